@@ -0,0 +1,444 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+os.environ.setdefault('YANDEX_API_KEY', 'benchmark')
+os.environ.setdefault('YANDEX_FOLDER_ID', 'benchmark')
+
+from config import Config, config  # noqa: E402
+
+ADMIN_ID = 1
+WORDS = [
+    "мониторинг", "активность", "безопасность", "риск", "сотрудник", "анализ", "угроза", "информация",
+    "конфиденциальность", "система", "оценка", "данные", "сеть", "доступ", "политика", "инцидент",
+    "журнал", "событие", "утечка", "контроль", "модель", "текст", "поведение", "аномалия", "пользователь",
+    "NLP", "почта", "сообщение", "сервер", "устройство", "агент", "отчет", "правило", "уведомление",
+]
+QUESTION_TEMPLATES = [
+    "Как работает {} {}?", "Что такое {} и {}?", "Зачем нужен {} для {}?",
+    "Как оценить {} {}?", "Какие есть инструменты {} {}?",
+]
+
+
+class YandexGPTStub:
+    def __init__(self, latency: float, jitter: float, error_rate: float, chunks: int = 5):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.requests = 0
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/foundationModels/v1/completion"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, '127.0.0.1', 0)
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self._complete(json.loads(body))
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode('latin-1') + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _complete(self, request: dict):
+        self.requests += 1
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+        if random.random() < self.error_rate:
+            return "500 Internal Server Error", b'{"error": "stub failure"}'
+
+        question = request['messages'][-1]['text']
+        text = f"Ответ заглушки на вопрос: {question}. " * 3
+        if not request['completionOptions'].get('stream'):
+            return "200 OK", json.dumps(self._alternative(text, 'ALTERNATIVE_STATUS_FINAL')).encode()
+
+        step = max(1, len(text) // self.chunks)
+        lines = [
+            json.dumps(self._alternative(text[:end], 'ALTERNATIVE_STATUS_PARTIAL'))
+            for end in range(step, len(text), step)
+        ]
+        lines.append(json.dumps(self._alternative(text, 'ALTERNATIVE_STATUS_FINAL')))
+        return "200 OK", ("\n".join(lines) + "\n").encode()
+
+    @staticmethod
+    def _alternative(text: str, status: str) -> dict:
+        return {"result": {"alternatives": [{"message": {"role": "assistant", "text": text}, "status": status}]}}
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.first_name = f"user{user_id}"
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, text: str = "", reply_to_message=None, chat_id: int = 0):
+        self.text = text
+        self.reply_to_message = reply_to_message
+        self.chat_id = chat_id
+        self.message_id = next(FakeMessage._ids)
+        self.replies: List["FakeMessage"] = []
+        self.edits = 0
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        reply = FakeMessage(text, reply_to_message=self, chat_id=self.chat_id)
+        self.replies.append(reply)
+        return reply
+
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        self.text = text
+        self.edits += 1
+        return self
+
+
+class FakeUpdate:
+    def __init__(self, user_id: int, text: str):
+        # У каждого пользователя свой личный чат, как в Telegram: иначе лимит на чат выстроит весь прогон в очередь.
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = FakeChat(user_id)
+        self.message = FakeMessage(text, chat_id=user_id)
+        self.callback_query = None
+
+
+class FakeContext:
+    def __init__(self):
+        self.user_data: Dict = {}
+        self.chat_data: Dict = {}
+        self.args: List[str] = []
+        self.error = None
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class StageRecorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.wall_time: Dict[str, float] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def measure(self, stage: str, func: Callable, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.record(stage, time.perf_counter() - start)
+        return result
+
+    async def measure_async(self, stage: str, coroutine):
+        start = time.perf_counter()
+        result = await coroutine
+        self.record(stage, time.perf_counter() - start)
+        return result
+
+    def report(self) -> Dict[str, dict]:
+        report = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            wall_time = self.wall_time.get(stage, sum(ordered))
+            report[stage] = {
+                'count': len(ordered),
+                'throughput_per_s': len(ordered) / wall_time if wall_time else 0.0,
+                'p50_ms': percentile(ordered, 0.50) * 1000,
+                'p95_ms': percentile(ordered, 0.95) * 1000,
+                'p99_ms': percentile(ordered, 0.99) * 1000,
+                'max_ms': ordered[-1] * 1000,
+            }
+        return report
+
+
+def random_question(rng: random.Random) -> str:
+    return rng.choice(QUESTION_TEMPLATES).format(*rng.sample(WORDS, 2))
+
+
+def generate_knowledge_base(size: int, seed: int = 0) -> Dict[str, List[str]]:
+    rng = random.Random(seed)
+    base: Dict[str, List[str]] = {}
+    for i in range(size):
+        answer = f"Ответ {i // 3}: " + " ".join(rng.sample(WORDS, 8))
+        base.setdefault(answer, []).append(f"{random_question(rng)} {rng.choice(WORDS)} #{i}")
+    return base
+
+
+def write_knowledge_base(base: Dict[str, List[str]], directory: Path) -> Path:
+    path = directory / "knowledge_base.json"
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(base, f, ensure_ascii=False)
+    return path
+
+
+async def bench_stages(recorder: StageRecorder, knowledge_base, questions: List[str]) -> None:
+    from utils import check_message_limit, is_on_topic
+    from yandex_gpt import yandex_gpt
+
+    for stage, func in (
+        ('rate_limit', lambda i, q: check_message_limit(1_000_000 + i)),
+        ('topic_filter', lambda i, q: is_on_topic(q)),
+        ('kb_lookup', lambda i, q: knowledge_base.find_answer(q)),
+    ):
+        start = time.perf_counter()
+        for i, question in enumerate(questions):
+            recorder.measure(stage, func, i, question)
+        recorder.wall_time[stage] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        recorder.measure_async('llm', yandex_gpt.ask(f"{question} #{i}"))
+        for i, question in enumerate(questions)
+    ))
+    recorder.wall_time['llm'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i, question in enumerate(questions):
+        recorder.measure('persistence', knowledge_base.add_question_answer, f"{question} #{i}", f"Ответ {i}")
+    recorder.measure('persistence_save', knowledge_base.save)
+    recorder.wall_time['persistence'] = time.perf_counter() - start
+
+
+async def bench_handlers(recorder: StageRecorder, bot_handlers, questions: List[str], concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle(i: int, question: str):
+        async with semaphore:
+            await recorder.measure_async(
+                'handle_message', bot_handlers.handle_message(FakeUpdate(2_000_000 + i, question), FakeContext())
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handle(i, question) for i, question in enumerate(questions)))
+    recorder.wall_time['handle_message'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i, question in enumerate(questions[:max(1, len(questions) // 10)]):
+        context = FakeContext()
+        update = FakeUpdate(3_000_000 + i, "/add_question")
+        update.effective_user.id = ADMIN_ID
+        await recorder.measure_async('add_question', _add_question(bot_handlers, update, context, question, i))
+    recorder.wall_time['add_question'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(10):
+        await recorder.measure_async('show_db', bot_handlers.show_db(FakeUpdate(ADMIN_ID, "/show_db"), FakeContext()))
+    recorder.wall_time['show_db'] = time.perf_counter() - start
+
+
+async def _add_question(bot_handlers, update, context, question: str, i: int):
+    await bot_handlers.add_question_command(update, context)
+    update.message = FakeMessage(f"{question} админ #{i} | Ответ администратора {i}", chat_id=update.effective_chat.id)
+    await bot_handlers.receive_question_answer(update, context)
+
+
+async def run_size(size: int, args) -> dict:
+    from feedback_store import FeedbackStore
+    from knowledge_base import KnowledgeBase
+    from main import BotHandlers
+    from yandex_gpt import yandex_gpt
+
+    rng = random.Random(size)
+    questions = [random_question(rng) for _ in range(args.requests)]
+    recorder = StageRecorder()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_knowledge_base(generate_knowledge_base(size), Path(directory))
+        knowledge_base = recorder.measure('kb_load', KnowledgeBase, path)
+        feedback = FeedbackStore(Path(directory) / "feedback.jsonl")
+        feedback.start()
+        knowledge_base.feedback = feedback
+
+        await bench_stages(recorder, knowledge_base, questions)
+        await bench_handlers(recorder, BotHandlers(knowledge_base, feedback), questions, args.concurrency)
+        feedback.close()
+        knowledge_base.close()
+
+    return {
+        'kb_size': size,
+        'stages': recorder.report(),
+        'llm_cache': yandex_gpt.cache.stats(),
+    }
+
+
+async def run(args) -> dict:
+    from yandex_gpt import yandex_gpt
+
+    logging.getLogger().setLevel(logging.WARNING)
+    Config.ADMIN_IDS = [ADMIN_ID]
+    Config.MESSAGE_LIMIT_SECONDS = 0.001
+    # Telegram здесь поддельный, его лимиты на отправку замеряли бы только ожидание в очереди, а не конвейер.
+    Config.SEND_GLOBAL_RATE = 1_000_000.0
+    Config.SEND_CHAT_INTERVAL = 1e-6
+    Config.YANDEX_GPT_STREAM = args.stream
+    Config.AUTO_SAVE_LLM_ANSWERS = True
+    Config.JOURNAL_FSYNC_BATCH = args.fsync_batch
+
+    stub = await YandexGPTStub(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate).start()
+    yandex_gpt.url = stub.url
+    try:
+        results = [await run_size(size, args) for size in args.sizes]
+    finally:
+        await yandex_gpt.close()
+        await stub.stop()
+
+    return {
+        'commit': _git_commit(),
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        'stub_requests': stub.requests,
+        'results': results,
+    }
+
+
+def bench_startup(args) -> dict:
+    from knowledge_base import KnowledgeBase
+
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_knowledge_base(generate_knowledge_base(size), Path(directory))
+            result = {'kb_size': size}
+            # Первый запуск разбирает JSON и пишет бинарный снимок, второй читает снимок.
+            for name in ('json_load_s', 'snapshot_load_s'):
+                start = time.perf_counter()
+                knowledge_base = KnowledgeBase(path)
+                result[name] = time.perf_counter() - start
+                knowledge_base.close()
+            result['snapshot_bytes'] = path.with_suffix('.snapshot').stat().st_size
+            results.append(result)
+
+    return {
+        'commit': _git_commit(),
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'import_main_s': _import_time('main'),
+        'results': results,
+    }
+
+
+def _import_time(module: str):
+    try:
+        output = subprocess.run(
+            [sys.executable, '-c', f"import time; start = time.perf_counter(); import {module}; "
+                                   f"print(time.perf_counter() - start)"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout
+        return float(output.strip().splitlines()[-1])
+    except Exception as e:
+        logging.warning(f"Could not measure import time of {module}: {e}")
+        return None
+
+
+def print_startup_report(report: dict) -> None:
+    if report['import_main_s'] is not None:
+        print(f"import main: {report['import_main_s'] * 1000:.1f} ms")
+    print(f"{'kb size':>10}{'json load ms':>16}{'snapshot load ms':>20}{'snapshot MB':>14}")
+    for result in report['results']:
+        print(
+            f"{result['kb_size']:>10}{result['json_load_s'] * 1000:>16.1f}"
+            f"{result['snapshot_load_s'] * 1000:>20.1f}{result['snapshot_bytes'] / 2 ** 20:>14.1f}"
+        )
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def print_report(report: dict) -> None:
+    for result in report['results']:
+        print(f"\nKB size: {result['kb_size']}")
+        print(f"{'stage':<18}{'count':>8}{'ops/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage, stats in result['stages'].items():
+            print(
+                f"{stage:<18}{stats['count']:>8}{stats['throughput_per_s']:>12.1f}"
+                f"{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+            )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay benchmark for the bot message pipeline")
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[1000, 10000, 100000], help="comma-separated KB sizes, up to 1000000")
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=200.0)
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--fsync-batch', type=int, default=config.JOURNAL_FSYNC_BATCH)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--startup', action='store_true', help="measure cold start instead of the message pipeline")
+    parser.add_argument('--output', type=Path, help="write machine-readable JSON results here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.startup:
+        report = bench_startup(args)
+        print_startup_report(report)
+    else:
+        report = asyncio.run(run(args))
+        print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
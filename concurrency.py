@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import config
+from metrics import UPDATES_DROPPED
+from profiler import record_stage, slow_updates
+
+logger = logging.getLogger(__name__)
+
+
+class LLMBusyError(Exception):
+    pass
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int, max_pending_per_chat: int = config.MAX_PENDING_UPDATES_PER_CHAT):
+        super().__init__(max_concurrent_updates)
+        self.max_pending_per_chat = max_pending_per_chat
+        self.dropped = 0
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._chat_pending: Dict[Hashable, int] = {}
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._chat_locks)
+
+    @staticmethod
+    def _chat_key(update: object) -> Optional[Hashable]:
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        # Трасса открывается до ожидания очереди чата, так что медленное обновление видно вместе с этим ожиданием.
+        async with slow_updates.trace(update):
+            await self._process_in_order(update, coroutine)
+
+    async def _process_in_order(self, update: object, coroutine) -> None:
+        key = self._chat_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        # process_update держит слот общего семафора и пока обновление ждёт очереди своего чата.
+        # Без предела один заваливающий сообщениями чат занял бы все слоты и остановил остальные чаты.
+        if self._chat_pending.get(key, 0) >= self.max_pending_per_chat:
+            self.dropped += 1
+            UPDATES_DROPPED.inc()
+            logger.warning(f"Chat {key} has {self.max_pending_per_chat} updates pending, dropping update")
+            coroutine.close()
+            return
+
+        lock = self._chat_locks.get(key)
+        if lock is None:
+            lock = self._chat_locks[key] = asyncio.Lock()
+        self._chat_pending[key] = self._chat_pending.get(key, 0) + 1
+
+        try:
+            # asyncio.Lock обслуживает ожидающих по очереди, так что порядок в чате сохраняется.
+            start = time.perf_counter()
+            async with lock:
+                record_stage('chat_wait', time.perf_counter() - start)
+                await coroutine
+        finally:
+            self._chat_pending[key] -= 1
+            if not self._chat_pending[key]:
+                del self._chat_pending[key]
+                del self._chat_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class ConcurrencyGate:
+    def __init__(self, limit: int, max_waiting: int):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise LLMBusyError(f"{self.waiting} requests already waiting")
+
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        record_stage('llm_wait', time.perf_counter() - start)
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
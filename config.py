@@ -14,9 +14,32 @@ class Config:
 
     ADMIN_IDS = [int(id_str) for id_str in os.getenv('ADMIN_IDS' , '').split(',') if id_str]
 
+    KB_BACKEND = os.getenv('KB_BACKEND', 'json')
     KNOWLEDGE_BASE_FILE = BASE_DIR / "knowledge_base.json"
+    KNOWLEDGE_BASE_DB_FILE = Path(os.getenv('KNOWLEDGE_BASE_DB_FILE', BASE_DIR / "knowledge_base.db"))
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+    JOURNAL_FSYNC_BATCH = 32
+    JOURNAL_FSYNC_INTERVAL = 1.0
+    JOURNAL_COMPACT_THRESHOLD = 1000
+    KB_BINARY_SNAPSHOT = os.getenv('KB_BINARY_SNAPSHOT', '1') == '1'
+    KB_PUBLISH_DELAY = 0.2
+    KB_RELOAD_INTERVAL = float(os.getenv('KB_RELOAD_INTERVAL', '5'))
+    NEAR_DUP_ENABLED = os.getenv('NEAR_DUP_ENABLED', '1') == '1'
+    NEAR_DUP_THRESHOLD = float(os.getenv('NEAR_DUP_THRESHOLD', '0.7'))
+    NEAR_DUP_NUM_PERM = 32
+    NEAR_DUP_BANDS = 8
+    NEAR_DUP_SHINGLE_SIZE = 2
     SIMILARITY_THRESHOLD = 0.7
+    SHOW_DB_PAGE_SIZE = 10
+    SHOW_DB_SEARCH_LIMIT = 1000
+    SHOW_DB_SNIPPET_LENGTH = 300
     MESSAGE_LIMIT_SECONDS = 10
+    RATE_LIMIT_BURST = 3
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_DB_FILE = Path(os.getenv('RATE_LIMIT_DB_FILE', BASE_DIR / "rate_limits.db"))
+    SENTIMENT_ANALYZER = os.getenv('SENTIMENT_ANALYZER', 'lexicon')
+    SENTIMENT_CACHE_SIZE = 10000
+    SENTIMENT_WORKERS = 2
     TOPIC_KEYWORDS = [
         "мониторинг" , "активность" , "безопасность" , "риск" , "сотрудник" ,
         "анализ" , "NLP" , "угроза" , "информация" , "конфиденциальность"
@@ -25,15 +48,103 @@ class Config:
     Отвечай только на вопросы по этой теме. Отвечай кратко и точно на русском языке. 
     Если вопрос не по теме, вежливо сообщи, что не можешь помочь."""
     YANDEX_GPT_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+    YANDEX_GPT_TEMPERATURE = 0.5
+    YANDEX_GPT_MAX_TOKENS = 1000
+    YANDEX_GPT_STREAM = os.getenv('YANDEX_GPT_STREAM', '1') == '1'
+    YANDEX_GPT_HTTP2 = True
+    YANDEX_GPT_TIMEOUT = 10.0
+    YANDEX_GPT_CONNECT_TIMEOUT = 5.0
+    YANDEX_GPT_POOL_TIMEOUT = 5.0
+    YANDEX_GPT_MAX_CONNECTIONS = int(os.getenv('YANDEX_GPT_MAX_CONNECTIONS', '100'))
+    YANDEX_GPT_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('YANDEX_GPT_MAX_KEEPALIVE_CONNECTIONS', '20'))
+    YANDEX_GPT_KEEPALIVE_EXPIRY = 60.0
+    YANDEX_GPT_DEADLINE = 20.0
+    YANDEX_GPT_STREAM_DEADLINE = 60.0
+    YANDEX_GPT_MAX_RETRIES = 2
+    YANDEX_GPT_BACKOFF_BASE = 0.25
+    YANDEX_GPT_BACKOFF_MAX = 4.0
+    YANDEX_GPT_HEDGE = os.getenv('YANDEX_GPT_HEDGE', '0') == '1'
+    CIRCUIT_FAILURE_THRESHOLD = 5
+    CIRCUIT_RECOVERY_TIMEOUT = 30.0
 
+    MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '256'))
+    MAX_PENDING_UPDATES_PER_CHAT = int(os.getenv('MAX_PENDING_UPDATES_PER_CHAT', '5'))
+    LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '20'))
+    LLM_MAX_WAITING = int(os.getenv('LLM_MAX_WAITING', '100'))
+
+    LLM_CACHE_SIZE = 5000
+    LLM_CACHE_TTL = 24 * 60 * 60
+    LLM_CACHE_FILE = os.getenv('LLM_CACHE_FILE') or None
+    # Непроверенные ответы модели попадают в базу знаний только если это явно включено.
+    AUTO_SAVE_LLM_ANSWERS = os.getenv('AUTO_SAVE_LLM_ANSWERS', '0') == '1'
+
+    FEEDBACK_FILE = Path(os.getenv('FEEDBACK_FILE', BASE_DIR / "feedback.jsonl"))
+    FEEDBACK_BACKEND = os.getenv('FEEDBACK_BACKEND', 'file')
+    FEEDBACK_DB_FILE = Path(os.getenv('FEEDBACK_DB_FILE', BASE_DIR / "feedback.db"))
+    FEEDBACK_BUFFER_SIZE = 10000
+    FEEDBACK_BATCH_SIZE = 500
+    FEEDBACK_FLUSH_INTERVAL = 2.0
+    FEEDBACK_MAX_BYTES = 10 * 1024 * 1024
+    FEEDBACK_BACKUPS = 5
+    FEEDBACK_PRIOR_WEIGHT = 5.0
+    FEEDBACK_RANK_WEIGHT = 0.2
+
+    PREWARM_CONCURRENCY = int(os.getenv('PREWARM_CONCURRENCY', '8'))
+    PREWARM_CHECKPOINT_EVERY = 100
+    PREWARM_PROGRESS_INTERVAL = 10.0
+    PREWARM_DEDUP_SIZE = 100000
+
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+    WORKER_HEARTBEAT_INTERVAL = 2.0
+    WORKER_HEARTBEAT_TIMEOUT = 15.0
+    WORKER_STOP_TIMEOUT = 30.0
+    WORKER_RESTART_BACKOFF = 1.0
+    WORKER_RESTART_BACKOFF_MAX = 30.0
+    ROUTER_POLL_TIMEOUT = 30
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+    WEBHOOK_MAX_CONNECTIONS = 100
+
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+    SLOW_UPDATE_THRESHOLD = float(os.getenv('SLOW_UPDATE_THRESHOLD', '2.0'))
+    SLOW_UPDATE_TRACE_SIZE = 100
+    SLOW_UPDATE_DUMP_SIZE = 10
+    PROFILE_DEFAULT_SECONDS = 10
+    PROFILE_MAX_SECONDS = 120
+    PROFILE_INTERVAL = 0.005
+    PROFILE_TOP_FUNCTIONS = 20
+
+    STREAM_EDIT_INTERVAL = 1.0
+    SEND_GLOBAL_RATE = 30.0
+    SEND_GLOBAL_BURST = 30
+    SEND_CHAT_INTERVAL = 1.0
+    SEND_CHAT_BURST = 3
+    SEND_MAX_RETRIES = 3
+    TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+    @classmethod
+    def set_topic_keywords(cls, keywords):
+        cls.TOPIC_KEYWORDS = list(keywords)
 
     @classmethod
     def validate (cls):
         required = ['TELEGRAM_TOKEN' , 'YANDEX_API_KEY' , 'YANDEX_FOLDER_ID']
+        if cls.BOT_MODE == 'webhook':
+            # Без WEBHOOK_URL PTB зарегистрировал бы адрес слушателя, и setWebhook упал бы при старте;
+            # для локального прогона без регистрации есть BOT_MODE=webhook_local.
+            required.extend(['WEBHOOK_URL', 'WEBHOOK_SECRET'])
+        elif cls.BOT_MODE not in ('polling', 'webhook_local'):
+            raise ValueError(f"Неизвестный BOT_MODE: {cls.BOT_MODE}")
         for var in required:
             if not getattr(cls , var):
                 raise ValueError(f"Не задана обязательная переменная: {var}")
 
 
 config = Config()
-Config.validate()
@@ -0,0 +1,151 @@
+import itertools
+from array import array
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Контейнеры для версий базы знаний: копия делит с оригиналом блоки и копирует блок только при первой
+# записи в него. Публикация версии стоит O(число блоков), а не O(размер базы).
+CHUNK_BITS = 10
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+SHARDS = 256
+SHARD_MASK = SHARDS - 1
+_MISSING = object()
+
+
+class ChunkedList:
+    # Список блоками по CHUNK_SIZE элементов; typecode - тип элементов array, None - обычные списки.
+    __slots__ = ('typecode', '_chunks', '_length', '_owned')
+
+    def __init__(self, items: Iterable = (), typecode: Optional[str] = None):
+        self.typecode = typecode
+        self._chunks: List = []
+        self._length = 0
+        # Номера блоков, принадлежащих этой копии; None - все.
+        self._owned: Optional[Set[int]] = None
+        for item in items:
+            self.append(item)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator:
+        return itertools.chain.from_iterable(self._chunks)
+
+    def __reversed__(self) -> Iterator:
+        return itertools.chain.from_iterable(reversed(chunk) for chunk in reversed(self._chunks))
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('ChunkedList index out of range')
+        return self._chunks[index >> CHUNK_BITS][index & CHUNK_MASK]
+
+    def __setitem__(self, index: int, value) -> None:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('ChunkedList assignment index out of range')
+        self._writable(index >> CHUNK_BITS)[index & CHUNK_MASK] = value
+
+    def append(self, value) -> None:
+        number = self._length >> CHUNK_BITS
+        if number == len(self._chunks):
+            self._chunks.append(array(self.typecode) if self.typecode else [])
+            if self._owned is not None:
+                self._owned.add(number)
+        self._writable(number).append(value)
+        self._length += 1
+
+    def _writable(self, number: int):
+        if self._owned is not None and number not in self._owned:
+            self._chunks[number] = self._chunks[number][:]
+            self._owned.add(number)
+        return self._chunks[number]
+
+    def copy(self) -> 'ChunkedList':
+        chunked = ChunkedList.__new__(ChunkedList)
+        chunked.typecode = self.typecode
+        chunked._chunks = self._chunks[:]
+        chunked._length = self._length
+        chunked._owned = set()
+        # Оригинал тоже перестаёт быть единственным владельцем блоков.
+        self._owned = set()
+        return chunked
+
+    def __getstate__(self):
+        return self.typecode, self._chunks, self._length
+
+    def __setstate__(self, state):
+        self.typecode, self._chunks, self._length = state
+        self._owned = None
+
+
+class ShardedDict:
+    # Словарь из SHARDS частей по хешу ключа. Хеш строк меняется от процесса к процессу,
+    # поэтому в снимок словарь пишется плоским и раскладывается по частям заново при чтении.
+    __slots__ = ('_shards', '_length', '_owned')
+
+    def __init__(self, items: Iterable[Tuple[Hashable, object]] = ()):
+        self._shards: List[Dict] = [{} for _ in range(SHARDS)]
+        self._length = 0
+        self._owned: Optional[Set[int]] = None
+        for key, value in items:
+            self[key] = value
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator:
+        return itertools.chain.from_iterable(self._shards)
+
+    def __contains__(self, key) -> bool:
+        return key in self._shards[hash(key) & SHARD_MASK]
+
+    def __getitem__(self, key):
+        return self._shards[hash(key) & SHARD_MASK][key]
+
+    def get(self, key, default=None):
+        return self._shards[hash(key) & SHARD_MASK].get(key, default)
+
+    def __setitem__(self, key, value) -> None:
+        shard = self._writable(hash(key) & SHARD_MASK)
+        if key not in shard:
+            self._length += 1
+        shard[key] = value
+
+    def setdefault(self, key, default=None):
+        number = hash(key) & SHARD_MASK
+        value = self._shards[number].get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        self._writable(number)[key] = default
+        self._length += 1
+        return default
+
+    def items(self) -> Iterator[Tuple[Hashable, object]]:
+        return itertools.chain.from_iterable(shard.items() for shard in self._shards)
+
+    def _writable(self, number: int) -> Dict:
+        if self._owned is not None and number not in self._owned:
+            self._shards[number] = self._shards[number].copy()
+            self._owned.add(number)
+        return self._shards[number]
+
+    def copy(self) -> 'ShardedDict':
+        sharded = ShardedDict.__new__(ShardedDict)
+        sharded._shards = self._shards[:]
+        sharded._length = self._length
+        sharded._owned = set()
+        self._owned = set()
+        return sharded
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        self._shards = [{} for _ in range(SHARDS)]
+        self._owned = None
+        for key, value in state.items():
+            self._shards[hash(key) & SHARD_MASK][key] = value
+        self._length = len(state)
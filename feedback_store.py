@@ -0,0 +1,287 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import config
+from journal import write_atomic_json
+from kb_store import answer_digest
+
+logger = logging.getLogger(__name__)
+
+HELPFUL = 'helpful'
+UNHELPFUL = 'unhelpful'
+
+
+def answer_key(answer: str) -> str:
+    # Ключ по содержимому ответа одинаков для обоих бэкендов базы и помещается в callback_data.
+    return answer_digest(answer.encode('utf-8')).hex()
+
+
+class AnswerFeedback:
+    __slots__ = ('helpful', 'total')
+
+    def __init__(self, helpful: int = 0, total: int = 0):
+        self.helpful = helpful
+        self.total = total
+
+    def helpful_rate(self, prior_weight: float) -> float:
+        # Сглаживаем к 0.5, чтобы единственная оценка не перевешивала близость вопроса.
+        return (self.helpful + 0.5 * prior_weight) / (self.total + prior_weight)
+
+
+class SqliteFeedbackAggregates:
+    # Общие итоги оценок для нескольких процессов бота; каждый процесс прибавляет свои приращения.
+    def __init__(self, file_path: Path):
+        self.file_path = Path(file_path)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.file_path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answer_feedback (
+                answer TEXT PRIMARY KEY,
+                helpful INTEGER NOT NULL,
+                total INTEGER NOT NULL
+            );
+        """)
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM answer_feedback").fetchone()[0]
+
+    def add(self, deltas: Dict[str, AnswerFeedback]):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO answer_feedback (answer, helpful, total) VALUES (?, ?, ?) "
+                    "ON CONFLICT (answer) DO UPDATE SET helpful = helpful + excluded.helpful, "
+                    "total = total + excluded.total",
+                    [(key, stats.helpful, stats.total) for key, stats in deltas.items()]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def load(self) -> Dict[str, AnswerFeedback]:
+        with self._lock:
+            rows = self.conn.execute("SELECT answer, helpful, total FROM answer_feedback").fetchall()
+        return {key: AnswerFeedback(helpful, total) for key, helpful, total in rows}
+
+    def close(self):
+        self.conn.close()
+
+
+class FeedbackStore:
+    def __init__(self, path: Path, capacity: int = config.FEEDBACK_BUFFER_SIZE,
+                 batch_size: int = config.FEEDBACK_BATCH_SIZE,
+                 flush_interval: float = config.FEEDBACK_FLUSH_INTERVAL,
+                 max_bytes: int = config.FEEDBACK_MAX_BYTES, backups: int = config.FEEDBACK_BACKUPS,
+                 shared: Optional[SqliteFeedbackAggregates] = None):
+        self.path = Path(path)
+        self.aggregates_path = self.path.with_name(self.path.name + '.aggregates')
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        # deque с maxlen - кольцевой буфер: append не блокирует обработчик, при переполнении
+        # вытесняется самое старое событие.
+        self._buffer: deque = deque(maxlen=capacity)
+        self.aggregates: Dict[str, AnswerFeedback] = {}
+        # С общими итогами локальные оценки копятся в _deltas, пока писатель не перенесёт их в SQLite.
+        self.shared = shared
+        self._deltas: Dict[str, AnswerFeedback] = {}
+        self.dropped = 0
+        self.written = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def _load(self):
+        try:
+            if self.aggregates_path.exists():
+                with open(self.aggregates_path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+                self._seq = snapshot['seq']
+                self.aggregates = {key: AnswerFeedback(*value) for key, value in snapshot['answers'].items()}
+            # Итоги покрывают события до seq включительно, остальное досчитываем из текущего файла.
+            if self.path.exists():
+                covered = self._seq
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            event = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if event['seq'] > covered:
+                            self._aggregate(event, self.aggregates)
+                        self._seq = max(self._seq, event['seq'])
+        except Exception as e:
+            logger.error(f"Ошибка загрузки обратной связи: {e}")
+
+        if self.shared is not None:
+            # Итоги файла этого процесса уже учтены в общей базе; ранжируем по общим.
+            try:
+                self.aggregates = self.shared.load()
+            except Exception as e:
+                logger.error(f"Ошибка загрузки общих итогов обратной связи: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='feedback-writer', daemon=True)
+            self._thread.start()
+
+    def record(self, event_type: str, user_id: int, answer: Optional[str] = None, text: Optional[str] = None):
+        event = {'ts': time.time(), 'user': user_id, 'type': event_type}
+        if answer is not None:
+            event['answer'] = answer
+        if text is not None:
+            event['text'] = text
+
+        with self._lock:
+            self._seq += 1
+            event['seq'] = self._seq
+            self._aggregate(event, self.aggregates)
+            if self.shared is not None:
+                self._aggregate(event, self._deltas)
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(event)
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    @staticmethod
+    def _aggregate(event: dict, aggregates: Dict[str, AnswerFeedback]):
+        key = event.get('answer')
+        if key is None or event['type'] not in (HELPFUL, UNHELPFUL):
+            return
+        stats = aggregates.get(key)
+        if stats is None:
+            stats = aggregates[key] = AnswerFeedback()
+        stats.total += 1
+        if event['type'] == HELPFUL:
+            stats.helpful += 1
+
+    def weight(self, key: str) -> float:
+        # Множитель к близости вопроса: 1.0 без оценок, от 1 - FEEDBACK_RANK_WEIGHT до 1 + FEEDBACK_RANK_WEIGHT.
+        stats = self.aggregates.get(key)
+        if stats is None:
+            return 1.0
+        return 1.0 + config.FEEDBACK_RANK_WEIGHT * (2 * stats.helpful_rate(config.FEEDBACK_PRIOR_WEIGHT) - 1)
+
+    def rank(self, candidates: Iterable[Tuple[str, float]]) -> Tuple[Optional[str], float]:
+        # Выбираем с учётом оценок, но возвращаем исходную близость: порог сравнивается с ней.
+        best_answer, best_score, best_rank = None, 0.0, 0.0
+        for answer, score in candidates:
+            rank = score * self.weight(answer_key(answer))
+            if rank > best_rank:
+                best_answer, best_score, best_rank = answer, score, rank
+        return best_answer, best_score
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            self.sync_shared()
+
+    def sync_shared(self):
+        # Отдаём свои приращения и забираем итоги остальных процессов.
+        if self.shared is None:
+            return
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        try:
+            if deltas:
+                self.shared.add(deltas)
+            aggregates = self.shared.load()
+        except Exception as e:
+            logger.error(f"Ошибка синхронизации итогов обратной связи: {e}")
+            with self._lock:
+                for key, stats in deltas.items():
+                    pending = self._deltas.setdefault(key, AnswerFeedback())
+                    pending.helpful += stats.helpful
+                    pending.total += stats.total
+            return
+
+        with self._lock:
+            # Оценки, пришедшие во время синхронизации, ещё не в базе - добавляем их поверх.
+            for key, stats in self._deltas.items():
+                merged = aggregates.setdefault(key, AnswerFeedback())
+                merged.helpful += stats.helpful
+                merged.total += stats.total
+            self.aggregates = aggregates
+
+    def flush(self):
+        while self._buffer:
+            batch: List[dict] = []
+            while self._buffer and len(batch) < self.batch_size:
+                batch.append(self._buffer.popleft())
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Ошибка записи обратной связи: {e}")
+                self._buffer.extendleft(reversed(batch))
+                return
+
+    def _write(self, batch: List[dict]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(event, ensure_ascii=False) + '\n' for event in batch)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        self.written += len(batch)
+        if size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        # Сначала сохраняем итоги, потом уводим файл: после перезапуска его события уже учтены в итогах,
+        # а ещё не записанные события с seq не больше сохранённого не будут посчитаны второй раз.
+        with self._lock:
+            snapshot = {
+                'seq': self._seq,
+                'answers': {key: (stats.helpful, stats.total) for key, stats in self.aggregates.items()}
+            }
+        write_atomic_json(self.aggregates_path, snapshot)
+        for number in range(self.backups - 1, 0, -1):
+            backup = self.path.with_name(f"{self.path.name}.{number}")
+            if backup.exists():
+                os.replace(backup, self.path.with_name(f"{self.path.name}.{number + 1}"))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            os.unlink(self.path)
+        logger.info(f"Файл обратной связи {self.path} ротирован")
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.sync_shared()
+        if self.shared is not None:
+            self.shared.close()
+
+
+def create_feedback_store() -> FeedbackStore:
+    shared = None
+    if config.FEEDBACK_BACKEND == 'sqlite':
+        shared = SqliteFeedbackAggregates(config.FEEDBACK_DB_FILE)
+    return FeedbackStore(config.FEEDBACK_FILE, shared=shared)
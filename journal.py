@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Iterator, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    # append только дописывает строку в файл; fsync делает поток journal-sync - сразу после
+    # fsync_batch записей или не позже чем через fsync_interval после записи, так что обработчики
+    # на цикле событий не ждут диска.
+    def __init__(self, path: Path, fsync_batch: int, fsync_interval: float):
+        self.path = Path(path)
+        self.rotated_path = self.path.with_name(self.path.name + '.compacting')
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.records = 0
+
+        self._file: Optional[TextIO] = None
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        # Держится на время fsync, чтобы rotate и close не закрыли файл под ним; append его не берёт.
+        self._sync_lock = threading.Lock()
+
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def append(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            self.records += 1
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='journal-sync', daemon=True)
+                self._thread.start()
+            if self._unsynced >= self.fsync_batch:
+                self._wake.set()
+
+    def sync(self) -> None:
+        with self._sync_lock:
+            with self._lock:
+                journal_file = self._file if self._unsynced else None
+                self._unsynced = 0
+            if journal_file is not None:
+                os.fsync(journal_file.fileno())
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.fsync_interval)
+            self._wake.clear()
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации журнала {self.path}: {e}")
+
+    def rotate(self) -> Path:
+        with self._sync_lock, self._lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+            if self.path.exists() and self.rotated_path.exists():
+                # Прошлое сжатие не завершилось: дописываем, чтобы не потерять его записи.
+                with open(self.rotated_path, 'a', encoding='utf-8') as rotated, \
+                        open(self.path, 'r', encoding='utf-8') as current:
+                    rotated.writelines(current)
+                    rotated.flush()
+                    os.fsync(rotated.fileno())
+                os.unlink(self.path)
+            elif self.path.exists():
+                os.replace(self.path, self.rotated_path)
+            self.records = 0
+            return self.rotated_path
+
+    def close(self) -> None:
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._sync_lock, self._lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self) -> TextIO:
+        torn_tail = False
+        if self.path.exists() and self.path.stat().st_size:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn_tail = f.read(1) != b'\n'
+
+        journal_file = open(self.path, 'a', encoding='utf-8')
+        if torn_tail:
+            journal_file.write('\n')
+        return journal_file
+
+    def _sync(self) -> None:
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def replay(self) -> Iterator[dict]:
+        for path in (self.rotated_path, self.path):
+            if not path.exists():
+                continue
+
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Пропущена повреждённая запись журнала {path}:{line_number}")
+                        continue
+                    self.records += 1
+
+
+def write_atomic_json(path: Path, data) -> None:
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
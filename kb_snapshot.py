@@ -0,0 +1,55 @@
+import gc
+import logging
+import mmap
+import os
+import pickle
+import struct
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'KBSNAP'
+VERSION = 7
+# magic, версия формата, размер и mtime исходного JSON, по которому собран снимок
+HEADER = struct.Struct('<6sHqq')
+
+
+def _source_stamp(source: Path):
+    stat = source.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_snapshot(path: Path, source: Path) -> Optional[dict]:
+    try:
+        if not path.exists() or not source.exists():
+            return None
+
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, size, mtime_ns = HEADER.unpack_from(mm)
+            if magic != MAGIC or version != VERSION or (size, mtime_ns) != _source_stamp(source):
+                logger.info(f"Бинарный снимок {path} устарел, пересобираем")
+                return None
+            # Снимок - это сотни тысяч мелких объектов; сборщик мусора на них только тратит время.
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                with memoryview(mm) as view:
+                    return pickle.loads(view[HEADER.size:])
+            finally:
+                if gc_enabled:
+                    gc.enable()
+
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать бинарный снимок {path}: {e}")
+        return None
+
+
+def write_snapshot(path: Path, source: Path, state: dict) -> None:
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, *_source_stamp(source)))
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
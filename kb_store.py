@@ -0,0 +1,165 @@
+import hashlib
+import zlib
+from array import array
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from cow_collections import ChunkedList, ShardedDict
+
+# Длинные ответы (сохранённые ответы GPT) храним сжатыми, короткие - как есть.
+COMPRESS_MIN_BYTES = 256
+DIGEST_SIZE = 16
+_RAW = b'\x00'
+_ZLIB = b'\x01'
+
+
+def answer_digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def pack_text(data: bytes) -> bytes:
+    if len(data) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return _ZLIB + compressed
+    return _RAW + data
+
+
+def unpack_text(blob: bytes) -> str:
+    data = zlib.decompress(blob[1:]) if blob[:1] == _ZLIB else blob[1:]
+    return data.decode('utf-8')
+
+
+class KBStore:
+    # Ответы адресуются по содержимому и хранятся один раз под целочисленным id, вопросы - плоским
+    # списком, id вопроса совпадает с id документа в поисковом индексе. Вопросы одного ответа
+    # связаны в список через question_next, так что на ответ не приходится ни одного лишнего объекта.
+    # Списки объектов и словари блочные: копия для новой версии базы не перебирает все элементы.
+    __slots__ = (
+        'answer_blobs', 'answer_first', 'answer_last', 'questions', 'question_answers', 'question_next',
+        '_answer_ids', '_question_answer', '_extra_pairs'
+    )
+
+    def __init__(self):
+        self.answer_blobs = ChunkedList()
+        self.answer_first = array('i')
+        self.answer_last = array('i')
+        self.questions = ChunkedList()
+        self.question_answers = array('i')
+        self.question_next = array('i')
+        self._answer_ids = ShardedDict()
+        # Вопрос -> id его первого ответа; тот же вопрос с другим ответом попадает в _extra_pairs.
+        self._question_answer = ShardedDict()
+        self._extra_pairs: Set[Tuple[str, int]] = set()
+
+    def __len__(self) -> int:
+        return len(self.answer_blobs)
+
+    @property
+    def question_count(self) -> int:
+        return len(self.questions)
+
+    def answer_id(self, answer: str) -> Optional[int]:
+        return self._answer_ids.get(answer_digest(answer.encode('utf-8')))
+
+    def contains(self, question: str, answer: str) -> bool:
+        answer_id = self.answer_id(answer)
+        return answer_id is not None and self._has_pair(question, answer_id)
+
+    def add(self, question: str, answer: str) -> Optional[int]:
+        data = answer.encode('utf-8')
+        digest = answer_digest(data)
+        answer_id = self._answer_ids.get(digest)
+        question_id = len(self.questions)
+
+        if answer_id is None:
+            answer_id = len(self.answer_blobs)
+            self.answer_blobs.append(pack_text(data))
+            self.answer_first.append(question_id)
+            self.answer_last.append(question_id)
+            self._answer_ids[digest] = answer_id
+        elif self._has_pair(question, answer_id):
+            return None
+        else:
+            self.question_next[self.answer_last[answer_id]] = question_id
+            self.answer_last[answer_id] = question_id
+
+        self.questions.append(question)
+        self.question_answers.append(answer_id)
+        self.question_next.append(-1)
+        self._link(question, answer_id)
+        return question_id
+
+    def answer_text(self, answer_id: int) -> str:
+        return unpack_text(self.answer_blobs[answer_id])
+
+    def answer_of(self, question_id: int) -> str:
+        return self.answer_text(self.question_answers[question_id])
+
+    def questions_of(self, answer_id: int) -> List[str]:
+        questions = []
+        question_id = self.answer_first[answer_id]
+        while question_id != -1:
+            questions.append(self.questions[question_id])
+            question_id = self.question_next[question_id]
+        return questions
+
+    def entry(self, answer_id: int) -> Tuple[str, List[str]]:
+        return self.answer_text(answer_id), self.questions_of(answer_id)
+
+    def items(self) -> Iterator[Tuple[str, List[str]]]:
+        for answer_id in range(len(self.answer_blobs)):
+            yield self.entry(answer_id)
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        return dict(self.items())
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, List[str]]) -> 'KBStore':
+        store = cls()
+        for answer, questions in data.items():
+            for question in questions:
+                store.add(question, answer)
+        return store
+
+    def copy(self) -> 'KBStore':
+        # Новые контейнеры для следующей версии базы: блоки общие до первой записи, массивы копируются целиком.
+        store = KBStore.__new__(KBStore)
+        store.answer_blobs = self.answer_blobs.copy()
+        store.answer_first = self.answer_first[:]
+        store.answer_last = self.answer_last[:]
+        store.questions = self.questions.copy()
+        store.question_answers = self.question_answers[:]
+        store.question_next = self.question_next[:]
+        store._answer_ids = self._answer_ids.copy()
+        store._question_answer = self._question_answer.copy()
+        store._extra_pairs = self._extra_pairs.copy()
+        return store
+
+    def _has_pair(self, question: str, answer_id: int) -> bool:
+        first = self._question_answer.get(question)
+        return first == answer_id or (first is not None and (question, answer_id) in self._extra_pairs)
+
+    def _link(self, question: str, answer_id: int):
+        if self._question_answer.setdefault(question, answer_id) != answer_id:
+            self._extra_pairs.add((question, answer_id))
+
+    def __getstate__(self):
+        digests: List[bytes] = [b''] * len(self.answer_blobs)
+        for digest, answer_id in self._answer_ids.items():
+            digests[answer_id] = digest
+        return (
+            digests, self.answer_blobs, self.answer_first, self.answer_last,
+            self.questions, self.question_answers, self.question_next
+        )
+
+    def __setstate__(self, state):
+        (digests, self.answer_blobs, self.answer_first, self.answer_last,
+         self.questions, self.question_answers, self.question_next) = state
+        self._answer_ids = ShardedDict(zip(digests, range(len(digests))))
+        # Первый ответ на вопрос побеждает, поэтому словарь строим с конца.
+        self._question_answer = ShardedDict(zip(reversed(self.questions), reversed(self.question_answers)))
+        self._extra_pairs = set()
+        if len(self._question_answer) != len(self.questions):
+            for question, answer_id in zip(self.questions, self.question_answers):
+                if self._question_answer[question] != answer_id:
+                    self._extra_pairs.add((question, answer_id))
@@ -1,17 +1,226 @@
 import json
 import logging
-from typing import Dict, List
+import os
+import threading
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 from pathlib import Path
 
+from config import config
+from metrics import KB_NEAR_DUPLICATES
+from profiler import stage
+from journal import Journal, write_atomic_json
+from kb_store import KBStore
+from near_duplicates import NearDuplicateIndex
+from kb_snapshot import read_snapshot, write_snapshot
+from search_index import SearchIndex
+from text_processing import tokenize
+
 logger = logging.getLogger(__name__)
 
 
+class KBPage(NamedTuple):
+    entries: List[Tuple[str, List[str]]]
+    prev_cursor: Optional[int]
+    next_cursor: Optional[int]
+
+
+class KBVersion(NamedTuple):
+    store: KBStore
+    index: SearchIndex
+
+
 class KnowledgeBase:
+    # Читатели берут опубликованную версию (store + index) без блокировок и больше её не видят
+    # изменённой: писатель под _lock копирует версию в черновик, копит в нём вставки и атомарно
+    # подменяет _version ссылкой на черновик.
     def __init__(self, file_path: str):
         self.file_path = Path(file_path)
-        self.base = self._initialize_knowledge_base()
+        self.journal = Journal(
+            self.file_path.with_suffix('.journal'),
+            fsync_batch=config.JOURNAL_FSYNC_BATCH,
+            fsync_interval=config.JOURNAL_FSYNC_INTERVAL
+        )
+        self._lock = threading.RLock()
+        self._compaction = None
+        self._compacting = False
+        self._draft: Optional[KBVersion] = None
+        self._publish_timer: Optional[threading.Timer] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._watcher_stop = threading.Event()
+        self._generation = 0
+        self.feedback = None
+
+        self.snapshot_path = self.file_path.with_suffix('.snapshot')
+        self._load()
+
+    def _load(self):
+        self._stamp = self._file_stamp()
+        self._install(self._read_state(self._load_snapshot))
+
+    def _read_state(self, load_data) -> dict:
+        state = read_snapshot(self.snapshot_path, self.file_path) if config.KB_BINARY_SNAPSHOT else None
+        if state is not None and not self._near_duplicates_fresh(state['near_duplicates']):
+            # Устаревший индекс похожих ответов просто отбрасываем: он построится заново при первом слиянии.
+            state['near_duplicates'] = None
+        if state is None:
+            state = self._build_state(load_data())
+            if config.KB_BINARY_SNAPSHOT and self.file_path.exists():
+                self._write_binary_snapshot(state)
+        return state
+
+    def _install(self, state: dict):
+        # Свежесобранное состояние ещё никто не читает, поэтому журнал накатываем прямо в него.
+        with self._lock:
+            self._generation += 1
+            self._draft = KBVersion(state['store'], state['index'])
+            self.near_duplicates: Optional[NearDuplicateIndex] = state['near_duplicates']
+            if self.near_duplicates is not None:
+                self.near_duplicates.threshold = config.NEAR_DUP_THRESHOLD
+
+            self.journal.records = 0
+            try:
+                for record in self.journal.replay():
+                    self._insert(record['q'], record['a'])
+            except Exception as e:
+                logger.error(f"Ошибка чтения журнала базы знаний: {e}")
+            self._publish()
+
+    @property
+    def store(self) -> KBStore:
+        return self._version.store
+
+    @property
+    def index(self) -> SearchIndex:
+        return self._version.index
+
+    def _draft_version(self) -> KBVersion:
+        # Черновик делит с опубликованной версией блоки списков и части словарей (cow_collections) и копирует
+        # только те, в которые пишет; целиком копируются лишь числовые массивы. Частые автосохранения
+        # всё равно копятся KB_PUBLISH_DELAY в одну версию.
+        if self._draft is None:
+            self._draft = KBVersion(self._version.store.copy(), self._version.index.copy())
+        return self._draft
+
+    def _publish(self):
+        with self._lock:
+            if self._publish_timer is not None:
+                self._publish_timer.cancel()
+                self._publish_timer = None
+            if self._draft is not None:
+                self._version = self._draft
+                self._draft = None
+
+    def _schedule_publish(self):
+        # Вставки, пришедшие за KB_PUBLISH_DELAY, попадают в одну версию и одно копирование.
+        if config.KB_PUBLISH_DELAY <= 0:
+            self._publish()
+        elif self._publish_timer is None:
+            self._publish_timer = threading.Timer(config.KB_PUBLISH_DELAY, self._publish)
+            self._publish_timer.daemon = True
+            self._publish_timer.start()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.file_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def reload_if_changed(self) -> bool:
+        stamp = self._file_stamp()
+        if self._compacting or stamp is None or stamp == self._stamp:
+            return False
+
+        logger.info(f"Файл базы знаний {self.file_path} изменён, перечитываем")
+        try:
+            # Собираем новое состояние в стороне: поиск всё это время работает по текущей версии.
+            state = self._read_state(self._read_json)
+        except Exception as e:
+            logger.error(f"Не удалось перечитать базу знаний: {e}")
+            self._stamp = stamp
+            return False
+
+        with self._lock:
+            if self._compacting or self._file_stamp() != stamp:
+                # Файл успел измениться ещё раз (или его переписало наше сжатие), дождёмся следующей проверки.
+                return False
+            self._stamp = stamp
+            self._install(state)
+        logger.info(f"База знаний перечитана: {len(self)} ответов")
+        return True
+
+    def start_reload_watcher(self, interval: float):
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while not self._watcher_stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    logger.error(f"Ошибка проверки файла базы знаний: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='kb-reload-watcher', daemon=True)
+        self._watcher.start()
+
+    @staticmethod
+    def _build_state(data: Dict[str, List[str]], signatures: Optional[array] = None) -> dict:
+        store = KBStore()
+        index = SearchIndex()
+        # Индекс похожих ответов переносим, только если он уже был построен (сигнатуры при сжатии).
+        near_duplicates = None
+        if config.NEAR_DUP_ENABLED and signatures is not None:
+            near_duplicates = NearDuplicateIndex.from_config(signatures)
+        for answer, questions in data.items():
+            for question in questions:
+                if store.add(question, answer) is not None:
+                    index.add(question)
+            # Готовые сигнатуры (при сжатии) уже покрывают все ответы снимка, считаем только недостающие.
+            if near_duplicates is not None and len(near_duplicates) < len(store):
+                near_duplicates.add(near_duplicates.signature(answer))
+        return {'store': store, 'index': index, 'near_duplicates': near_duplicates}
+
+    @staticmethod
+    def _near_duplicates_fresh(near_duplicates: Optional[NearDuplicateIndex]) -> bool:
+        return near_duplicates is None or (config.NEAR_DUP_ENABLED and near_duplicates.matches_config())
 
-    def _initialize_knowledge_base(self) -> Dict[str, List[str]]:
+    def prepare_near_duplicates(self):
+        # Индекс похожих ответов нужен только для слияния (автосохранение ответов LLM, прогрев), поэтому
+        # строится по первому требованию: MinHash всех ответов - основная часть холодной загрузки.
+        # Сигнатуры считаются по опубликованной версии без блокировки, под ней досчитываются только
+        # ответы, добавленные за это время.
+        while config.NEAR_DUP_ENABLED and self.near_duplicates is None:
+            generation = self._generation
+            store = self._version.store
+            near_duplicates = NearDuplicateIndex.from_config()
+            with stage('kb_near_duplicates'):
+                for answer_id in range(len(store)):
+                    near_duplicates.add(near_duplicates.signature(store.answer_text(answer_id)))
+
+            with self._lock:
+                if generation != self._generation:
+                    # База перечитана с диска, id ответов могли поменяться.
+                    continue
+                if self.near_duplicates is None:
+                    current = (self._draft or self._version).store
+                    for answer_id in range(len(near_duplicates), len(current)):
+                        near_duplicates.add(near_duplicates.signature(current.answer_text(answer_id)))
+                    self.near_duplicates = near_duplicates
+                    logger.info(f"Индекс похожих ответов построен: {len(near_duplicates)} ответов")
+
+    def _write_binary_snapshot(self, state: dict):
+        try:
+            with stage('kb_snapshot'):
+                write_snapshot(self.snapshot_path, self.file_path, state)
+        except Exception as e:
+            logger.error(f"Ошибка записи бинарного снимка базы знаний: {e}")
+
+    def _read_json(self) -> Dict[str, List[str]]:
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _load_snapshot(self) -> Dict[str, List[str]]:
         try:
             self.file_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -19,8 +228,7 @@ class KnowledgeBase:
                 example_data = {
                     "Пример ответа": ["Пример вопроса 1", "Пример вопроса 2"]
                 }
-                with open(self.file_path, 'w', encoding='utf-8') as f:
-                    json.dump(example_data, f, ensure_ascii=False, indent=2)
+                write_atomic_json(self.file_path, example_data)
                 return example_data
 
             with open(self.file_path, 'r', encoding='utf-8') as f:
@@ -28,27 +236,100 @@ class KnowledgeBase:
 
         except Exception as e:
             logger.error(f"Ошибка инициализации базы знаний: {e}")
+            # Не даём следующему сжатию затереть повреждённый снимок.
+            if self.file_path.exists():
+                os.replace(self.file_path, self.file_path.with_suffix('.corrupt'))
             return {}
 
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def items(self):
+        return self.store.items()
+
+    def page(self, cursor: int, limit: int) -> KBPage:
+        # Ответы не удаляются, поэтому id ответа - это и его позиция при постраничном просмотре.
+        store = self.store
+        end = min(cursor + limit, len(store))
+        return KBPage(
+            [store.entry(answer_id) for answer_id in range(cursor, end)],
+            max(0, cursor - limit) if cursor > 0 else None,
+            end if end < len(store) else None
+        )
+
+    def search_answers(self, text: str, limit: int) -> List[int]:
+        version = self._version
+        postings = [version.index.postings.get(term) for term in set(tokenize(text))]
+        if not postings or not all(postings):
+            return []
+
+        postings.sort(key=len)
+        doc_ids = set(postings[0]).intersection(*postings[1:])
+        return sorted({version.store.question_answers[doc_id] for doc_id in doc_ids})[:limit]
+
+    def entries(self, refs) -> List[Tuple[str, List[str]]]:
+        return [self.store.entry(ref) for ref in refs]
+
     def save(self):
         try:
-            with open(self.file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.base, f, ensure_ascii=False, indent=2)
+            with stage('kb_save'):
+                self.journal.sync()
         except Exception as e:
             logger.error(f"Ошибка сохранения базы знаний: {e}")
 
+    def compact(self):
+        try:
+            self._compact()
+        except Exception as e:
+            logger.error(f"Ошибка сжатия базы знаний: {e}")
+
+    def _compact(self):
+        # Под блокировкой только фиксируем версию; сериализация идёт по неизменяемой копии.
+        with self._lock:
+            self._publish()
+            self._compacting = True
+            rotated_path = self.journal.rotate()
+            store = self.store
+            signatures = array('I', self.near_duplicates.signatures) if self.near_duplicates else None
+
+        with stage('kb_compact'):
+            try:
+                data = store.to_dict()
+                write_atomic_json(self.file_path, data)
+                self._stamp = self._file_stamp()
+            finally:
+                self._compacting = False
+            if config.KB_BINARY_SNAPSHOT:
+                self._write_binary_snapshot(self._build_state(data, signatures))
+            if rotated_path.exists():
+                rotated_path.unlink()
+        logger.info(f"База знаний сжата: {len(data)} ответов")
+
+    def close(self):
+        self._watcher_stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+        self._publish()
+        if self._compaction is not None:
+            self._compaction.join()
+        self.journal.close()
+
     def find_answer(self, user_question: str) -> tuple:
         try:
-            for answer, questions in self.base.items():
-                for question in questions:
-                    if self._is_similar(question, user_question):
-                        return answer, 1.0
-            return None, 0.0
+            version = self._version
+            candidates = version.index.candidates(user_question)
+            if not candidates:
+                return None, 0.0
+            if self.feedback is not None and self.feedback.aggregates:
+                return self.feedback.rank(
+                    (version.store.answer_of(doc_id), score) for doc_id, score in candidates)
+            doc_id, score = max(candidates, key=lambda candidate: candidate[1])
+            return version.store.answer_of(doc_id), score
         except Exception as e:
             logger.error(f"Ошибка поиска ответа: {e}")
             return None, 0.0
 
-    def add_question_answer(self, question: str, answer: str):
+    def add_question_answer(self, question: str, answer: str, merge_similar: bool = False, batched: bool = False):
         try:
             question = question.strip()
             answer = answer.strip()
@@ -56,17 +337,82 @@ class KnowledgeBase:
             if not question or not answer:
                 return
 
-            if answer in self.base:
-                if question not in self.base[answer]:
-                    self.base[answer].append(question)
-            else:
-                self.base[answer] = [question]
+            with self._lock:
+                answer = self._insert(question, answer, merge_similar)
+                if answer is None:
+                    return
+                with stage('kb_save'):
+                    self.journal.append({'q': question, 'a': answer})
+                # Правку администратора публикуем сразу, чтобы следующий же поиск её видел; автосохранения
+                # ответов LLM можно копить в одну версию.
+                if batched:
+                    self._schedule_publish()
+                else:
+                    self._publish()
 
-            self.save()
             logger.info(f"Автосохранение: Q: {question[:50]}... | A: {answer[:50]}...")
+
+            if self.journal.records >= config.JOURNAL_COMPACT_THRESHOLD:
+                self._start_compaction()
         except Exception as e:
             logger.error(f"Ошибка автосохранения: {e}")
 
-    @staticmethod
-    def _is_similar(a: str, b: str) -> bool:
-        return a.lower().strip() == b.lower().strip()
+    def add_many(self, pairs: Iterable[Tuple[str, str]], merge_similar: bool = False) -> int:
+        added = 0
+        with self._lock:
+            for question, answer in pairs:
+                question = question.strip()
+                answer = answer.strip()
+                if question and answer and self._insert(question, answer, merge_similar) is not None:
+                    added += 1
+            self._publish()
+
+        # Вместо записи в журнал по каждой паре один раз сохраняем снимок целиком.
+        if added:
+            if self._compaction is not None:
+                self._compaction.join()
+            self._compact()
+        logger.info(f"Массовое добавление: {added} новых вопросов")
+        return added
+
+    def _start_compaction(self):
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        self._compaction = threading.Thread(target=self.compact, name='kb-compaction', daemon=True)
+        self._compaction.start()
+
+    def _insert(self, question: str, answer: str, merge_similar: bool = False) -> Optional[str]:
+        # Вызывается под _lock и пишет только в черновик.
+        draft = self._draft_version()
+        if merge_similar and self.near_duplicates is None:
+            self.prepare_near_duplicates()
+        signature = None
+        if self.near_duplicates is not None and draft.store.answer_id(answer) is None:
+            signature = self.near_duplicates.signature(answer)
+            if merge_similar and signature is not None:
+                match_id, similarity = self.near_duplicates.query(signature)
+                if match_id is not None:
+                    logger.info(f"Ответ объединён с похожим ответом #{match_id} (сходство {similarity:.2f})")
+                    KB_NEAR_DUPLICATES.inc()
+                    answer = draft.store.answer_text(match_id)
+
+        answers_before = len(draft.store)
+        if draft.store.add(question, answer) is None:
+            return None
+        if self.near_duplicates is not None and len(draft.store) > answers_before:
+            self.near_duplicates.add(signature)
+        draft.index.add(question)
+        return answer
+
+
+def create_knowledge_base():
+    if config.KB_BACKEND != 'sqlite':
+        return KnowledgeBase(config.KNOWLEDGE_BASE_FILE)
+
+    from sqlite_knowledge_base import SqliteKnowledgeBase, migrate_from_json
+
+    knowledge_base = SqliteKnowledgeBase(config.KNOWLEDGE_BASE_DB_FILE)
+    if not len(knowledge_base) and Path(config.KNOWLEDGE_BASE_FILE).exists():
+        logger.info("Переносим базу знаний из JSON в SQLite...")
+        migrate_from_json(config.KNOWLEDGE_BASE_FILE, config.KNOWLEDGE_BASE_DB_FILE)
+    return knowledge_base
@@ -1,6 +1,8 @@
+import asyncio
 import logging
-import os
+import threading
 
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import(
     ApplicationBuilder,
     CommandHandler,
@@ -10,10 +12,24 @@ from telegram.ext import(
     filters
 )
 
+from concurrency import ChatOrderedUpdateProcessor, ConcurrencyGate, LLMBusyError
 from config import config
-from knowledge_base import KnowledgeBase
+from feedback_store import HELPFUL, UNHELPFUL, FeedbackStore, answer_key, create_feedback_store
+from knowledge_base import KnowledgeBase, create_knowledge_base
+from metrics import (
+    FEEDBACK_EVENTS, FEEDBACK_STORE, FEEDBACK_WRITES, KB_LOOKUPS, KB_SIZE, LLM_CACHE, LLM_CACHE_EVENTS,
+    LLM_CIRCUIT, LLM_GATE, LLM_GATE_REJECTED, LLM_IN_FLIGHT, LLM_REQUESTS, RATE_LIMITED, SEND_MESSAGES,
+    SEND_QUEUE, UPDATES, start_metrics_server
+)
+from profiler import ProfilerBusyError, run_profile, slow_updates, stage
+from send_queue import Priority, SendQueue
+from sentiment import shutdown_sentiment_workers
+from singleflight import SingleFlight
+from streaming import StreamingMessage
+from text_processing import normalize_text
 from yandex_gpt import yandex_gpt
-from utils import check_message_limit, is_on_topic
+from utils import check_message_limit, analyze_sentiment, is_on_topic
+from webhook import run_local_webhook, run_webhook
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s' ,
@@ -25,12 +41,17 @@ SELECTING_ACTION , GIVING_FEEDBACK , ADDING_QUESTION = range(3)
 
 
 class BotHandlers:
-    def __init__ (self , knowledge_base: KnowledgeBase):
+    def __init__ (self , knowledge_base: KnowledgeBase, feedback: FeedbackStore):
         self.knowledge_base = knowledge_base
+        self.feedback = feedback
+        self.outbox = SendQueue()
+        self.llm_requests = SingleFlight()
+        self.llm_gate = ConcurrencyGate(config.LLM_MAX_CONCURRENCY, config.LLM_MAX_WAITING)
 
     async def start(self, update, context):
         user = update.effective_user
-        await update.message.reply_text(
+        await self.outbox.reply(
+            update.message,
             f"Привет, {user.first_name}! Я бот для анализа систем мониторинга онлайн-активности.\n"
             "Я могу ответить на вопросы по темам:\n"
             "- Мониторинг онлайн-активности сотрудников\n"
@@ -47,38 +68,107 @@ class BotHandlers:
 /help - показать это сообщение
 /feedback - оставить обратную связь
 /add_question - добавить новый вопрос и ответ (только для администраторов)
+/show_db [запрос] - просмотр и поиск по базе знаний
+/profile [секунды] - профилировать бота (только для администраторов)
+/slow [число|clear] - последние медленные обновления (только для администраторов)
 
 Я отвечаю на вопросы по теме мониторинга онлайн-активности для оценки рисков безопасности.
 """
-        await update.message.reply_text(help_text)
+        await self.outbox.reply(update.message, help_text)
 
     async def handle_message(self, update, context):
         user_id = update.effective_user.id
 
-        if not check_message_limit(user_id):
-            await update.message.reply_text(f"Подождите {config.MESSAGE_LIMIT_SECONDS} секунд.")
+        with stage('rate_limit'):
+            allowed = check_message_limit(user_id)
+        if not allowed:
+            RATE_LIMITED.inc()
+            await self.outbox.reply(update.message, f"Подождите {config.MESSAGE_LIMIT_SECONDS} секунд.")
             return
 
         user_question = update.message.text
         logger.info(f"User {user_id} asked: {user_question}")
 
-        if not is_on_topic(user_question):
-            await update.message.reply_text("Я отвечаю только на вопросы по мониторингу активности.")
+        with stage('topic_filter'):
+            on_topic = is_on_topic(user_question)
+        if not on_topic:
+            await self.outbox.reply(update.message, "Я отвечаю только на вопросы по мониторингу активности.")
             return
 
-        answer, ratio = self.knowledge_base.find_answer(user_question)
+        with stage('sentiment'):
+            sentiment = analyze_sentiment(user_question)
+        logger.info(f"Question sentiment: {sentiment}")
+
+        with stage('kb_lookup'):
+            answer, ratio = self.knowledge_base.find_answer(user_question)
 
         if answer and ratio > config.SIMILARITY_THRESHOLD:
-            await update.message.reply_text(answer)
+            KB_LOOKUPS.labels('hit').inc()
+            await self.outbox.reply(update.message, answer, Priority.ANSWER)
+            await self._request_feedback(update, answer)
+        elif yandex_gpt.is_unavailable:
+            KB_LOOKUPS.labels('miss').inc()
+            await self.outbox.reply(update.message, self._fallback_text(answer), Priority.ANSWER)
         else:
-            await update.message.reply_text("Ищу ответ...")
-            yandex_response = yandex_gpt.ask(user_question)
+            KB_LOOKUPS.labels('miss').inc()
+            placeholder = await self.outbox.reply(update.message, "Ищу ответ...", Priority.PLACEHOLDER)
+            streaming_message = StreamingMessage(placeholder, outbox=self.outbox)
+
+            try:
+                with stage('llm'):
+                    yandex_response, shared = await self.llm_requests.do(
+                        normalize_text(user_question),
+                        lambda: self._ask_llm(user_question, streaming_message)
+                    )
+            except LLMBusyError as e:
+                logger.warning(f"LLM перегружен, запрос отклонён: {e}")
+                await streaming_message.finish("Сейчас слишком много запросов. Попробуйте чуть позже.")
+                return
+            except Exception as e:
+                logger.error(f"Ошибка запроса к LLM: {e}")
+                yandex_response, shared = None, False
 
             if yandex_response:
-                await update.message.reply_text(yandex_response)
-                self.knowledge_base.add_question_answer(user_question, yandex_response)
+                if config.YANDEX_GPT_STREAM:
+                    await streaming_message.finish(yandex_response)
+                else:
+                    await self.outbox.reply(update.message, yandex_response, Priority.ANSWER)
+                await self._request_feedback(update, yandex_response)
+
+                if not shared and config.AUTO_SAVE_LLM_ANSWERS:
+                    with stage('kb_add'):
+                        # Похожие ответы объединяем только для автосохранения LLM; ответы администраторов пишем как есть.
+                        self.knowledge_base.add_question_answer(
+                            user_question, yandex_response, merge_similar=True, batched=True)
+            elif config.YANDEX_GPT_STREAM:
+                await streaming_message.finish(self._fallback_text(answer))
             else:
-                await update.message.reply_text("Не удалось получить ответ.")
+                await self.outbox.reply(update.message, self._fallback_text(answer), Priority.ANSWER)
+
+    async def _request_feedback(self, update, answer):
+        key = answer_key(answer)
+        keyboard = [[
+            InlineKeyboardButton("👍 Полезно", callback_data=f'feedback_{HELPFUL}_{key}'),
+            InlineKeyboardButton("👎 Не помогло", callback_data=f'feedback_{UNHELPFUL}_{key}')
+        ]]
+        await self.outbox.reply(
+            update.message, "Ответ был полезен?", Priority.PROMPT, reply_markup=InlineKeyboardMarkup(keyboard))
+
+    @staticmethod
+    def _fallback_text(answer):
+        if not answer:
+            return "Не удалось получить ответ."
+        return f"Сервис ответов сейчас недоступен. Ближайший ответ из базы знаний:\n\n{answer}"
+
+    async def _ask_llm(self, question, streaming_message):
+        # Ответ из кэша не ждёт слота LLM и не попадает под отказ перегруженного шлюза.
+        cached = yandex_gpt.cached(question)
+        if cached is not None:
+            return cached
+        async with self.llm_gate.slot():
+            if config.YANDEX_GPT_STREAM:
+                return await yandex_gpt.ask_stream(question, streaming_message.update, use_cache=False)
+            return await yandex_gpt.ask(question, use_cache=False)
 
     async def feedback_handler(self, update, context):
         query = update.callback_query
@@ -86,30 +176,33 @@ class BotHandlers:
 
         data_parts = query.data.split('_')
         feedback_type = data_parts[1]
-        # answer_snippet = data_parts[2] if len(data_parts) > 2 else ""
+        key = data_parts[2] if len(data_parts) > 2 else None
         user_id = query.from_user.id
 
         logger.info(f"Feedback from {user_id}: {feedback_type}")
-        await query.edit_message_text("Спасибо за оценку!")
+        FEEDBACK_EVENTS.labels(feedback_type).inc()
+        self.feedback.record(feedback_type, user_id, answer=key)
+        await self.outbox.edit_query(query, "Спасибо за оценку!")
 
     async def save_question_handler(self, update, context):
         query = update.callback_query
         await query.answer()
 
         if query.data == 'dont_save':
-            await query.edit_message_text("Хорошо, не сохраняем.")
+            await self.outbox.edit_query(query, "Хорошо, не сохраняем.")
             return
 
         data_parts = query.data.split('_')
         if len(data_parts) < 3:
-            await query.edit_message_text("Ошибка обработки.")
+            await self.outbox.edit_query(query, "Ошибка обработки.")
             return
 
         question = '_'.join(data_parts[1:-1])
         full_answer = query.message.reply_to_message.text
 
-        self.knowledge_base.add_question_answer(question , full_answer)
-        await query.edit_message_text("Вопрос и ответ сохранены!")
+        with stage('kb_add'):
+            self.knowledge_base.add_question_answer(question , full_answer)
+        await self.outbox.edit_query(query, "Вопрос и ответ сохранены!")
         context.user_data.pop('last_question' , None)
         context.user_data.pop('last_answer' , None)
 
@@ -117,10 +210,10 @@ class BotHandlers:
         user_id = update.effective_user.id
 
         if not check_message_limit(user_id):
-            await update.message.reply_text(f"Подождите {config.MESSAGE_LIMIT_SECONDS} секунд.")
+            await self.outbox.reply(update.message, f"Подождите {config.MESSAGE_LIMIT_SECONDS} секунд.")
             return ConversationHandler.END
 
-        await update.message.reply_text("Напишите ваши предложения по улучшению:")
+        await self.outbox.reply(update.message, "Напишите ваши предложения по улучшению:")
         return GIVING_FEEDBACK
 
     async def receive_feedback(self, update, context):
@@ -128,21 +221,24 @@ class BotHandlers:
         user_id = update.effective_user.id
 
         logger.info(f"Feedback from {user_id}: {feedback}")
-        await update.message.reply_text("Спасибо за обратную связь!")
+        FEEDBACK_EVENTS.labels('text').inc()
+        self.feedback.record('text', user_id, text=feedback)
+        await self.outbox.reply(update.message, "Спасибо за обратную связь!")
         return ConversationHandler.END
 
     async def add_question_command(self, update, context):
         user_id = update.effective_user.id
 
         if not check_message_limit(user_id):
-            await update.message.reply_text(f"Подождите {config.MESSAGE_LIMIT_SECONDS} секунд.")
+            await self.outbox.reply(update.message, f"Подождите {config.MESSAGE_LIMIT_SECONDS} секунд.")
             return ConversationHandler.END
 
         if user_id not in config.ADMIN_IDS:
-            await update.message.reply_text("Эта команда только для администраторов.")
+            await self.outbox.reply(update.message, "Эта команда только для администраторов.")
             return ConversationHandler.END
 
-        await update.message.reply_text(
+        await self.outbox.reply(
+            update.message,
             "Введите вопрос и ответ через '|'.\n"
             "Пример: Как работает анализ? | Анализ использует NLP для обработки текста."
         )
@@ -153,57 +249,232 @@ class BotHandlers:
         text = update.message.text
 
         if not check_message_limit(user_id):
-            await update.message.reply_text(f"Подождите {config.MESSAGE_LIMIT_SECONDS} секунд.")
+            await self.outbox.reply(update.message, f"Подождите {config.MESSAGE_LIMIT_SECONDS} секунд.")
             return ADDING_QUESTION
 
         if '|' not in text:
-            await update.message.reply_text("Используйте '|' для разделения вопроса и ответа.")
+            await self.outbox.reply(update.message, "Используйте '|' для разделения вопроса и ответа.")
             return ADDING_QUESTION
 
         question, answer = [part.strip() for part in text.split('|' , 1)]
-        self.knowledge_base.add_question_answer(question, answer)
+        with stage('kb_add'):
+            self.knowledge_base.add_question_answer(question, answer)
 
-        await update.message.reply_text(
+        await self.outbox.reply(
+            update.message,
             f"Добавлено в базу знаний:\nВопрос: {question}\nОтвет: {answer}"
         )
         return ConversationHandler.END
 
     async def show_db(self, update, context):
         try:
-            if not self.knowledge_base.base:
-                await update.message.reply_text("📚 База знаний пуста")
+            if not len(self.knowledge_base):
+                await self.outbox.reply(update.message, "📚 База знаний пуста")
                 return
 
-            message = ["Содержимое базы знаний:"]
-            for answer , questions in self.knowledge_base.base.items():
-                message.append(f"\nОтвет: {answer}")
-                message.append(f"\nВопросы: {', '.join(questions)}")
+            search = " ".join(context.args or [])
+            if search:
+                refs = self.knowledge_base.search_answers(search, config.SHOW_DB_SEARCH_LIMIT)
+                if not refs:
+                    await self.outbox.reply(update.message, f"По запросу «{search}» ничего не найдено")
+                    return
+                context.user_data['show_db_search'] = (search, refs)
+                text, markup = self._search_page(search, refs, 0)
+            else:
+                text, markup = self._browse_page(0)
+
+            await self.outbox.reply(update.message, text, reply_markup=markup)
+
+        except Exception as e:
+            logger.error(f"Ошибка показа базы знаний: {e}")
+            await self.outbox.reply(update.message, "Временные проблемы с доступом к базе знаний")
+
+    async def show_db_page(self, update, context):
+        query = update.callback_query
+        await query.answer()
+
+        try:
+            kind, cursor = query.data.split('_')
+            if kind == 'db':
+                text, markup = self._browse_page(int(cursor))
+            else:
+                search = context.user_data.get('show_db_search')
+                if search is None:
+                    await self.outbox.edit_query(query, "Результаты поиска устарели, повторите /show_db <запрос>")
+                    return
+                text, markup = self._search_page(*search, int(cursor))
 
-            full_message = "\n".join(message)
-            await update.message.reply_text(full_message[:4000])
+            await self.outbox.edit_query(query, text, reply_markup=markup)
 
         except Exception as e:
             logger.error(f"Ошибка показа базы знаний: {e}")
-            await update.message.reply_text("Временные проблемы с доступом к базе знаний")
+
+    def _browse_page(self, cursor):
+        page = self.knowledge_base.page(cursor, config.SHOW_DB_PAGE_SIZE)
+        header = f"Содержимое базы знаний (ответов: {len(self.knowledge_base)}):"
+        return self._render_page(header, page.entries), self._page_markup('db', page.prev_cursor, page.next_cursor)
+
+    def _search_page(self, search, refs, offset):
+        end = offset + config.SHOW_DB_PAGE_SIZE
+        entries = self.knowledge_base.entries(refs[offset:end])
+        header = f"Поиск «{search}»: {offset + 1}–{min(end, len(refs))} из {len(refs)}"
+        markup = self._page_markup(
+            'dbs',
+            max(0, offset - config.SHOW_DB_PAGE_SIZE) if offset > 0 else None,
+            end if end < len(refs) else None
+        )
+        return self._render_page(header, entries), markup
+
+    @staticmethod
+    def _render_page(header, entries):
+        limit = config.SHOW_DB_SNIPPET_LENGTH
+        message = [header]
+        for answer, questions in entries:
+            message.append(f"\nОтвет: {answer[:limit]}")
+            message.append(f"Вопросы: {', '.join(questions)[:limit]}")
+        return "\n".join(message)[:config.TELEGRAM_MESSAGE_LIMIT]
+
+    @staticmethod
+    def _page_markup(kind, prev_cursor, next_cursor):
+        buttons = []
+        if prev_cursor is not None:
+            buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=f"{kind}_{prev_cursor}"))
+        if next_cursor is not None:
+            buttons.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"{kind}_{next_cursor}"))
+        return InlineKeyboardMarkup([buttons]) if buttons else None
+
+    async def profile_command(self, update, context):
+        if update.effective_user.id not in config.ADMIN_IDS:
+            await self.outbox.reply(update.message, "Эта команда только для администраторов.")
+            return
+
+        try:
+            seconds = float(context.args[0]) if context.args else config.PROFILE_DEFAULT_SECONDS
+        except ValueError:
+            await self.outbox.reply(update.message, "Использование: /profile [секунды]")
+            return
+        seconds = min(max(seconds, 1.0), config.PROFILE_MAX_SECONDS)
+
+        await self.outbox.reply(update.message, f"Профилирую {seconds:g} с...")
+        # Профиль снимается в фоне: обработчик сразу отпускает блокировку чата и слот обработки,
+        # а сама команда не попадает в журнал медленных обновлений.
+        context.application.create_task(self._send_profile(update.message, seconds))
+
+    async def _send_profile(self, message, seconds: float):
+        try:
+            # Выборки снимает отдельный поток, цикл событий тем временем обслуживает обновления как обычно.
+            profiler = await asyncio.to_thread(run_profile, seconds)
+        except ProfilerBusyError:
+            await self.outbox.reply(message, "Профилировщик уже запущен.")
+            return
+
+        summary = profiler.summary(config.PROFILE_TOP_FUNCTIONS)
+        await self.outbox.reply(message, summary[:config.TELEGRAM_MESSAGE_LIMIT])
+        if profiler.stacks:
+            # Свёрнутые стеки подходят для flamegraph.pl и speedscope.
+            collapsed = profiler.collapsed().encode('utf-8')
+            await self.outbox.submit(
+                message.chat_id, Priority.INTERACTIVE,
+                lambda: message.reply_document(collapsed, filename='profile.collapsed')
+            )
+
+    async def slow_command(self, update, context):
+        if update.effective_user.id not in config.ADMIN_IDS:
+            await self.outbox.reply(update.message, "Эта команда только для администраторов.")
+            return
+
+        if context.args and context.args[0] == 'clear':
+            slow_updates.clear()
+            await self.outbox.reply(update.message, "Журнал медленных обновлений очищен.")
+            return
+        try:
+            limit = int(context.args[0]) if context.args else config.SLOW_UPDATE_DUMP_SIZE
+            traces = slow_updates.recent(limit)
+        except ValueError:
+            await self.outbox.reply(update.message, "Использование: /slow [число|clear]")
+            return
+
+        if not traces:
+            await self.outbox.reply(
+                update.message, f"Обновлений медленнее {slow_updates.threshold:g} с не было.")
+            return
+
+        text = (
+            f"Медленные обновления (порог {slow_updates.threshold:g} с), "
+            f"последние {len(traces)} из {len(slow_updates)}:\n\n"
+            + "\n\n".join(trace.format() for trace in traces)
+        )
+        await self.outbox.reply(update.message, text[:config.TELEGRAM_MESSAGE_LIMIT])
 
     async def cancel(self, update, context):
-        await update.message.reply_text("Отменено.")
+        await self.outbox.reply(update.message, "Отменено.")
         return ConversationHandler.END
 
     async def error_handler(self, update, context):
         logger.warning(f'Update {update} caused error {context.error}')
 
 
-def main():
-    if not os.path.exists(config.KNOWLEDGE_BASE_FILE):
-        logger.info("Создаем новую базу знаний...")
-        kb = KnowledgeBase(config.KNOWLEDGE_BASE_FILE)
-        kb.save()
-
-    knowledge_base = KnowledgeBase(config.KNOWLEDGE_BASE_FILE)
-    bot_handlers = BotHandlers(knowledge_base)
+def register_gauges(application, knowledge_base, bot_handlers):
+    KB_SIZE.set_function(lambda: len(knowledge_base))
+    UPDATES.labels('queued').set_function(application.update_queue.qsize)
+    UPDATES.labels('processing').set_function(
+        lambda: application.update_processor.current_concurrent_updates)
+    LLM_GATE.labels('active').set_function(lambda: bot_handlers.llm_gate.active)
+    LLM_GATE.labels('waiting').set_function(lambda: bot_handlers.llm_gate.waiting)
+    LLM_GATE_REJECTED.set_function(lambda: bot_handlers.llm_gate.rejected)
+    LLM_REQUESTS.labels('calls').set_function(lambda: bot_handlers.llm_requests.calls)
+    LLM_REQUESTS.labels('coalesced').set_function(lambda: bot_handlers.llm_requests.coalesced)
+    LLM_IN_FLIGHT.set_function(lambda: len(bot_handlers.llm_requests))
+    LLM_CIRCUIT.set_function(lambda: int(yandex_gpt.is_unavailable))
+    FEEDBACK_STORE.labels('buffered').set_function(lambda: len(bot_handlers.feedback))
+    FEEDBACK_WRITES.labels('written').set_function(lambda: bot_handlers.feedback.written)
+    FEEDBACK_WRITES.labels('dropped').set_function(lambda: bot_handlers.feedback.dropped)
+    FEEDBACK_STORE.labels('answers').set_function(lambda: len(bot_handlers.feedback.aggregates))
+    SEND_QUEUE.labels('queued').set_function(lambda: len(bot_handlers.outbox))
+    SEND_QUEUE.labels('blocked_chats').set_function(lambda: bot_handlers.outbox.blocked_chats)
+    for result in ('sent', 'coalesced', 'retried', 'failed'):
+        SEND_MESSAGES.labels(result).set_function(lambda result=result: getattr(bot_handlers.outbox, result))
+    LLM_CACHE.set_function(lambda: yandex_gpt.cache.stats()['size'])
+    for event in ('hits', 'disk_hits', 'misses', 'evictions', 'expirations'):
+        LLM_CACHE_EVENTS.labels(event).set_function(lambda event=event: yandex_gpt.cache.stats()[event])
+
+
+async def shutdown(application):
+    await application.bot_data['outbox'].close()
+    await yandex_gpt.close()
+    application.bot_data['knowledge_base'].close()
+    application.bot_data['feedback'].close()
+    shutdown_sentiment_workers()
+
+
+def build_application():
+    knowledge_base = create_knowledge_base()
+    feedback = create_feedback_store()
+    feedback.start()
+    knowledge_base.feedback = feedback
+    if isinstance(knowledge_base, KnowledgeBase) and config.KB_RELOAD_INTERVAL > 0:
+        knowledge_base.start_reload_watcher(config.KB_RELOAD_INTERVAL)
+    if isinstance(knowledge_base, KnowledgeBase) and config.AUTO_SAVE_LLM_ANSWERS:
+        # Автосохранение сливает похожие ответы; индекс для этого строим в фоне, а не на первом сохранении.
+        threading.Thread(target=knowledge_base.prepare_near_duplicates, name='kb-near-duplicates',
+                         daemon=True).start()
+    bot_handlers = BotHandlers(knowledge_base, feedback)
+
+    application = (
+        ApplicationBuilder()
+        .token(config.TELEGRAM_TOKEN)
+        .concurrent_updates(
+            ChatOrderedUpdateProcessor(config.MAX_CONCURRENT_UPDATES, config.MAX_PENDING_UPDATES_PER_CHAT))
+        .post_shutdown(shutdown)
+        .build()
+    )
+    application.bot_data['knowledge_base'] = knowledge_base
+    application.bot_data['feedback'] = feedback
+    application.bot_data['outbox'] = bot_handlers.outbox
 
-    application = ApplicationBuilder().token(config.TELEGRAM_TOKEN).build()
+    if config.METRICS_ENABLED:
+        register_gauges(application, knowledge_base, bot_handlers)
+        start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
 
     application.add_handler(CommandHandler("start" , bot_handlers.start))
     application.add_handler(CommandHandler("help" , bot_handlers.help_command))
@@ -229,9 +500,28 @@ def main():
     application.add_handler(add_question_conv_handler)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND , bot_handlers.handle_message))
     application.add_handler(CommandHandler("show_db" , bot_handlers.show_db))
+    application.add_handler(CommandHandler("profile" , bot_handlers.profile_command))
+    application.add_handler(CommandHandler("slow" , bot_handlers.slow_command))
+    application.add_handler(CallbackQueryHandler(bot_handlers.show_db_page , pattern='^dbs?_'))
     application.add_error_handler(bot_handlers.error_handler)
+    return application
 
-    application.run_polling()
+
+def main():
+    config.validate()
+
+    if config.BOT_WORKERS > 1:
+        from supervisor import run_supervisor
+        run_supervisor(config.BOT_WORKERS)
+        return
+
+    application = build_application()
+    if config.BOT_MODE == 'webhook':
+        run_webhook(application)
+    elif config.BOT_MODE == 'webhook_local':
+        run_local_webhook(application)
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
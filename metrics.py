@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        pass
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        pass
+
+    def _value_samples(self) -> List[str]:
+        samples = []
+        for key, child in list(self._children.items()):
+            try:
+                samples.append(f"{self.name}{_format_labels(self.labelnames, key)} {child.get()}")
+            except Exception as e:
+                logger.warning(f"Failed to collect {self.kind} {self.name}: {e}")
+        return samples
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        # Для счётчиков, которые уже ведёт сам объект (отправлено, отброшено и т.п.); функция должна только расти.
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+    def _samples(self) -> List[str]:
+        return self._value_samples()
+
+
+class _GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+    def _samples(self) -> List[str]:
+        return self._value_samples()
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                samples.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            samples.append(f"{self.name}_sum{labels} {child.sum}")
+            samples.append(f"{self.name}_count{labels} {child.count}")
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram('bot_stage_seconds', "Latency of message pipeline stages", ('stage',))
+KB_LOOKUPS = Counter('bot_kb_lookups_total', "Knowledge base lookups by result", ('result',))
+LLM_ERRORS = Counter('bot_llm_errors_total', "Failed LLM requests by status code", ('status',))
+LLM_HEDGES = Counter('bot_llm_hedged_requests_total', "Hedged second LLM requests")
+LLM_CIRCUIT = Gauge('bot_llm_circuit_open', "1 while the LLM circuit breaker fails fast")
+RATE_LIMITED = Counter('bot_rate_limited_total', "Messages rejected by the rate limiter")
+SLOW_UPDATES = Counter('bot_slow_updates_total', "Updates slower than SLOW_UPDATE_THRESHOLD")
+FEEDBACK_EVENTS = Counter('bot_feedback_events_total', "Feedback events by type", ('type',))
+FEEDBACK_STORE = Gauge('bot_feedback_store', "Buffered feedback events and rated answers", ('stat',))
+FEEDBACK_WRITES = Counter('bot_feedback_store_events_total', "Feedback events written or dropped", ('result',))
+KB_NEAR_DUPLICATES = Counter('bot_kb_near_duplicates_total', "New answers merged into a similar existing answer")
+KB_SIZE = Gauge('bot_knowledge_base_answers', "Number of answers in the knowledge base")
+LLM_REQUESTS = Counter('bot_llm_requests_total', "Single-flight LLM calls and coalesced requests", ('kind',))
+LLM_IN_FLIGHT = Gauge('bot_llm_requests_in_flight', "Distinct LLM requests in flight")
+LLM_GATE = Gauge('bot_llm_gate', "Outbound LLM concurrency gate state", ('state',))
+LLM_GATE_REJECTED = Counter('bot_llm_gate_rejected_total', "LLM requests rejected by the concurrency gate")
+UPDATES = Gauge('bot_updates', "Telegram updates waiting in the queue or being processed", ('state',))
+UPDATES_DROPPED = Counter('bot_updates_dropped_total', "Updates dropped because their chat had too many pending")
+LLM_CACHE = Gauge('bot_llm_cache_entries', "LLM response cache size")
+LLM_CACHE_EVENTS = Counter('bot_llm_cache_events_total', "LLM response cache hits, misses and removals", ('event',))
+SEND_QUEUE = Gauge('bot_send_queue', "Outbound Telegram send queue state", ('stat',))
+SEND_MESSAGES = Counter('bot_send_queue_messages_total', "Outbound Telegram messages by outcome", ('result',))
+SEND_WAIT_SECONDS = Histogram('bot_send_wait_seconds', "Time outbound messages wait for a send slot", ('priority',))
+
+
+def start_metrics_server(host: str, port: int):
+    # http.server нужен только при включённых метриках, не тянем его при импорте.
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    # Один поток на все запросы: функции-метрики (например, размер базы на SQLite) не плодят соединения
+    # в каждом новом потоке, а опрос раз в несколько секунд параллелить незачем.
+    server = HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"Metrics available at http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,196 @@
+import argparse
+import hashlib
+import logging
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from config import config
+from text_processing import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Один 64-байтовый blake2b даёт 16 независимых 32-битных хешей.
+_DIGEST = struct.Struct('<16I')
+HASHES_PER_DIGEST = _DIGEST.size // 4
+
+
+def shingles(text: str, size: int) -> Set[str]:
+    terms = tokenize(text)
+    if len(terms) <= size:
+        return {" ".join(terms)} if terms else set()
+    return {" ".join(terms[i:i + size]) for i in range(len(terms) - size + 1)}
+
+
+def minhash(text: str, num_perm: int, shingle_size: int) -> Optional[Tuple[int, ...]]:
+    items = shingles(text, shingle_size)
+    if not items:
+        return None
+
+    salts = [bytes([i]) for i in range(num_perm // HASHES_PER_DIGEST)]
+    rows = []
+    for shingle in items:
+        data = shingle.encode('utf-8')
+        row: Tuple[int, ...] = ()
+        for salt in salts:
+            row += _DIGEST.unpack(hashlib.blake2b(data, digest_size=64, salt=salt).digest())
+        rows.append(row)
+    return tuple(map(min, zip(*rows)))
+
+
+def signature_similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def band_keys(signature: Sequence[int], bands: int) -> List[int]:
+    # Ключи хранятся на диске, поэтому берём blake2b от упакованной полосы, а не hash(): его значение
+    # для кортежей не обещано одинаковым между версиями и сборками Python.
+    rows = len(signature) // bands
+    band_struct = struct.Struct(f'<{rows + 1}I')
+    return [
+        int.from_bytes(
+            hashlib.blake2b(band_struct.pack(band, *signature[band * rows:(band + 1) * rows]), digest_size=8).digest(),
+            'little', signed=True
+        )
+        for band in range(bands)
+    ]
+
+
+class NearDuplicateIndex:
+    # MinHash-сигнатуры ответов и LSH по полосам; id элемента совпадает с id ответа в KBStore.
+    # Корзины LSH - отсортированные массивы (ключ полосы, id): словарь на сотни тысяч ключей
+    # занимает в разы больше памяти и долго поднимается из снимка.
+    def __init__(self, num_perm: int, bands: int, shingle_size: int, threshold: float):
+        if num_perm % HASHES_PER_DIGEST or num_perm % bands:
+            raise ValueError(f"num_perm={num_perm} must be a multiple of {HASHES_PER_DIGEST} and of bands={bands}")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.signatures = array('I')
+        self._keys = array('q')
+        self._ids = array('i')
+        self._pending: List[Tuple[int, int]] = []
+
+    @classmethod
+    def from_config(cls, signatures: Optional[array] = None) -> 'NearDuplicateIndex':
+        index = cls(config.NEAR_DUP_NUM_PERM, config.NEAR_DUP_BANDS, config.NEAR_DUP_SHINGLE_SIZE,
+                    config.NEAR_DUP_THRESHOLD)
+        if signatures is not None:
+            for start in range(0, len(signatures), index.num_perm):
+                signature = signatures[start:start + index.num_perm]
+                index.add(signature if any(signature) else None)
+        return index
+
+    def matches_config(self) -> bool:
+        return (self.num_perm, self.bands, self.shingle_size) == (
+            config.NEAR_DUP_NUM_PERM, config.NEAR_DUP_BANDS, config.NEAR_DUP_SHINGLE_SIZE)
+
+    def __len__(self) -> int:
+        return len(self.signatures) // self.num_perm
+
+    def signature(self, text: str) -> Optional[Tuple[int, ...]]:
+        return minhash(text, self.num_perm, self.shingle_size)
+
+    def add(self, signature: Optional[Sequence[int]]) -> int:
+        item_id = len(self)
+        if signature is None:
+            # Ответ без значимых слов ни с чем не сравнивается, но место под id занимает.
+            self.signatures.extend([0] * self.num_perm)
+            return item_id
+
+        self.signatures.extend(signature)
+        self._pending.extend((key, item_id) for key in band_keys(signature, self.bands))
+        return item_id
+
+    def query(self, signature: Sequence[int]) -> Tuple[Optional[int], float]:
+        self._merge_pending()
+        keys = self._keys
+        candidates: Set[int] = set()
+        for key in band_keys(signature, self.bands):
+            i = bisect_left(keys, key)
+            while i < len(keys) and keys[i] == key:
+                candidates.add(self._ids[i])
+                i += 1
+
+        best_id, best_similarity = None, 0.0
+        for item_id in candidates:
+            start = item_id * self.num_perm
+            similarity = signature_similarity(signature, self.signatures[start:start + self.num_perm])
+            if similarity >= self.threshold and similarity > best_similarity:
+                best_id, best_similarity = item_id, similarity
+        return best_id, best_similarity
+
+    def _merge_pending(self):
+        if not self._pending:
+            return
+        if len(self._pending) < len(self._keys) // 1000 + 64:
+            for key, item_id in self._pending:
+                i = bisect_right(self._keys, key)
+                self._keys.insert(i, key)
+                self._ids.insert(i, item_id)
+        else:
+            pairs = sorted(chain(zip(self._keys, self._ids), self._pending))
+            self._keys = array('q', [key for key, _ in pairs])
+            self._ids = array('i', [item_id for _, item_id in pairs])
+        self._pending.clear()
+
+    def __getstate__(self):
+        self._merge_pending()
+        return self.__dict__
+
+
+def dedupe(items: Iterable[Tuple[str, List[str]]], index: NearDuplicateIndex) -> Tuple[Dict[str, List[str]], int]:
+    base: Dict[str, List[str]] = {}
+    canonical: List[str] = []
+    merged = 0
+
+    for answer, questions in items:
+        signature = index.signature(answer)
+        match_id = index.query(signature)[0] if signature is not None else None
+        if match_id is None:
+            index.add(signature)
+            canonical.append(answer)
+            base[answer] = list(questions)
+            continue
+
+        merged += 1
+        target = base[canonical[match_id]]
+        target.extend(question for question in questions if question not in target)
+
+    return base, merged
+
+
+def dedupe_file(path: Path, dry_run: bool = False) -> Tuple[int, int]:
+    from journal import write_atomic_json
+    from knowledge_base import KnowledgeBase
+
+    # Загружаем через KnowledgeBase, чтобы учесть записи журнала, и переписываем снимок как при сжатии.
+    knowledge_base = KnowledgeBase(path)
+    try:
+        before = len(knowledge_base)
+        base, merged = dedupe(knowledge_base.items(), NearDuplicateIndex.from_config())
+        if not dry_run and merged:
+            rotated_path = knowledge_base.journal.rotate()
+            write_atomic_json(knowledge_base.file_path, base)
+            rotated_path.unlink(missing_ok=True)
+    finally:
+        knowledge_base.close()
+
+    logger.info(f"{path}: {before} ответов, объединено {merged} похожих")
+    return before, merged
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Merge near-duplicate answers in a knowledge base JSON file")
+    parser.add_argument('path', type=Path, nargs='?', default=config.KNOWLEDGE_BASE_FILE)
+    parser.add_argument('--threshold', type=float, default=config.NEAR_DUP_THRESHOLD,
+                        help="minimum estimated Jaccard similarity of answers to merge")
+    parser.add_argument('--dry-run', action='store_true', help="only report how many answers would be merged")
+    args = parser.parse_args()
+    config.NEAR_DUP_THRESHOLD = args.threshold
+    dedupe_file(args.path, args.dry_run)
@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, Optional, Set, Tuple
+
+from config import config
+from journal import write_atomic_json
+from text_processing import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+def iter_questions(path: Path, field: str = 'question') -> Iterator[str]:
+    # Читаем построчно: пустые записи тоже отдаём, чтобы номер записи в контрольной точке не съезжал.
+    suffix = path.suffix.lower()
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if suffix == '.csv':
+            reader = csv.DictReader(f)
+            fieldnames = reader.fieldnames or []
+            column = field if field in fieldnames else (fieldnames[0] if fieldnames else None)
+            for row in reader:
+                yield (row.get(column) or '').strip()
+        elif suffix in ('.jsonl', '.ndjson'):
+            for line in f:
+                if not line.strip():
+                    yield ''
+                    continue
+                record = json.loads(line)
+                value = record.get(field) if isinstance(record, dict) else record
+                yield str(value or '').strip()
+        else:
+            for line in f:
+                yield line.strip()
+
+
+def iter_answers(path: Path) -> Iterator[Tuple[str, str]]:
+    if not path.exists():
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record['q'], record['a']
+
+
+class Prewarmer:
+    def __init__(self, knowledge_base, llm, source: Path, field: str = 'question',
+                 concurrency: int = config.PREWARM_CONCURRENCY, rate: float = 0.0):
+        self.knowledge_base = knowledge_base
+        self.llm = llm
+        self.source = source
+        self.field = field
+        self.concurrency = concurrency
+        self.rate = rate
+
+        # Рядом с входным файлом: контрольная точка, накопленные ответы GPT и вопросы, на которые ответа не было.
+        self.checkpoint_path = source.with_name(source.name + '.checkpoint')
+        self.answers_path = source.with_name(source.name + '.answers.jsonl')
+        self.failed_path = source.with_name(source.name + '.failed')
+
+        self.stats = {'processed': 0, 'kb_hits': 0, 'answered': 0, 'failed': 0, 'duplicates': 0, 'empty': 0}
+        self.position = 0
+        self.total = 0
+        self._done: Set[int] = set()
+        # Дайджесты недавних вопросов для отсева повторов; размер ограничен, чтобы большой файл не съел память.
+        self._seen: "OrderedDict[bytes, None]" = OrderedDict()
+        self._next_slot = 0.0
+        self._since_checkpoint = 0
+        self._answers = None
+        self._failed = None
+
+    def _load_checkpoint(self) -> int:
+        if not self.checkpoint_path.exists():
+            return 0
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        self.stats.update(checkpoint.get('stats', {}))
+        # Записи после позиции, уже обработанные до остановки; не завершённые из-за ошибки пройдут заново.
+        self._done = set(checkpoint.get('done', []))
+        self.stats['processed'] = checkpoint['position'] + len(self._done)
+        logger.info(f"Resuming {self.source} from record {checkpoint['position']}")
+        return checkpoint['position']
+
+    def _save_checkpoint(self):
+        # Сначала ответы на диск, потом позиция: контрольная точка не должна опережать сохранённые ответы.
+        for f in (self._answers, self._failed):
+            f.flush()
+            os.fsync(f.fileno())
+        write_atomic_json(
+            self.checkpoint_path, {'position': self.position, 'done': sorted(self._done), 'stats': self.stats})
+        self._since_checkpoint = 0
+
+    def _complete(self, index: int):
+        # Записи завершаются не по порядку; позиция - начало самого длинного полностью обработанного префикса.
+        self.stats['processed'] += 1
+        self._done.add(index)
+        while self.position in self._done:
+            self._done.remove(self.position)
+            self.position += 1
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= config.PREWARM_CHECKPOINT_EVERY:
+            self._save_checkpoint()
+
+    async def _wait_turn(self):
+        while self.llm.is_unavailable:
+            logger.warning(f"Yandex GPT circuit is open, pausing for {config.CIRCUIT_RECOVERY_TIMEOUT}s")
+            await asyncio.sleep(config.CIRCUIT_RECOVERY_TIMEOUT)
+
+        if self.rate:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+    async def _process(self, question: str):
+        if not question:
+            self.stats['empty'] += 1
+            return
+
+        answer, score = self.knowledge_base.find_answer(question)
+        if answer and score > config.SIMILARITY_THRESHOLD:
+            self.stats['kb_hits'] += 1
+            return
+
+        key = hashlib.blake2b(normalize_text(question).encode('utf-8'), digest_size=16).digest()
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            self.stats['duplicates'] += 1
+            return
+        self._seen[key] = None
+        if len(self._seen) > config.PREWARM_DEDUP_SIZE:
+            self._seen.popitem(last=False)
+
+        await self._wait_turn()
+        response = await self.llm.ask(question)
+        if response is None:
+            self.stats['failed'] += 1
+            self._failed.write(question + '\n')
+            return
+
+        self.stats['answered'] += 1
+        self._answers.write(json.dumps({'q': question, 'a': response}, ensure_ascii=False) + '\n')
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, question = item
+            # Отменённая или упавшая запись не отмечается обработанной: после перезапуска её спросят снова.
+            try:
+                await self._process(question)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Failed to pre-warm {question[:50]!r}: {e}")
+                continue
+            self._complete(index)
+
+    async def _report_progress(self, started: float, resumed: int):
+        while True:
+            await asyncio.sleep(config.PREWARM_PROGRESS_INTERVAL)
+            self._log_progress(started, resumed)
+
+    def _log_progress(self, started: float, resumed: int):
+        elapsed = time.perf_counter() - started
+        throughput = (self.stats['processed'] - resumed) / elapsed if elapsed else 0.0
+        logger.info(
+            f"Processed {self.stats['processed']}: {self.stats['kb_hits']} from KB, "
+            f"{self.stats['answered']} from GPT, {self.stats['failed']} failed, "
+            f"{throughput:.1f} questions/s"
+        )
+
+    async def run(self) -> dict:
+        start = self.position = self._load_checkpoint()
+        resumed = self.stats['processed']
+        started = time.perf_counter()
+        # Очередь ограничена, так что в памяти одновременно не больше пары окон вопросов.
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        with open(self.answers_path, 'a', encoding='utf-8') as self._answers, \
+                open(self.failed_path, 'a', encoding='utf-8') as self._failed:
+            workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+            reporter = asyncio.create_task(self._report_progress(started, resumed))
+            try:
+                for index, question in enumerate(iter_questions(self.source, self.field)):
+                    self.total = index + 1
+                    if index >= start and index not in self._done:
+                        await queue.put((index, question))
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+            finally:
+                reporter.cancel()
+                self._save_checkpoint()
+
+        self._log_progress(started, resumed)
+        return self.stats
+
+    def flush(self) -> int:
+        # Все ответы прогона добавляются одним пакетом и сохраняются одной записью базы.
+        added = self.knowledge_base.add_many(iter_answers(self.answers_path), merge_similar=True)
+        self.answers_path.unlink(missing_ok=True)
+        if self.position < self.total:
+            # Ответы уже в базе; контрольная точка остаётся, чтобы повторный запуск спросил только упавшие записи.
+            logger.warning(f"{self.total - self.position - len(self._done)} questions failed, run again to retry them")
+        else:
+            self.checkpoint_path.unlink(missing_ok=True)
+        if self.failed_path.exists() and not self.failed_path.stat().st_size:
+            self.failed_path.unlink()
+        return added
+
+
+async def prewarm(source: Path, field: str, concurrency: int, rate: float) -> Tuple[dict, Optional[int]]:
+    from knowledge_base import create_knowledge_base
+    from yandex_gpt import yandex_gpt
+
+    knowledge_base = create_knowledge_base()
+    prewarmer = Prewarmer(knowledge_base, yandex_gpt, source, field, concurrency, rate)
+    try:
+        stats = await prewarmer.run()
+        added = prewarmer.flush()
+        logger.info(f"Added {added} questions to the knowledge base")
+        return stats, added
+    finally:
+        await yandex_gpt.close()
+        knowledge_base.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Answer a question file through the knowledge base and Yandex GPT and store the new answers. "
+                    "Run it while the bot is stopped unless KB_BACKEND=sqlite."
+    )
+    parser.add_argument('questions', type=Path, help="text (one question per line), .csv or .jsonl file")
+    parser.add_argument('--field', default='question', help="CSV column or JSON field holding the question")
+    parser.add_argument('--concurrency', type=int, default=config.PREWARM_CONCURRENCY)
+    parser.add_argument('--rate', type=float, default=0.0, help="max Yandex GPT requests per second, 0 - unlimited")
+    args = parser.parse_args()
+    asyncio.run(prewarm(args.questions, args.field, args.concurrency, args.rate))
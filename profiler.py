@@ -0,0 +1,184 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from config import config
+from metrics import SLOW_UPDATES, STAGE_SECONDS
+
+# Кадры, в которых поток просто ждёт работы; такие выборки считаем простоем, а не горячим кодом.
+IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('socketserver.py', 'serve_forever'),
+}
+
+_current_trace: ContextVar[Optional['UpdateTrace']] = ContextVar('update_trace', default=None)
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+class UpdateTrace:
+    __slots__ = ('update_id', 'chat_id', 'kind', 'started_at', 'duration', 'stages')
+
+    def __init__(self, update_id: Optional[int], chat_id: Optional[int], kind: str):
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.kind = kind
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.stages: List[Tuple[str, float]] = []
+
+    def format(self) -> str:
+        started = time.strftime('%H:%M:%S', time.localtime(self.started_at))
+        lines = [f"{started} update {self.update_id} chat {self.chat_id} {self.kind}: {self.duration * 1000:.0f} мс"]
+        lines.extend(f"  {name}: {seconds * 1000:.1f} мс" for name, seconds in self.stages)
+        # Всё, что не попало в именованные этапы: ожидание отправки, обработчики без замеров.
+        other = self.duration - sum(seconds for _, seconds in self.stages)
+        lines.append(f"  прочее: {max(other, 0.0) * 1000:.1f} мс")
+        return "\n".join(lines)
+
+
+def record_stage(name: str, seconds: float):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def _describe(update) -> Tuple[Optional[int], Optional[int], str]:
+    chat = getattr(update, 'effective_chat', None)
+    message = getattr(update, 'effective_message', None)
+    if getattr(update, 'callback_query', None) is not None:
+        kind = 'callback_query'
+    elif message is not None and (message.text or '').startswith('/'):
+        kind = message.text.split()[0]
+    else:
+        kind = 'message'
+    return getattr(update, 'update_id', None), chat.id if chat else None, kind
+
+
+class SlowUpdateLog:
+    def __init__(self, threshold: float = config.SLOW_UPDATE_THRESHOLD, capacity: int = config.SLOW_UPDATE_TRACE_SIZE):
+        self.threshold = threshold
+        # Кольцевой буфер: храним только последние медленные обновления.
+        self._traces: deque = deque(maxlen=capacity)
+
+    def __len__(self) -> int:
+        return len(self._traces)
+
+    @asynccontextmanager
+    async def trace(self, update):
+        trace = UpdateTrace(*_describe(update))
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - start
+            _current_trace.reset(token)
+            if trace.duration >= self.threshold:
+                SLOW_UPDATES.inc()
+                self._traces.append(trace)
+
+    def recent(self, limit: int) -> List[UpdateTrace]:
+        if limit < 1:
+            raise ValueError(f"limit must be positive, got {limit}")
+        traces = list(self._traces)
+        return traces[:-limit - 1:-1]
+
+    def clear(self):
+        self._traces.clear()
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = config.PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.duration = 0.0
+
+    def _sample(self, own_thread: int):
+        # sys._current_frames() берёт кадры всех потоков разом; стек пишем от корня к листу, как в flamegraph.
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+            self.samples += 1
+            if leaf in IDLE_FRAMES:
+                self.idle += 1
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def run(self, seconds: float) -> 'SamplingProfiler':
+        own_thread = threading.get_ident()
+        start = time.perf_counter()
+        deadline = start + seconds
+        while time.perf_counter() < deadline:
+            self._sample(own_thread)
+            time.sleep(self.interval)
+        self.duration = time.perf_counter() - start
+        return self
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top(self, limit: int) -> List[Tuple[str, int, int]]:
+        # Собственное время - выборки, где функция на вершине стека; общее - где она есть в стеке хоть раз.
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        return [(name, count, total[name]) for name, count in own.most_common(limit)]
+
+    def summary(self, limit: int) -> str:
+        busy = self.samples - self.idle
+        lines = [f"Профиль за {self.duration:.1f} с: {self.samples} выборок, в работе {busy}, простой {self.idle}"]
+        if busy:
+            lines.append("своё% / всего% функция")
+            lines.extend(
+                f"{own * 100 / busy:5.1f} / {total * 100 / busy:5.1f} {name}"
+                for name, own, total in self.top(limit)
+            )
+        return "\n".join(lines)
+
+
+_profile_lock = threading.Lock()
+
+
+def run_profile(seconds: float, interval: float = config.PROFILE_INTERVAL) -> SamplingProfiler:
+    # Одновременно работает один профилировщик: два сразу только исказят друг другу выборки.
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("profiler is already running")
+    try:
+        return SamplingProfiler(interval).run(seconds)
+    finally:
+        _profile_lock.release()
+
+
+slow_updates = SlowUpdateLog()
@@ -0,0 +1,124 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Hashable, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucketLimiter:
+    def __init__(self, capacity: int, refill_seconds: float, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate = 1.0 / refill_seconds
+        # Через это время ведро снова полное, так что его удаление ничего не меняет.
+        self.idle_ttl = capacity * refill_seconds
+        self.clock = clock
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, key: Hashable) -> bool:
+        with self._lock:
+            now = self.clock()
+            self._evict(now)
+
+            tokens, updated_at = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self._buckets[key] = (tokens, now)
+            return allowed
+
+    def retry_in(self, key: Hashable) -> float:
+        # Через сколько секунд allow() для ключа вернёт True; токен при этом не списывается.
+        with self._lock:
+            entry = self._buckets.get(key)
+            if entry is None:
+                return 0.0
+            tokens, updated_at = entry
+            tokens = min(self.capacity, tokens + (self.clock() - updated_at) * self.rate)
+            return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def _evict(self, now: float) -> None:
+        # Записи упорядочены по времени обновления, поэтому просроченные всегда в начале.
+        while self._buckets:
+            _, (_, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < self.idle_ttl:
+                break
+            self._buckets.popitem(last=False)
+
+
+class SqliteRateLimiter:
+    EVICT_INTERVAL = 60.0
+
+    def __init__(self, file_path: Path, capacity: int, refill_seconds: float):
+        self.file_path = Path(file_path)
+        self.capacity = capacity
+        self.rate = 1.0 / refill_seconds
+        self.idle_ttl = capacity * refill_seconds
+        self._next_eviction = 0.0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(self.file_path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS buckets_updated_at ON buckets (updated_at);
+        """)
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM buckets").fetchone()[0]
+
+    def allow(self, key: Hashable) -> bool:
+        key = str(key)
+        with self._lock:
+            now = time.time()
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                row = self.conn.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated_at = row if row else (self.capacity, now)
+                tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (key, tokens, now)
+                )
+                if now >= self._next_eviction:
+                    self.conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - self.idle_ttl,))
+                    self._next_eviction = now + self.EVICT_INTERVAL
+                self.conn.execute("COMMIT")
+                return allowed
+
+            except sqlite3.Error as e:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                logger.error(f"Ошибка общего ограничителя частоты: {e}")
+                return True
+
+
+def create_rate_limiter():
+    if config.RATE_LIMIT_BACKEND == 'sqlite':
+        return SqliteRateLimiter(config.RATE_LIMIT_DB_FILE, config.RATE_LIMIT_BURST, config.MESSAGE_LIMIT_SECONDS)
+    return TokenBucketLimiter(config.RATE_LIMIT_BURST, config.MESSAGE_LIMIT_SECONDS)
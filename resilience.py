@@ -0,0 +1,82 @@
+import logging
+import random
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, recovery_timeout: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self.clock() - self.opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        state = self.state
+        return state == self.OPEN or (state == self.HALF_OPEN and self._probe_in_flight)
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self) -> None:
+        # Пробный запрос отменили, не дождавшись ответа: следующий запрос сможет проверить сервис заново.
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        if self._state != self.CLOSED:
+            logger.info("Circuit breaker closed")
+        self._state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probe_in_flight or self.failures >= self.failure_threshold:
+            if self._state != self.OPEN or self._probe_in_flight:
+                logger.warning(f"Circuit breaker opened after {self.failures} failures")
+            self._state = self.OPEN
+            self.opened_at = self.clock()
+            self._probe_in_flight = False
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float):
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from config import config
+from text_processing import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int, ttl: float, disk_path: Optional[Path] = None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._disk: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._open_disk(Path(disk_path))
+
+    @staticmethod
+    def make_key(question: str, model_uri: str, system_prompt: str, temperature: float) -> str:
+        payload = json.dumps([normalize_text(question), model_uri, system_prompt, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[str]:
+        now = self.clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                text, expires_at = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return text
+                del self._data[key]
+                self.expirations += 1
+
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                self._store(key, *entry)
+                self.disk_hits += 1
+                return entry[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, text: str) -> None:
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            self._store(key, text, expires_at)
+            self._disk_put(key, text, expires_at)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+    def _store(self, key: str, text: str, expires_at: float) -> None:
+        self._data[key] = (text, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _open_disk(self, path: Path) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._disk = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("PRAGMA synchronous=NORMAL")
+            self._disk.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, text TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._disk.execute("DELETE FROM responses WHERE expires_at <= ?", (self.clock(),))
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open response cache {path}: {e}")
+            self._disk = None
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        if self._disk is None:
+            return None
+        try:
+            return self._disk.execute(
+                "SELECT text, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Response cache read failed: {e}")
+            return None
+
+    def _disk_put(self, key: str, text: str, expires_at: float) -> None:
+        if self._disk is None:
+            return
+        try:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO responses (key, text, expires_at) VALUES (?, ?, ?)",
+                (key, text, expires_at)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Response cache write failed: {e}")
@@ -0,0 +1,217 @@
+import heapq
+import itertools
+import math
+import sys
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from cow_collections import ChunkedList, ShardedDict
+from text_processing import tokenize
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RERANK_CANDIDATES = 10
+FREQUENT_TERM_POSTINGS = 2000
+# Больше документов на запрос точно не считаем: у запроса из одного частого терма берём первые попавшиеся.
+MAX_SCORED_DOCS = 2000
+
+
+def bm25_idf(doc_freq: int, doc_count: int) -> float:
+    return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def bm25_term_weight(tf: int, doc_length: int, avg_length: float) -> float:
+    norm = 1 - BM25_B + BM25_B * doc_length / avg_length if avg_length else 1.0
+    return tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+
+def bm25_similarity(query_terms: Dict[str, int], doc_terms: Dict[str, int],
+                    idf: Dict[str, float], avg_length: float) -> float:
+    doc_length = sum(doc_terms.values())
+    doc_self_score = sum(
+        idf.get(term, 0.0) * bm25_term_weight(tf, doc_length, avg_length)
+        for term, tf in doc_terms.items()
+    )
+    query_weight = sum(idf.get(term, 0.0) for term in query_terms)
+    if not doc_self_score or not query_weight:
+        return 0.0
+
+    score = 0.0
+    matched_weight = 0.0
+    for term in query_terms:
+        tf = doc_terms.get(term)
+        if tf:
+            score += idf[term] * bm25_term_weight(tf, doc_length, avg_length)
+            matched_weight += idf[term]
+
+    return min(1.0, score / doc_self_score * matched_weight / query_weight)
+
+
+class SearchIndex:
+    def __init__(self):
+        # Терм -> {id документа: tf}; словарь термов блочный, чтобы копия индекса не перебирала весь словарь.
+        self.postings = ShardedDict()
+        # Термы документа как кортеж интернированных строк: словарь на каждый вопрос обходится слишком дорого.
+        self.doc_terms = ChunkedList()
+        self.doc_lengths = array('I')
+        self.total_length = 0
+        # Терм -> (наибольший tf, наименьшая длина документа) среди его документов: из них верхняя оценка
+        # вклада терма, вес BM25 растёт с tf и падает с длиной документа.
+        self.term_bounds = ShardedDict()
+        # Термы, чьи списки документов принадлежат этой копии индекса; None - все.
+        self._owned: Optional[Set[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def add(self, text: str) -> int:
+        doc_id = len(self.doc_terms)
+        terms = tuple(sys.intern(term) for term in tokenize(text))
+
+        for term, tf in Counter(terms).items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+            elif self._owned is not None and term not in self._owned:
+                # Копирование при записи: опубликованная версия продолжает видеть старый список.
+                postings = self.postings[term] = dict(postings)
+            if self._owned is not None:
+                self._owned.add(term)
+            postings[doc_id] = tf
+
+            bound = self.term_bounds.get(term)
+            if bound is None or tf > bound[0] or len(terms) < bound[1]:
+                self.term_bounds[term] = (max(tf, bound[0]), min(len(terms), bound[1])) if bound else (tf, len(terms))
+
+        self.doc_terms.append(terms)
+        self.doc_lengths.append(len(terms))
+        self.total_length += len(terms)
+        return doc_id
+
+    def copy(self) -> 'SearchIndex':
+        index = SearchIndex.__new__(SearchIndex)
+        index.postings = self.postings.copy()
+        index.doc_terms = self.doc_terms.copy()
+        index.doc_lengths = self.doc_lengths[:]
+        index.total_length = self.total_length
+        index.term_bounds = self.term_bounds.copy()
+        index._owned = set()
+        return index
+
+    def search(self, text: str) -> Tuple[Optional[int], float]:
+        candidates = self.candidates(text)
+        return max(candidates, key=lambda candidate: candidate[1]) if candidates else (None, 0.0)
+
+    def candidates(self, text: str) -> List[Tuple[int, float]]:
+        query_terms = dict(Counter(tokenize(text)))
+        doc_count = len(self.doc_terms)
+        if not query_terms or not doc_count:
+            return []
+
+        avg_length = self.total_length / doc_count
+        idf = {
+            term: bm25_idf(len(self.postings[term]), doc_count)
+            for term in query_terms if term in self.postings
+        }
+
+        terms = sorted(idf, key=lambda t: len(self.postings[t]))
+        scores = self._top_scores(terms, idf, avg_length)
+        if scores is None:
+            scores = self._accumulate(terms, idf, avg_length)
+
+        candidates = []
+        for doc_id in heapq.nlargest(RERANK_CANDIDATES, scores, key=scores.__getitem__):
+            doc_terms = dict(Counter(self.doc_terms[doc_id]))
+            for term in doc_terms:
+                if term not in idf:
+                    idf[term] = bm25_idf(len(self.postings[term]), doc_count)
+
+            score = bm25_similarity(query_terms, doc_terms, idf, avg_length)
+            if score > 0:
+                candidates.append((doc_id, score))
+
+        return candidates
+
+    def _top_scores(self, terms: List[str], idf: Dict[str, float],
+                    avg_length: float) -> Optional[Dict[int, float]]:
+        # MaxScore: документы со всеми термами запроса задают порог - RERANK_CANDIDATES-й лучший счёт.
+        # Терм обязателен, если без него сумма верхних оценок остальных термов ниже порога: документ
+        # без такого терма в лучшие не попадёт. Пересечения списков считает C-код множеств, а по одному
+        # в Python оцениваются только документы со всеми обязательными термами.
+        postings = [self.postings[term] for term in terms]
+        prefixes = self._intersect(postings)
+        matched = prefixes[-1]
+        if len(matched) < RERANK_CANDIDATES:
+            return None
+
+        scores = self._score(matched, postings, terms, idf, avg_length)
+        threshold = heapq.nlargest(RERANK_CANDIDATES, scores.values())[-1]
+        bounds = []
+        for term in terms:
+            max_tf, min_length = self.term_bounds[term]
+            bounds.append(idf[term] * bm25_term_weight(max_tf, min_length, avg_length))
+        total = sum(bounds)
+        required = [i for i, bound in enumerate(bounds) if total - bound < threshold]
+        if len(required) == len(postings):
+            return scores
+        if not required:
+            return None
+
+        # Обычно обязательны самые редкие термы, и их пересечение уже посчитано по дороге.
+        if required == list(range(len(required))):
+            rest = prefixes[len(required) - 1] - matched
+        else:
+            rest = self._intersect([postings[i] for i in required])[-1] - matched
+        scores.update(self._score(rest, postings, terms, idf, avg_length))
+        return scores
+
+    @staticmethod
+    def _intersect(postings: List[Dict[int, int]]) -> List[Set[int]]:
+        # Пересечения первых 1, 2, ... списков; списки идут от коротких к длинным, так что каждое
+        # пересечение не больше первого списка.
+        prefixes = [postings[0].keys()]
+        for term_postings in postings[1:]:
+            prefixes.append(term_postings.keys() & prefixes[-1])
+        return prefixes
+
+    def _score(self, doc_ids: Set[int], postings: List[Dict[int, int]], terms: List[str],
+               idf: Dict[str, float], avg_length: float) -> Dict[int, float]:
+        # bm25_term_weight, развёрнутая в цикле: tf * (k1 + 1) / (tf + k1 * norm); вызов функции на каждую
+        # пару документ-терм здесь дороже самой формулы.
+        weights = [idf[term] * (BM25_K1 + 1) for term in terms]
+        base = BM25_K1 * (1 - BM25_B) if avg_length else BM25_K1
+        per_length = BM25_K1 * BM25_B / avg_length if avg_length else 0.0
+        if len(doc_ids) > MAX_SCORED_DOCS:
+            doc_ids = itertools.islice(doc_ids, MAX_SCORED_DOCS)
+        doc_lengths = self.doc_lengths
+        scores = {}
+        for doc_id in doc_ids:
+            norm = base + per_length * doc_lengths[doc_id]
+            score = 0.0
+            for term_postings, weight in zip(postings, weights):
+                tf = term_postings.get(doc_id)
+                if tf:
+                    score += weight * tf / (tf + norm)
+            scores[doc_id] = score
+        return scores
+
+    def _accumulate(self, terms: List[str], idf: Dict[str, float], avg_length: float) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        # Редкие термы порождают кандидатов, частые только досчитывают уже найденных.
+        for term in terms:
+            postings = self.postings[term]
+            term_idf = idf[term]
+
+            if scores and len(postings) > FREQUENT_TERM_POSTINGS:
+                for doc_id in scores:
+                    tf = postings.get(doc_id)
+                    if tf:
+                        scores[doc_id] += term_idf * bm25_term_weight(
+                            tf, self.doc_lengths[doc_id], avg_length)
+                continue
+
+            for doc_id, tf in postings.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + term_idf * bm25_term_weight(
+                    tf, self.doc_lengths[doc_id], avg_length)
+        return scores
@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+
+from config import config
+from metrics import SEND_WAIT_SECONDS
+from rate_limiter import TokenBucketLimiter
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = 'global'
+
+
+class Priority(IntEnum):
+    ANSWER = 0
+    INTERACTIVE = 1
+    PLACEHOLDER = 2
+    PROMPT = 3
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'chat_id', 'send', 'key', 'futures', 'attempts', 'enqueued_at', 'superseded')
+
+    def __init__(self, priority: Priority, seq: int, chat_id: Hashable, send: Callable[[], Awaitable],
+                 key: Optional[Hashable], future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.send = send
+        self.key = key
+        self.futures = [future]
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        self.superseded = False
+
+    def __lt__(self, other: '_Job') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendQueue:
+    def __init__(self, global_rate: Optional[float] = None, chat_interval: Optional[float] = None,
+                 max_retries: Optional[int] = None):
+        # Настройки читаются при создании, а не при импорте: воркер супервизора делит SEND_GLOBAL_RATE уже после импорта.
+        global_rate = config.SEND_GLOBAL_RATE if global_rate is None else global_rate
+        chat_interval = config.SEND_CHAT_INTERVAL if chat_interval is None else chat_interval
+        self.global_bucket = TokenBucketLimiter(config.SEND_GLOBAL_BURST, 1.0 / global_rate)
+        self.chat_buckets = TokenBucketLimiter(config.SEND_CHAT_BURST, chat_interval)
+        self.max_retries = config.SEND_MAX_RETRIES if max_retries is None else max_retries
+
+        self._heap: List[_Job] = []
+        # Сообщения чатов, которым сейчас писать нельзя, лежат отдельно до времени из _wake_at,
+        # чтобы поиск следующего сообщения не перебирал их на каждой отправке.
+        self._parked: Dict[Hashable, List[_Job]] = {}
+        self._wake_at: List[Tuple[float, Hashable]] = []
+        # Ключ правки -> ещё не отправленная правка; новая правка того же сообщения её заменяет.
+        self._pending: Dict[Hashable, _Job] = {}
+        self._blocked_until: Dict[Hashable, float] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight = set()
+
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        parked = sum(not job.superseded for jobs in self._parked.values() for job in jobs)
+        return parked + sum(not job.superseded for job in self._heap)
+
+    @property
+    def blocked_chats(self) -> int:
+        now = time.monotonic()
+        return sum(until > now for until in self._blocked_until.values())
+
+    def submit(self, chat_id: Hashable, priority: Priority, send: Callable[[], Awaitable],
+               key: Optional[Hashable] = None) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+            self._task.add_done_callback(self._dispatcher_done)
+
+        future = loop.create_future()
+        job = _Job(priority, next(self._seq), chat_id, send, key, future)
+        if key is not None:
+            previous = self._pending.get(key)
+            if previous is not None:
+                # Ждавшие старую правку получат результат новой; место в очереди и приоритет - лучшие из двух.
+                previous.superseded = True
+                job.futures = previous.futures + job.futures
+                job.priority = min(job.priority, previous.priority)
+                job.seq = previous.seq
+                job.enqueued_at = previous.enqueued_at
+                self.coalesced += 1
+            self._pending[key] = job
+
+        self._enqueue(job)
+        self._wakeup.set()
+        return future
+
+    def _enqueue(self, job: _Job):
+        parked = self._parked.get(job.chat_id)
+        if parked is not None:
+            parked.append(job)
+        else:
+            heapq.heappush(self._heap, job)
+
+    def reply(self, message, text: str, priority: Priority = Priority.INTERACTIVE, **kwargs) -> asyncio.Future:
+        return self.submit(message.chat_id, priority, lambda: message.reply_text(text, **kwargs))
+
+    def edit(self, message, text: str, priority: Priority = Priority.INTERACTIVE, **kwargs) -> asyncio.Future:
+        return self.submit(
+            message.chat_id, priority, lambda: message.edit_text(text, **kwargs),
+            key=(message.chat_id, message.message_id)
+        )
+
+    def edit_query(self, query, text: str, priority: Priority = Priority.INTERACTIVE, **kwargs) -> asyncio.Future:
+        message = query.message
+        return self.submit(
+            message.chat_id, priority, lambda: query.edit_message_text(text, **kwargs),
+            key=(message.chat_id, message.message_id)
+        )
+
+    def _dispatcher_done(self, task: asyncio.Task):
+        # Если диспетчер всё же завершился, следующий submit запустит новый, а не оставит ждать вечно.
+        if self._task is task:
+            self._task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Send queue dispatcher stopped: {task.exception()}")
+
+    async def _run(self):
+        while True:
+            try:
+                job, delay = self._next_job()
+            except Exception as e:
+                logger.exception(f"Send queue dispatcher error: {e}")
+                job, delay = None, 1.0
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Отправка идёт отдельной задачей: медленный запрос к Telegram не держит остальные чаты.
+            task = asyncio.create_task(self._deliver(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    def _next_job(self) -> Tuple[Optional[_Job], Optional[float]]:
+        now = time.monotonic()
+        while self._wake_at and self._wake_at[0][0] <= now:
+            _, chat_id = heapq.heappop(self._wake_at)
+            for job in self._parked.pop(chat_id, ()):
+                if not job.superseded:
+                    heapq.heappush(self._heap, job)
+
+        while self._heap and self._heap[0].superseded:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None, self._next_wake(now)
+
+        global_wait = self.global_bucket.retry_in(GLOBAL_KEY)
+        if global_wait > 0:
+            return None, global_wait
+
+        # Берём самое приоритетное сообщение из тех чатов, что сейчас можно писать. Чат, которому писать
+        # рано, откладываем целиком: каждое сообщение перекладывается один раз за период ожидания чата.
+        while self._heap:
+            job = heapq.heappop(self._heap)
+            if job.superseded:
+                continue
+            parked = self._parked.get(job.chat_id)
+            if parked is not None:
+                parked.append(job)
+                continue
+            wait = max(self._blocked_until.get(job.chat_id, 0.0) - now, self.chat_buckets.retry_in(job.chat_id))
+            if wait <= 0:
+                break
+            self._parked[job.chat_id] = [job]
+            heapq.heappush(self._wake_at, (now + wait, job.chat_id))
+        else:
+            return None, self._next_wake(now)
+
+        self._blocked_until.pop(job.chat_id, None)
+        if job.key is not None and self._pending.get(job.key) is job:
+            del self._pending[job.key]
+        self.global_bucket.allow(GLOBAL_KEY)
+        self.chat_buckets.allow(job.chat_id)
+        return job, None
+
+    def _next_wake(self, now: float) -> Optional[float]:
+        return max(0.0, self._wake_at[0][0] - now) if self._wake_at else None
+
+    async def _deliver(self, job: _Job):
+        if not job.attempts:
+            SEND_WAIT_SECONDS.labels(job.priority.name.lower()).observe(time.monotonic() - job.enqueued_at)
+        try:
+            result = await job.send()
+        except RetryAfter as e:
+            self.retried += 1
+            delay = retry_after_seconds(e)
+            self._blocked_until[job.chat_id] = time.monotonic() + delay
+            newer = self._pending.get(job.key) if job.key is not None else None
+            if newer is not None:
+                # Пока ждали, пришла более новая правка того же сообщения - повторять старую незачем.
+                newer.futures = job.futures + newer.futures
+                self._wakeup.set()
+                return
+            if job.attempts < self.max_retries:
+                job.attempts += 1
+                if job.key is not None:
+                    self._pending[job.key] = job
+                self._enqueue(job)
+                self._wakeup.set()
+                logger.warning(f"Flood control for chat {job.chat_id}, retry in {delay}s")
+                return
+            self._fail(job, e)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.sent += 1
+            for future in job.futures:
+                if not future.done():
+                    future.set_result(result)
+
+    def _fail(self, job: _Job, error: Exception):
+        self.failed += 1
+        for future in job.futures:
+            if not future.done():
+                future.set_exception(error)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._in_flight):
+            task.cancel()
+        for jobs in [self._heap, *self._parked.values()]:
+            for job in jobs:
+                for future in job.futures:
+                    future.cancel()
+        self._heap.clear()
+        self._parked.clear()
+        self._wake_at.clear()
+        self._pending.clear()
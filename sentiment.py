@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from config import config
+from text_processing import normalize_text, stem
+
+logger = logging.getLogger(__name__)
+
+POSITIVE_WORDS = """
+хороший хорошо отличный отлично прекрасный замечательный полезный удобный понятный спасибо благодарю
+нравится рад лучший интересный эффективный надежный быстрый супер класс круто
+good great excellent thanks thank nice useful helpful love perfect
+"""
+NEGATIVE_WORDS = """
+плохой плохо ужасный ужасно бесполезный неудобный непонятный ошибка проблема сломался отвратительный
+медленный хуже глупый раздражает злой ненавижу отстой кошмар сбой угрожать
+bad terrible awful useless broken hate wrong slow poor worst
+"""
+NEGATIONS = frozenset({"не", "нет", "ни", "not", "no"})
+
+
+class LexiconSentimentAnalyzer:
+    def __init__(self):
+        self.positive = frozenset(stem(word) for word in POSITIVE_WORDS.split())
+        self.negative = frozenset(stem(word) for word in NEGATIVE_WORDS.split())
+
+    def polarity(self, normalized_text: str) -> float:
+        score = 0
+        hits = 0
+        negate = False
+
+        for token in normalized_text.split():
+            if token in NEGATIONS:
+                negate = True
+                continue
+
+            token_stem = stem(token)
+            if token_stem in self.positive:
+                value = 1
+            elif token_stem in self.negative:
+                value = -1
+            else:
+                value = 0
+
+            if value:
+                score += -value if negate else value
+                hits += 1
+            negate = False
+
+        return score / hits if hits else 0.0
+
+
+class TextBlobSentimentAnalyzer:
+    def __init__(self):
+        from textblob import TextBlob
+        from textblob.exceptions import NotTranslated
+
+        self._text_blob = TextBlob
+        self._not_translated = NotTranslated
+
+    def polarity(self, normalized_text: str) -> float:
+        try:
+            return self._text_blob(normalized_text).sentiment.polarity
+        except self._not_translated:
+            return 0.0
+
+
+ANALYZERS: Dict[str, Callable[[], object]] = {
+    'lexicon': LexiconSentimentAnalyzer,
+    'textblob': TextBlobSentimentAnalyzer,
+}
+
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+_analyzers: Dict[str, object] = {}
+_cache = LRUCache(config.SENTIMENT_CACHE_SIZE)
+_executor = None
+
+
+def register_analyzer(name: str, factory: Callable[[], object]) -> None:
+    ANALYZERS[name] = factory
+    _analyzers.pop(name, None)
+
+
+def get_analyzer(name: Optional[str] = None):
+    name = name or config.SENTIMENT_ANALYZER
+    analyzer = _analyzers.get(name)
+    if analyzer is None:
+        analyzer = _analyzers[name] = ANALYZERS[name]()
+    return analyzer
+
+
+def _label(polarity: float) -> str:
+    if polarity > 0.1:
+        return "positive"
+    elif polarity < -0.1:
+        return "negative"
+    return "neutral"
+
+
+def _score(normalized_text: str, analyzer_name: Optional[str] = None) -> str:
+    try:
+        return _label(get_analyzer(analyzer_name).polarity(normalized_text))
+    except Exception as e:
+        logger.error(f"Error analyzing sentiment: {e}")
+        return "neutral"
+
+
+def _score_batch(normalized_texts: List[str], analyzer_name: str) -> List[str]:
+    return [_score(text, analyzer_name) for text in normalized_texts]
+
+
+def analyze_sentiment(text: str) -> str:
+    normalized = normalize_text(text)
+    sentiment = _cache.get(normalized)
+    if sentiment is None:
+        sentiment = _score(normalized)
+        _cache.put(normalized, sentiment)
+    return sentiment
+
+
+async def analyze_sentiment_batch(texts: List[str]) -> List[str]:
+    global _executor
+
+    normalized = [normalize_text(text) for text in texts]
+    results = {text: _cache.get(text) for text in set(normalized)}
+    misses = [text for text, sentiment in results.items() if sentiment is None]
+
+    if misses:
+        if _executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn, а не fork: форк из процесса с потоками наследует захваченные блокировки (кэш, логирование).
+            # Рабочий импортирует модуль заново и находит анализатор по имени в ANALYZERS.
+            _executor = ProcessPoolExecutor(
+                max_workers=config.SENTIMENT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+
+        chunk_size = max(1, len(misses) // config.SENTIMENT_WORKERS + 1)
+        chunks = [misses[i:i + chunk_size] for i in range(0, len(misses), chunk_size)]
+        loop = asyncio.get_running_loop()
+        scored = await asyncio.gather(*(
+            loop.run_in_executor(_executor, _score_batch, chunk, config.SENTIMENT_ANALYZER)
+            for chunk in chunks
+        ))
+
+        for chunk, sentiments in zip(chunks, scored):
+            for text, sentiment in zip(chunk, sentiments):
+                results[text] = sentiment
+                _cache.put(text, sentiment)
+
+    return [results[text] for text in normalized]
+
+
+def shutdown_sentiment_workers() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
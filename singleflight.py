@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class _Call:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        call = self._calls.get(key)
+        shared = call is not None
+
+        if shared:
+            self.coalesced += 1
+            logger.info(f"Coalesced in-flight request ({self.coalesced} total)")
+        else:
+            self.calls += 1
+            call = _Call(asyncio.ensure_future(func()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._forget(key, task))
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        except asyncio.CancelledError:
+            if not call.task.done() and call.waiters == 1:
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        call = self._calls.get(key)
+        if call is not None and call.task is task:
+            del self._calls[key]
+
+        # Ошибку получат ожидающие; здесь только помечаем её как извлечённую.
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,346 @@
+import logging
+import sqlite3
+import sys
+import threading
+from array import array
+from collections import Counter
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from config import config
+from knowledge_base import KBPage
+from metrics import KB_NEAR_DUPLICATES
+from profiler import stage
+from near_duplicates import band_keys, minhash, signature_similarity
+from search_index import RERANK_CANDIDATES, bm25_idf, bm25_similarity
+from text_processing import tokenize
+
+logger = logging.getLogger(__name__)
+
+BAND_KEYS_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    answer_id INTEGER NOT NULL REFERENCES answers(id),
+    text TEXT NOT NULL,
+    terms TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    UNIQUE (answer_id, text)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    doc_count INTEGER NOT NULL,
+    total_length INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO stats (id, doc_count, total_length) VALUES (1, 0, 0);
+CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+    terms, content='questions', content_rowid='id', tokenize='unicode61'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS questions_vocab USING fts5vocab(questions_fts, 'row');
+CREATE TABLE IF NOT EXISTS answer_signatures (
+    answer_id INTEGER PRIMARY KEY REFERENCES answers(id),
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS answer_bands (
+    key INTEGER NOT NULL,
+    answer_id INTEGER NOT NULL REFERENCES answers(id)
+);
+CREATE INDEX IF NOT EXISTS answer_bands_key ON answer_bands (key);
+CREATE TRIGGER IF NOT EXISTS questions_ai AFTER INSERT ON questions BEGIN
+    INSERT INTO questions_fts (rowid, terms) VALUES (new.id, new.terms);
+    UPDATE stats SET doc_count = doc_count + 1, total_length = total_length + new.length WHERE id = 1;
+END;
+"""
+
+
+class SqliteKnowledgeBase:
+    def __init__(self, file_path: str):
+        self.file_path = Path(file_path)
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self.feedback = None
+
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # user_version 1: ключи полос LSH считаются через blake2b вместо hash().
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] >= BAND_KEYS_VERSION:
+            return
+        with self._write() as conn:
+            rows = conn.execute("SELECT answer_id, signature FROM answer_signatures").fetchall()
+            conn.execute("DELETE FROM answer_bands")
+            conn.executemany(
+                "INSERT INTO answer_bands (key, answer_id) VALUES (?, ?)",
+                [(key, answer_id) for answer_id, blob in rows
+                 for key in band_keys(array('I', blob), config.NEAR_DUP_BANDS)]
+            )
+            conn.execute(f"PRAGMA user_version={BAND_KEYS_VERSION}")
+        if rows:
+            logger.info(f"Ключи похожих ответов пересчитаны для {len(rows)} ответов")
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.file_path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _write(self):
+        return _Transaction(self.conn)
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM answers").fetchone()[0]
+
+    def items(self) -> Iterator[Tuple[str, List[str]]]:
+        rows = self.conn.execute(
+            "SELECT a.text, q.text FROM answers a JOIN questions q ON q.answer_id = a.id "
+            "ORDER BY a.id, q.id"
+        )
+        for answer, group in groupby(rows, key=lambda row: row[0]):
+            yield answer, [question for _, question in group]
+
+    def page(self, cursor: int, limit: int) -> KBPage:
+        # Курсор - id последнего ответа предыдущей страницы (keyset-пагинация).
+        rows = self.conn.execute(
+            "SELECT id FROM answers WHERE id > ? ORDER BY id LIMIT ?", (cursor, limit + 1)
+        ).fetchall()
+        ids = [row[0] for row in rows[:limit]]
+
+        prev_cursor = None
+        if cursor > 0:
+            row = self.conn.execute(
+                "SELECT id FROM answers WHERE id <= ? ORDER BY id DESC LIMIT 1 OFFSET ?", (cursor, limit)
+            ).fetchone()
+            prev_cursor = row[0] if row else 0
+
+        return KBPage(self.entries(ids), prev_cursor, ids[-1] if len(rows) > limit else None)
+
+    def search_answers(self, text: str, limit: int) -> List[int]:
+        terms = set(tokenize(text))
+        if not terms:
+            return []
+
+        rows = self.conn.execute(
+            "SELECT DISTINCT q.answer_id FROM questions_fts "
+            "JOIN questions q ON q.id = questions_fts.rowid "
+            "WHERE questions_fts MATCH ? ORDER BY q.answer_id LIMIT ?",
+            (" AND ".join(f'"{term}"' for term in terms), limit)
+        )
+        return [row[0] for row in rows]
+
+    def entries(self, refs: List[int]) -> List[Tuple[str, List[str]]]:
+        if not refs:
+            return []
+        placeholders = ",".join("?" * len(refs))
+        rows = self.conn.execute(
+            "SELECT a.id, a.text, q.text FROM answers a JOIN questions q ON q.answer_id = a.id "
+            f"WHERE a.id IN ({placeholders}) ORDER BY a.id, q.id",
+            refs
+        )
+        return [
+            (answer, [question for _, _, question in group])
+            for (_, answer), group in groupby(rows, key=lambda row: row[:2])
+        ]
+
+    def save(self):
+        try:
+            with stage('kb_save'):
+                self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except Exception as e:
+            logger.error(f"Ошибка сохранения базы знаний: {e}")
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def find_answer(self, user_question: str) -> tuple:
+        try:
+            query_terms = dict(Counter(tokenize(user_question)))
+            if not query_terms:
+                return None, 0.0
+
+            match = " OR ".join(f'"{term}"' for term in query_terms)
+            candidates = self.conn.execute(
+                "SELECT a.text, q.terms FROM questions_fts "
+                "JOIN questions q ON q.id = questions_fts.rowid "
+                "JOIN answers a ON a.id = q.answer_id "
+                "WHERE questions_fts MATCH ? ORDER BY bm25(questions_fts) LIMIT ?",
+                (match, RERANK_CANDIDATES)
+            ).fetchall()
+            if not candidates:
+                return None, 0.0
+
+            doc_count, total_length = self.conn.execute(
+                "SELECT doc_count, total_length FROM stats WHERE id = 1"
+            ).fetchone()
+            avg_length = total_length / doc_count if doc_count else 0.0
+
+            candidate_terms = [dict(Counter(terms.split())) for _, terms in candidates]
+            idf = self._idf(set(query_terms).union(*candidate_terms), doc_count)
+
+            scored = [
+                (answer, bm25_similarity(query_terms, doc_terms, idf, avg_length))
+                for (answer, _), doc_terms in zip(candidates, candidate_terms)
+            ]
+            if self.feedback is not None and self.feedback.aggregates:
+                return self.feedback.rank(scored)
+
+            best_answer, best_score = None, 0.0
+            for answer, score in scored:
+                if score > best_score:
+                    best_answer, best_score = answer, score
+            return best_answer, best_score
+
+        except Exception as e:
+            logger.error(f"Ошибка поиска ответа: {e}")
+            return None, 0.0
+
+    def _idf(self, terms, doc_count: int) -> Dict[str, float]:
+        terms = list(terms)
+        placeholders = ",".join("?" * len(terms))
+        rows = self.conn.execute(
+            f"SELECT term, doc FROM questions_vocab WHERE term IN ({placeholders})", terms
+        )
+        return {term: bm25_idf(doc_freq, doc_count) for term, doc_freq in rows}
+
+    def add_question_answer(self, question: str, answer: str, merge_similar: bool = False, batched: bool = False):
+        # batched нужен только JSON-базе: здесь запись видна сразу после коммита.
+        try:
+            question = question.strip()
+            answer = answer.strip()
+
+            if not question or not answer:
+                return
+
+            with stage('kb_save'), self._write() as conn:
+                if not self._insert(conn, question, answer, merge_similar):
+                    return
+
+            logger.info(f"Автосохранение: Q: {question[:50]}... | A: {answer[:50]}...")
+        except Exception as e:
+            logger.error(f"Ошибка автосохранения: {e}")
+
+    def add_many(self, pairs: Iterable[Tuple[str, str]], merge_similar: bool = False) -> int:
+        added = 0
+        with self._write() as conn:
+            for question, answer in pairs:
+                question = question.strip()
+                answer = answer.strip()
+                if question and answer:
+                    added += self._insert(conn, question, answer, merge_similar)
+
+        logger.info(f"Массовое добавление: {added} новых вопросов")
+        return added
+
+    def import_base(self, base: Dict[str, List[str]]) -> int:
+        added = 0
+        with self._write() as conn:
+            for answer, questions in base.items():
+                for question in questions:
+                    added += self._insert(conn, question.strip(), answer.strip())
+        return added
+
+    @classmethod
+    def _insert(cls, conn: sqlite3.Connection, question: str, answer: str, merge_similar: bool = False) -> bool:
+        row = conn.execute("SELECT id FROM answers WHERE text = ?", (answer,)).fetchone()
+        if row is not None:
+            answer_id = row[0]
+        else:
+            answer_id = cls._insert_answer(conn, answer, merge_similar)
+
+        terms = tokenize(question)
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO questions (answer_id, text, terms, length) VALUES (?, ?, ?, ?)",
+            (answer_id, question, " ".join(terms), len(terms))
+        )
+        return cursor.rowcount > 0
+
+
+    @staticmethod
+    def _insert_answer(conn: sqlite3.Connection, answer: str, merge_similar: bool) -> int:
+        signature = None
+        if config.NEAR_DUP_ENABLED:
+            signature = minhash(answer, config.NEAR_DUP_NUM_PERM, config.NEAR_DUP_SHINGLE_SIZE)
+
+        if signature is not None:
+            keys = band_keys(signature, config.NEAR_DUP_BANDS)
+            if merge_similar:
+                placeholders = ",".join("?" * len(keys))
+                candidates = conn.execute(
+                    "SELECT s.answer_id, s.signature FROM answer_signatures s WHERE s.answer_id IN "
+                    f"(SELECT answer_id FROM answer_bands WHERE key IN ({placeholders}))",
+                    keys
+                ).fetchall()
+
+                best_id, best_similarity = None, 0.0
+                for candidate_id, blob in candidates:
+                    similarity = signature_similarity(signature, array('I', blob))
+                    if similarity >= config.NEAR_DUP_THRESHOLD and similarity > best_similarity:
+                        best_id, best_similarity = candidate_id, similarity
+                if best_id is not None:
+                    logger.info(f"Ответ объединён с похожим ответом #{best_id} (сходство {best_similarity:.2f})")
+                    KB_NEAR_DUPLICATES.inc()
+                    return best_id
+
+        answer_id = conn.execute("INSERT INTO answers (text) VALUES (?)", (answer,)).lastrowid
+        if signature is not None:
+            conn.execute(
+                "INSERT INTO answer_signatures (answer_id, signature) VALUES (?, ?)",
+                (answer_id, array('I', signature).tobytes())
+            )
+            conn.executemany(
+                "INSERT INTO answer_bands (key, answer_id) VALUES (?, ?)", [(key, answer_id) for key in keys]
+            )
+        return answer_id
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def migrate_from_json(json_path: Path, db_path: Path) -> int:
+    from knowledge_base import KnowledgeBase
+
+    source = KnowledgeBase(json_path)
+    target = SqliteKnowledgeBase(db_path)
+    try:
+        added = target.import_base(source.store.to_dict())
+    finally:
+        source.close()
+        target.close()
+
+    logger.info(f"Перенесено в {db_path}: {added} вопросов")
+    return added
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    json_path = Path(sys.argv[1]) if len(sys.argv) > 1 else config.KNOWLEDGE_BASE_FILE
+    db_path = Path(sys.argv[2]) if len(sys.argv) > 2 else config.KNOWLEDGE_BASE_DB_FILE
+    migrate_from_json(json_path, db_path)
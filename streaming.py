@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from config import config
+from send_queue import Priority, SendQueue, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingMessage:
+    def __init__(self, message: Message, interval: float = config.STREAM_EDIT_INTERVAL,
+                 outbox: Optional[SendQueue] = None):
+        self.message = message
+        self.interval = interval
+        self.outbox = outbox
+        self.shown_text = message.text
+        self.next_edit_at = 0.0
+
+    async def update(self, text: str) -> None:
+        if time.monotonic() < self.next_edit_at or not text.strip():
+            return
+        await self._edit(text)
+
+    async def finish(self, text: str) -> None:
+        if self.outbox is not None:
+            # Интервал выдерживает очередь, а недоставленную промежуточную правку она заменит этой.
+            await self._edit(text, Priority.ANSWER)
+            return
+
+        delay = max(0.0, self.next_edit_at - time.monotonic())
+        if delay:
+            await asyncio.sleep(delay)
+        if not await self._edit(text):
+            await asyncio.sleep(max(0.0, self.next_edit_at - time.monotonic()))
+            await self._edit(text)
+
+    async def _edit(self, text: str, priority: Priority = Priority.PLACEHOLDER) -> bool:
+        text = text[:config.TELEGRAM_MESSAGE_LIMIT]
+        if text == self.shown_text:
+            return True
+
+        self.next_edit_at = time.monotonic() + self.interval
+        try:
+            if self.outbox is None:
+                await self.message.edit_text(text)
+            elif priority == Priority.PLACEHOLDER:
+                # Промежуточные правки не ждём, чтобы не тормозить чтение потока от LLM.
+                self.outbox.edit(self.message, text, priority).add_done_callback(self._partial_sent(text))
+                return True
+            else:
+                await self.outbox.edit(self.message, text, priority)
+            self.shown_text = text
+            return True
+        except RetryAfter as e:
+            self.next_edit_at = time.monotonic() + retry_after_seconds(e)
+            logger.warning(f"Edit flood control, retry in {e.retry_after}")
+        except BadRequest as e:
+            logger.warning(f"Failed to edit streaming message: {e}")
+        return False
+
+    def _partial_sent(self, text: str):
+        def done(future: asyncio.Future):
+            if future.cancelled():
+                return
+            if future.exception() is None:
+                self.shown_text = text
+            else:
+                logger.warning(f"Failed to edit streaming message: {future.exception()}")
+        return done
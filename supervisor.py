@@ -0,0 +1,475 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+from config import BASE_DIR, config
+from resilience import backoff_delay
+from webhook import SECRET_HEADER, webhook_url
+
+logger = logging.getLogger(__name__)
+
+# Воркеры видят одно и то же состояние только через SQLite: база знаний, лимиты сообщений,
+# итоги оценок ответов и дисковый кэш LLM.
+SHARED_STATE_DEFAULTS = {
+    'KB_BACKEND': 'sqlite',
+    'RATE_LIMIT_BACKEND': 'sqlite',
+    'FEEDBACK_BACKEND': 'sqlite',
+    'LLM_CACHE_FILE': str(BASE_DIR / "llm_cache.db"),
+}
+CHAT_PATHS = ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'my_chat_member',
+              'chat_member', 'chat_join_request', 'message_reaction', 'business_message')
+USER_PATHS = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer')
+
+
+def update_partition_key(update: dict) -> int:
+    for kind in CHAT_PATHS:
+        if kind in update and 'chat' in update[kind]:
+            return update[kind]['chat']['id']
+    callback_query = update.get('callback_query')
+    if callback_query is not None:
+        message = callback_query.get('message')
+        return message['chat']['id'] if message else callback_query['from']['id']
+    for kind in USER_PATHS:
+        if kind in update:
+            sender = update[kind].get('from') or update[kind].get('user') or {}
+            if 'id' in sender:
+                return sender['id']
+    return update.get('update_id', 0)
+
+
+def worker_main(index: int, workers: int, conn) -> None:
+    # Отдельные порт метрик и журнал событий обратной связи на воркер (итоги оценок общие, в SQLite),
+    # общий лимит Telegram делим поровну.
+    config.METRICS_PORT += 1 + index
+    config.FEEDBACK_FILE = config.FEEDBACK_FILE.with_name(
+        f"{config.FEEDBACK_FILE.stem}.{index}{config.FEEDBACK_FILE.suffix}")
+    config.SEND_GLOBAL_RATE /= workers
+    config.SEND_GLOBAL_BURST = max(1, config.SEND_GLOBAL_BURST // workers)
+
+    from main import build_application
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    application = build_application()
+    asyncio.run(_serve(application, conn))
+
+
+async def _serve(application, conn) -> None:
+    from telegram import Update
+    from main import shutdown
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+
+    def receive():
+        while True:
+            try:
+                data = conn.recv()
+            except (EOFError, OSError):
+                data = None
+            if data is None:
+                loop.call_soon_threadsafe(stopping.set)
+                return
+            asyncio.run_coroutine_threadsafe(application.update_queue.put(Update.de_json(data, application.bot)), loop)
+
+    await application.initialize()
+    await application.start()
+    threading.Thread(target=receive, name='worker-receiver', daemon=True).start()
+    try:
+        # Пульс шлёт сам цикл событий: если он завис, супервизор это заметит и перезапустит воркер.
+        while not stopping.is_set():
+            conn.send(('heartbeat', {
+                'queued': application.update_queue.qsize(),
+                'processing': application.update_processor.current_concurrent_updates,
+            }))
+            try:
+                await asyncio.wait_for(stopping.wait(), config.WORKER_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        # stop() дорабатывает уже принятые обновления.
+        await application.stop()
+        await shutdown(application)
+        await application.shutdown()
+
+
+class WorkerHandle:
+    def __init__(self, index: int, workers: int, context, target=worker_main):
+        self.index = index
+        self.workers = workers
+        self.context = context
+        self.target = target
+        self.process = None
+        self.conn = None
+        self.started_at = 0.0
+        self.last_heartbeat = 0.0
+        self.stats = {}
+        self.restarts = 0
+        self.failures = 0
+        self.next_start_at = 0.0
+
+        # Обновления копятся здесь, пока воркер перезапускается, и уходят в прежнем порядке.
+        self._pending: deque = deque()
+        self._ready = False
+        self._cond = threading.Condition()
+        threading.Thread(target=self._forward, name=f'forward-{index}', daemon=True).start()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def healthy(self) -> bool:
+        return (self.process is not None and self.process.is_alive()
+                and time.monotonic() - self.last_heartbeat < config.WORKER_HEARTBEAT_TIMEOUT)
+
+    def start(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=self.target, args=(self.index, self.workers, child_conn), name=f'bot-worker-{self.index}')
+        self.process.start()
+        child_conn.close()
+
+        self.started_at = self.last_heartbeat = time.monotonic()
+        self.stats = {}
+        threading.Thread(target=self._receive, args=(parent_conn,), name=f'heartbeat-{self.index}',
+                         daemon=True).start()
+        with self._cond:
+            self.conn = parent_conn
+            self._ready = True
+            self._cond.notify()
+        logger.info(f"Worker {self.index} started, pid {self.process.pid}")
+
+    def stop(self, timeout: float):
+        self.request_stop()
+        self.wait_stopped(timeout)
+
+    def request_stop(self):
+        # None - сигнал остановки; он встаёт в очередь после уже принятых обновлений.
+        self.submit(None)
+
+    def wait_stopped(self, timeout: float):
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logger.warning(f"Worker {self.index} did not stop in {timeout}s, terminating")
+            self.process.terminate()
+            self.process.join(5)
+        self._detach()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(5)
+        self._detach()
+
+    def _detach(self):
+        with self._cond:
+            self._ready = False
+            # Сигнал остановки, не дошедший до упавшего воркера, новому не нужен.
+            if self._pending and self._pending[0] is None:
+                self._pending.popleft()
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def submit(self, update: Optional[dict]):
+        with self._cond:
+            self._pending.append(update)
+            self._cond.notify()
+
+    def _forward(self):
+        while True:
+            with self._cond:
+                while not (self._ready and self._pending):
+                    self._cond.wait()
+                update = self._pending[0]
+                conn = self.conn
+            try:
+                conn.send(update)
+            except (OSError, ValueError):
+                # Воркер упал; обновление остаётся первым в очереди до перезапуска.
+                with self._cond:
+                    self._ready = False
+                continue
+
+            with self._cond:
+                if self._pending and self._pending[0] is update:
+                    self._pending.popleft()
+                if update is None:
+                    self._ready = False
+
+    def _receive(self, conn):
+        while True:
+            try:
+                kind, payload = conn.recv()
+            except (EOFError, OSError):
+                return
+            if kind == 'heartbeat':
+                self.last_heartbeat = time.monotonic()
+                self.stats = payload
+                self.failures = 0
+
+    def status(self) -> dict:
+        return {
+            'index': self.index,
+            'pid': self.process.pid if self.process else None,
+            'healthy': self.healthy,
+            'heartbeat_age': round(time.monotonic() - self.last_heartbeat, 1),
+            'restarts': self.restarts,
+            'pending': self.pending,
+            **self.stats,
+        }
+
+
+class Supervisor:
+    def __init__(self, workers: int, target=worker_main):
+        # spawn, а не fork: соединения SQLite и потоки родителя в дочерний процесс переносить нельзя.
+        self.context = multiprocessing.get_context('spawn')
+        self.workers: List[WorkerHandle] = [
+            WorkerHandle(index, workers, self.context, target) for index in range(workers)
+        ]
+        self.stopping = threading.Event()
+        # Поток, принимающий обновления от Telegram; без него воркеры живы, но работы не получат.
+        self.router: Optional[threading.Thread] = None
+        self._restart_requested = False
+
+    def route(self, update: dict):
+        # Один чат всегда попадает в один воркер: порядок сообщений и состояние диалогов сохраняются.
+        self.workers[update_partition_key(update) % len(self.workers)].submit(update)
+
+    def healthy(self) -> bool:
+        return self.router_alive() and all(worker.healthy for worker in self.workers)
+
+    def router_alive(self) -> bool:
+        return self.router is not None and self.router.is_alive()
+
+    def status(self) -> dict:
+        return {
+            'healthy': self.healthy(),
+            'router': self.router_alive(),
+            'workers': [worker.status() for worker in self.workers],
+        }
+
+    def request_stop(self, *args):
+        self.stopping.set()
+
+    def request_restart(self, *args):
+        self._restart_requested = True
+
+    def run(self):
+        for worker in self.workers:
+            worker.start()
+
+        while not self.stopping.wait(1.0):
+            if self._restart_requested:
+                self._restart_requested = False
+                self.rolling_restart()
+            self._check_workers()
+
+        logger.info("Stopping workers...")
+        running = [worker for worker in self.workers if worker.process is not None]
+        for worker in running:
+            worker.request_stop()
+        for worker in running:
+            worker.wait_stopped(config.WORKER_STOP_TIMEOUT)
+
+    def rolling_restart(self):
+        # По одному, чтобы остальные воркеры продолжали отвечать.
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            logger.info(f"Restarting worker {worker.index}")
+            worker.stop(config.WORKER_STOP_TIMEOUT)
+            worker.restarts += 1
+            worker.start()
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is None:
+                if now >= worker.next_start_at:
+                    worker.start()
+                continue
+            if worker.healthy:
+                continue
+
+            if worker.process.is_alive():
+                logger.error(f"Worker {worker.index} missed heartbeats for {now - worker.last_heartbeat:.1f}s, killing")
+            else:
+                logger.error(f"Worker {worker.index} exited with code {worker.process.exitcode}")
+            worker.kill()
+            worker.process = None
+            worker.restarts += 1
+            worker.failures += 1
+            worker.next_start_at = now + backoff_delay(
+                worker.failures, config.WORKER_RESTART_BACKOFF, config.WORKER_RESTART_BACKOFF_MAX)
+
+
+def poll_updates(supervisor: Supervisor, stopping: threading.Event):
+    import httpx
+
+    api = f"https://api.telegram.org/bot{config.TELEGRAM_TOKEN}"
+    offset = None
+    attempt = 0
+    webhook_deleted = False
+    with httpx.Client(timeout=config.ROUTER_POLL_TIMEOUT + 10) as client:
+        while not stopping.is_set():
+            params = {'timeout': config.ROUTER_POLL_TIMEOUT}
+            if offset is not None:
+                params['offset'] = offset
+            try:
+                # getUpdates не работает, пока у бота установлен вебхук.
+                if not webhook_deleted:
+                    client.post(f"{api}/deleteWebhook").raise_for_status()
+                    webhook_deleted = True
+                data = client.get(f"{api}/getUpdates", params=params).json()
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"Telegram polling request failed: {e}")
+                attempt += 1
+                stopping.wait(backoff_delay(attempt, 1.0, 30.0))
+                continue
+            if not data.get('ok'):
+                logger.warning(f"getUpdates rejected: {data.get('description')}")
+                stopping.wait(data.get('parameters', {}).get('retry_after', 1))
+                continue
+
+            attempt = 0
+            for update in data['result']:
+                offset = update['update_id'] + 1
+                try:
+                    supervisor.route(update)
+                except Exception as e:
+                    logger.error(f"Failed to route update {update.get('update_id')}: {e}")
+
+        if offset is not None:
+            # Подтверждаем полученные обновления, чтобы после перезапуска Telegram не прислал их снова.
+            client.get(f"{api}/getUpdates", params={'offset': offset, 'timeout': 0})
+
+
+def start_http_server(supervisor: Supervisor, host: str, port: int, webhook: bool):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class RouterHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/healthz':
+                self.send_error(404)
+                return
+            healthy = supervisor.healthy()
+            self._reply(200 if healthy else 503, json.dumps(supervisor.status()).encode('utf-8'))
+
+        def do_POST(self):
+            if not webhook or self.path.split('?')[0].strip('/') != config.WEBHOOK_PATH.strip('/'):
+                self.send_error(404)
+                return
+            if config.WEBHOOK_SECRET and self.headers.get(SECRET_HEADER) != config.WEBHOOK_SECRET:
+                self.send_error(403)
+                return
+            try:
+                update = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                self.send_error(400)
+                return
+            supervisor.route(update)
+            self._reply(200, b'')
+
+        def _reply(self, status: int, body: bytes):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), RouterHandler)
+    thread = threading.Thread(target=server.serve_forever, name=f'router-http-{port}', daemon=True)
+    thread.start()
+    return server, thread
+
+
+def set_webhook():
+    import httpx
+
+    response = httpx.post(
+        f"https://api.telegram.org/bot{config.TELEGRAM_TOKEN}/setWebhook",
+        json={'url': webhook_url(), 'secret_token': config.WEBHOOK_SECRET,
+              'max_connections': config.WEBHOOK_MAX_CONNECTIONS},
+        timeout=30
+    )
+    if not response.json().get('ok'):
+        raise RuntimeError(f"setWebhook failed: {response.text}")
+
+
+def prepare_shared_state():
+    for name, value in SHARED_STATE_DEFAULTS.items():
+        if not os.environ.get(name):
+            os.environ[name] = value
+            setattr(config, name, value)
+    if config.KB_BACKEND != 'sqlite' or config.RATE_LIMIT_BACKEND != 'sqlite' or config.FEEDBACK_BACKEND != 'sqlite':
+        raise ValueError(
+            "Для нескольких воркеров нужны KB_BACKEND=sqlite, RATE_LIMIT_BACKEND=sqlite и FEEDBACK_BACKEND=sqlite")
+
+    # Перенос JSON в SQLite делаем один раз здесь, а не наперегонки в каждом воркере.
+    from knowledge_base import create_knowledge_base
+    create_knowledge_base().close()
+
+    from feedback_store import FeedbackStore, SqliteFeedbackAggregates
+    shared = SqliteFeedbackAggregates(config.FEEDBACK_DB_FILE)
+    try:
+        if not len(shared):
+            # Оценки, накопленные в однопроцессном режиме, переносим в общие итоги.
+            shared.add(FeedbackStore(config.FEEDBACK_FILE).aggregates)
+    finally:
+        shared.close()
+
+
+def run_supervisor(workers: int):
+    prepare_shared_state()
+    supervisor = Supervisor(workers)
+    signal.signal(signal.SIGTERM, supervisor.request_stop)
+    signal.signal(signal.SIGINT, supervisor.request_stop)
+    signal.signal(signal.SIGHUP, supervisor.request_restart)
+
+    webhook = config.BOT_MODE in ('webhook', 'webhook_local')
+    health_server, _ = start_http_server(supervisor, config.METRICS_HOST, config.METRICS_PORT, webhook=False)
+    servers = [health_server]
+    logger.info(f"Health check at http://{config.METRICS_HOST}:{config.METRICS_PORT}/healthz")
+    if webhook:
+        webhook_server, supervisor.router = start_http_server(
+            supervisor, config.WEBHOOK_LISTEN, config.WEBHOOK_PORT, webhook=True)
+        servers.append(webhook_server)
+        if config.BOT_MODE == 'webhook':
+            set_webhook()
+        logger.info(f"Routing webhook {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}/{config.WEBHOOK_PATH} "
+                    f"to {workers} workers")
+    else:
+        supervisor.router = threading.Thread(target=poll_updates, args=(supervisor, supervisor.stopping),
+                                             name='router-poll', daemon=True)
+        supervisor.router.start()
+        logger.info(f"Routing polled updates to {workers} workers")
+
+    try:
+        supervisor.run()
+    finally:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Run the bot as a supervisor routing updates to worker processes")
+    parser.add_argument('--workers', type=int, default=max(config.BOT_WORKERS, os.cpu_count() or 1))
+    args = parser.parse_args()
+    config.validate()
+    run_supervisor(args.workers)
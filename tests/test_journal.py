@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+
+import journal as journal_module
+from journal import Journal
+from knowledge_base import KnowledgeBase
+
+
+def _journal(tmp_path, fsync_batch=100, fsync_interval=10.0):
+    return Journal(tmp_path / 'kb.journal', fsync_batch=fsync_batch, fsync_interval=fsync_interval)
+
+
+def test_replay_reads_rotated_then_current(tmp_path):
+    journal = _journal(tmp_path)
+    journal.append({'q': 'вопрос 1', 'a': 'ответ 1'})
+    journal.rotate()
+    journal.append({'q': 'вопрос 2', 'a': 'ответ 2'})
+    journal.close()
+
+    reopened = _journal(tmp_path)
+    assert [record['q'] for record in reopened.replay()] == ['вопрос 1', 'вопрос 2']
+    assert reopened.records == 2
+
+
+def test_truncated_tail_is_skipped_and_not_glued_to_next_record(tmp_path):
+    path = tmp_path / 'kb.journal'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'q': 'целая', 'a': 'запись'}, ensure_ascii=False) + '\n')
+        # Процесс упал посреди записи: строка оборвана и без перевода строки.
+        f.write('{"q": "оборван')
+
+    journal = _journal(tmp_path)
+    assert [record['q'] for record in journal.replay()] == ['целая']
+
+    journal.append({'q': 'новая', 'a': 'запись'})
+    journal.close()
+    assert [record['q'] for record in _journal(tmp_path).replay()] == ['целая', 'новая']
+
+
+def test_fsync_runs_after_interval_off_the_caller(tmp_path, monkeypatch):
+    synced = []
+    fsync = journal_module.os.fsync
+
+    def record_fsync(fd):
+        synced.append(threading.current_thread().name)
+        fsync(fd)
+
+    monkeypatch.setattr(journal_module.os, 'fsync', record_fsync)
+    journal = _journal(tmp_path, fsync_batch=100, fsync_interval=0.05)
+    journal.append({'q': 'вопрос', 'a': 'ответ'})
+    # Следующей записи нет, но данные всё равно уходят на диск по таймеру.
+    assert not synced
+    deadline = time.monotonic() + 2
+    while not synced and time.monotonic() < deadline:
+        time.sleep(0.01)
+    journal.close()
+
+    assert synced[0] == 'journal-sync'
+
+
+def test_fsync_batch_wakes_sync_thread(tmp_path, monkeypatch):
+    synced = threading.Event()
+    monkeypatch.setattr(journal_module.os, 'fsync', lambda fd: synced.set())
+    journal = _journal(tmp_path, fsync_batch=3, fsync_interval=60.0)
+    for i in range(3):
+        journal.append({'q': f'вопрос {i}', 'a': 'ответ'})
+
+    assert synced.wait(2)
+    journal.close()
+
+
+def test_compaction_folds_journal_into_snapshot(tmp_path):
+    path = tmp_path / 'kb.json'
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({}, f)
+    knowledge_base = KnowledgeBase(path)
+    knowledge_base.add_question_answer("как работает мониторинг", "Мониторинг анализирует события")
+    knowledge_base.compact()
+    knowledge_base.close()
+
+    assert not knowledge_base.journal.path.exists()
+    assert not knowledge_base.journal.rotated_path.exists()
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {"Мониторинг анализирует события": ["как работает мониторинг"]}
+
+    reopened = KnowledgeBase(path)
+    assert reopened.find_answer("как работает мониторинг")[0] == "Мониторинг анализирует события"
+    reopened.close()
+
+
+def test_interrupted_compaction_is_replayed(tmp_path):
+    path = tmp_path / 'kb.json'
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({}, f)
+    knowledge_base = KnowledgeBase(path)
+    knowledge_base.add_question_answer("что такое DLP", "Система предотвращения утечек")
+    # Журнал переименован, а снимок так и не записан.
+    knowledge_base.journal.rotate()
+    knowledge_base.close()
+
+    reopened = KnowledgeBase(path)
+    assert reopened.find_answer("что такое DLP")[0] == "Система предотвращения утечек"
+    reopened.close()
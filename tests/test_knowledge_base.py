@@ -0,0 +1,183 @@
+import json
+import os
+import pickle
+import random
+
+import pytest
+
+from config import config
+from cow_collections import CHUNK_SIZE, ChunkedList, ShardedDict
+from knowledge_base import KnowledgeBase
+from search_index import RERANK_CANDIDATES, SearchIndex, bm25_idf
+from text_processing import tokenize
+
+
+@pytest.fixture
+def knowledge_base(tmp_path):
+    path = tmp_path / 'kb.json'
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"Используйте DLP-систему": ["как предотвратить утечку данных"]}, f, ensure_ascii=False)
+    knowledge_base = KnowledgeBase(path)
+    yield knowledge_base
+    knowledge_base.close()
+
+
+def _rewrite(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    # mtime в тестах может не успеть смениться; сдвигаем явно, чтобы отметка файла точно поменялась.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_index_copy_on_write():
+    index = SearchIndex()
+    index.add("анализ угроз")
+    published = index.postings['анализ']
+
+    draft = index.copy()
+    draft.add("анализ рисков")
+    draft.add("анализ логов")
+
+    # Опубликованная версия не видит вставок в черновик.
+    assert index.postings['анализ'] is published
+    assert published == {0: 1}
+    assert 'рисков' not in index.postings and 'риск' not in index.postings
+    assert len(index) == 1
+
+    # Черновик копирует список документа один раз и дальше пишет в свою копию.
+    assert draft.postings['анализ'] is not published
+    assert sorted(draft.postings['анализ']) == [0, 1, 2]
+    assert draft.postings['угроз'] is index.postings['угроз']
+
+
+def test_pruned_top_scores_match_exhaustive():
+    words = ["мониторинг", "риск", "сотрудник", "анализ", "угроза", "журнал", "доступ", "политика"]
+    rng = random.Random(0)
+    index = SearchIndex()
+    for i in range(1500):
+        sampled = rng.sample(words, 3) + [rng.choice(words)]
+        index.add(f"как работает {' '.join(sampled)} {i}")
+
+    avg_length = index.total_length / len(index)
+    for query in ("риск сотрудник", "как работает мониторинг анализ", "журнал доступ политика"):
+        terms = sorted(set(tokenize(query)), key=lambda term: len(index.postings[term]))
+        idf = {term: bm25_idf(len(index.postings[term]), len(index)) for term in terms}
+        pruned = index._top_scores(terms, idf, avg_length)
+        exhaustive = index._accumulate(terms, idf, avg_length)
+
+        assert pruned is not None and len(pruned) < len(exhaustive)
+        best = sorted(exhaustive.values(), reverse=True)[:RERANK_CANDIDATES]
+        assert sorted(pruned.values(), reverse=True)[:RERANK_CANDIDATES] == pytest.approx(best)
+
+
+def test_chunked_list_copies_only_touched_chunk():
+    items = ChunkedList(range(3 * CHUNK_SIZE))
+    copy = items.copy()
+    copy[5] = -1
+    copy.append(-2)
+
+    assert items[5] == 5 and len(items) == 3 * CHUNK_SIZE
+    assert copy[5] == -1 and copy[-1] == -2
+    assert copy._chunks[0] is not items._chunks[0]
+    assert copy._chunks[1] is items._chunks[1]
+    assert list(reversed(copy))[:2] == [-2, 3 * CHUNK_SIZE - 1]
+
+
+def test_sharded_dict_copy_and_pickle():
+    data = ShardedDict((f"key {i}", i) for i in range(1000))
+    copy = data.copy()
+    copy["key 1"] = -1
+    assert copy.setdefault("new", 7) == 7
+    assert copy.setdefault("new", 8) == 7
+
+    assert data["key 1"] == 1 and "new" not in data and len(data) == 1000
+    assert copy["key 1"] == -1 and len(copy) == 1001
+    shared = sum(a is b for a, b in zip(data._shards, copy._shards))
+    assert shared >= len(data._shards) - 2
+
+    restored = pickle.loads(pickle.dumps(copy))
+    assert dict(restored.items()) == dict(copy.items())
+    assert restored.get("missing") is None
+
+
+def test_publish_shares_untouched_blocks(knowledge_base):
+    knowledge_base.add_question_answer("что такое DLP", "Система предотвращения утечек")
+    before = knowledge_base._version
+    knowledge_base.add_question_answer("как работает SIEM", "Собирает и коррелирует события")
+    after = knowledge_base._version
+
+    # Новая версия копирует только затронутые блоки, прежняя видит базу без новой пары.
+    assert after is not before
+    assert len(before.store) == 2 and len(after.store) == 3
+    assert before.store.answer_id("Собирает и коррелирует события") is None
+    shared = sum(a is b for a, b in zip(before.index.postings._shards, after.index.postings._shards))
+    assert shared >= len(before.index.postings._shards) - 4
+
+
+def test_admin_write_is_visible_immediately(knowledge_base, monkeypatch):
+    monkeypatch.setattr(config, 'KB_PUBLISH_DELAY', 60.0)
+    knowledge_base.add_question_answer("как настроить журнал событий", "Включите аудит входов")
+    assert knowledge_base.find_answer("как настроить журнал событий") == ("Включите аудит входов", 1.0)
+
+
+def test_batched_write_is_published_later(knowledge_base, monkeypatch):
+    monkeypatch.setattr(config, 'KB_PUBLISH_DELAY', 60.0)
+    knowledge_base.add_question_answer("что такое SIEM", "Система управления событиями", batched=True)
+    assert knowledge_base.find_answer("что такое SIEM")[0] is None
+
+    knowledge_base._publish()
+    assert knowledge_base.find_answer("что такое SIEM")[0] == "Система управления событиями"
+
+
+def test_journal_replay_on_restart(tmp_path, knowledge_base):
+    knowledge_base.add_question_answer("как защитить аккаунт", "Включите двухфакторную аутентификацию")
+    knowledge_base.close()
+
+    restarted = KnowledgeBase(tmp_path / 'kb.json')
+    try:
+        assert restarted.find_answer("как защитить аккаунт")[0] == "Включите двухфакторную аутентификацию"
+        assert len(restarted) == 2
+    finally:
+        restarted.close()
+
+
+def test_reload_keeps_journal_records(tmp_path, knowledge_base):
+    knowledge_base.add_question_answer("как защитить аккаунт", "Включите двухфакторную аутентификацию")
+    old_version = knowledge_base._version
+
+    _rewrite(tmp_path / 'kb.json', {
+        "Используйте DLP-систему": ["как предотвратить утечку данных"],
+        "Проверяйте права доступа": ["как найти лишние права"],
+    })
+    assert knowledge_base.reload_if_changed()
+
+    # Новая версия собрана из файла и журнала, а прежняя осталась нетронутой для тех, кто её ещё читает.
+    assert knowledge_base.find_answer("как найти лишние права")[0] == "Проверяйте права доступа"
+    assert knowledge_base.find_answer("как защитить аккаунт")[0] == "Включите двухфакторную аутентификацию"
+    assert len(knowledge_base) == 3
+    assert len(old_version.store) == 2
+    assert not knowledge_base.reload_if_changed()
+
+
+def test_near_duplicate_index_is_built_on_first_merge(tmp_path, knowledge_base, monkeypatch):
+    monkeypatch.setattr(config, 'KB_BINARY_SNAPSHOT', True)
+    answer = "Настройте DLP-систему на контроль почты, облачных хранилищ и съёмных носителей"
+    knowledge_base.add_question_answer("как контролировать утечки", answer)
+    assert knowledge_base.near_duplicates is None
+
+    similar = "Настройте DLP-систему на контроль почты, облачных хранилищ и съёмных носителей."
+    knowledge_base.add_question_answer("как остановить утечку", similar + " Проверьте политики", merge_similar=True)
+    assert knowledge_base.near_duplicates is not None
+    assert len(knowledge_base.near_duplicates) == len(knowledge_base)
+    assert knowledge_base.find_answer("как остановить утечку")[0] == answer
+
+    # После сжатия сигнатуры лежат в снимке, и следующая загрузка получает индекс без пересчёта.
+    knowledge_base.compact()
+    knowledge_base.close()
+    restarted = KnowledgeBase(tmp_path / 'kb.json')
+    try:
+        assert restarted.near_duplicates is not None
+        assert len(restarted.near_duplicates) == len(restarted)
+    finally:
+        restarted.close()
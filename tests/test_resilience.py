@@ -0,0 +1,182 @@
+import asyncio
+import time
+
+import pytest
+
+from config import config
+from resilience import CircuitBreaker
+from yandex_gpt import YandexGPT
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(failure_threshold=3, recovery_timeout=30.0, clock=clock)
+
+
+@pytest.fixture
+def gpt(monkeypatch):
+    monkeypatch.setattr(config, 'YANDEX_GPT_BACKOFF_BASE', 0.001)
+    monkeypatch.setattr(config, 'YANDEX_GPT_BACKOFF_MAX', 0.001)
+    monkeypatch.setattr(config, 'YANDEX_GPT_HEDGE', False)
+    return YandexGPT()
+
+
+def test_breaker_opens_after_threshold(breaker):
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open
+    assert not breaker.allow_request()
+
+
+def test_success_resets_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_probe_through(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 30.0
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.is_open
+    assert breaker.allow_request()
+    # Пока проба не вернулась, остальные запросы не проходят.
+    assert breaker.is_open
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_failed_probe_reopens_for_full_timeout(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 30.0
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now = 59.0
+    assert not breaker.allow_request()
+    clock.now = 60.0
+    assert breaker.allow_request()
+
+
+def test_released_probe_can_be_retried(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 30.0
+    assert breaker.allow_request()
+
+    breaker.release_probe()
+    assert breaker.allow_request()
+
+
+def test_retries_stop_after_max_retries(gpt, monkeypatch):
+    monkeypatch.setattr(config, 'YANDEX_GPT_MAX_RETRIES', 2)
+    posts = []
+
+    async def post(request):
+        posts.append(request)
+        return None, 0.0
+
+    monkeypatch.setattr(gpt, '_post', post)
+    assert asyncio.run(gpt.ask("вопрос")) is None
+    assert len(posts) == 3
+    assert gpt.breaker.failures == 3
+
+
+def test_retries_stop_at_deadline(gpt, monkeypatch):
+    monkeypatch.setattr(config, 'YANDEX_GPT_MAX_RETRIES', 100)
+    monkeypatch.setattr(config, 'YANDEX_GPT_DEADLINE', 0.2)
+    posts = []
+
+    async def post(request):
+        posts.append(request)
+        # Retry-After длиннее срока запроса: повтор не должен успеть начаться.
+        return None, 5.0
+
+    monkeypatch.setattr(gpt, '_post', post)
+    start = time.monotonic()
+    assert asyncio.run(gpt.ask("вопрос")) is None
+    assert time.monotonic() - start < 2.0
+    assert len(posts) == 1
+    # Ответ 429/5xx и сам таймаут засчитываются как две неудачи.
+    assert gpt.breaker.failures == 2
+
+
+def test_hedge_cancels_slow_request(gpt, monkeypatch):
+    monkeypatch.setattr(config, 'YANDEX_GPT_HEDGE', True)
+    for _ in range(gpt.latency.min_samples):
+        gpt.latency.observe(0.01)
+    cancelled = []
+    calls = []
+
+    async def post(request):
+        calls.append(request)
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append('first')
+                raise
+        return "ответ", None
+
+    monkeypatch.setattr(gpt, '_post', post)
+
+    async def scenario():
+        answer = await gpt.ask("вопрос")
+        await asyncio.sleep(0)
+        return answer
+
+    assert asyncio.run(scenario()) == "ответ"
+    assert len(calls) == 2
+    assert cancelled == ['first']
+
+
+def test_deadline_cancels_both_hedged_requests(gpt, monkeypatch):
+    monkeypatch.setattr(config, 'YANDEX_GPT_HEDGE', True)
+    monkeypatch.setattr(config, 'YANDEX_GPT_DEADLINE', 0.2)
+    for _ in range(gpt.latency.min_samples):
+        gpt.latency.observe(0.01)
+    cancelled = []
+
+    async def post(request):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(request)
+            raise
+        return "ответ", None
+
+    monkeypatch.setattr(gpt, '_post', post)
+
+    async def scenario():
+        answer = await gpt.ask("вопрос")
+        await asyncio.sleep(0)
+        return answer
+
+    assert asyncio.run(scenario()) is None
+    assert len(cancelled) == 2
@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from send_queue import Priority, SendQueue
+
+
+def _sender(log, name, result=None):
+    async def send():
+        log.append(name)
+        return result if result is not None else name
+    return send
+
+
+def test_priority_order():
+    async def scenario():
+        queue = SendQueue(global_rate=1000.0, chat_interval=0.001)
+        log = []
+        futures = [
+            queue.submit(1, Priority.PROMPT, _sender(log, 'prompt')),
+            queue.submit(2, Priority.PLACEHOLDER, _sender(log, 'placeholder')),
+            queue.submit(3, Priority.ANSWER, _sender(log, 'answer')),
+            queue.submit(4, Priority.INTERACTIVE, _sender(log, 'interactive')),
+        ]
+        await asyncio.gather(*futures)
+        await queue.close()
+        return log
+
+    assert asyncio.run(scenario()) == ['answer', 'interactive', 'placeholder', 'prompt']
+
+
+def test_edit_coalescing():
+    async def scenario():
+        queue = SendQueue(global_rate=1000.0, chat_interval=0.001)
+        log = []
+        # Все правки одного сообщения приходят до отправки: уходит только последняя, ждавшие получают её результат.
+        futures = [
+            queue.submit(1, Priority.PLACEHOLDER, _sender(log, f'edit {i}'), key=(1, 10))
+            for i in range(3)
+        ]
+        results = await asyncio.gather(*futures)
+        await queue.close()
+        return queue, log, results
+
+    queue, log, results = asyncio.run(scenario())
+    assert log == ['edit 2']
+    assert results == ['edit 2'] * 3
+    assert queue.coalesced == 2
+    assert queue.sent == 1
+
+
+def test_retry_after_parks_only_that_chat():
+    async def scenario():
+        queue = SendQueue(global_rate=1000.0, chat_interval=0.001)
+        log = []
+        attempts = []
+
+        async def flooded():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.1)
+            log.append('chat 1')
+            return 'chat 1'
+
+        first = queue.submit(1, Priority.ANSWER, flooded)
+        await asyncio.sleep(0.02)
+        # Пока чат 1 ждёт, другие чаты отправляются, а новое сообщение в чат 1 встаёт за повтором.
+        other = queue.submit(2, Priority.PROMPT, _sender(log, 'chat 2'))
+        later = queue.submit(1, Priority.PROMPT, _sender(log, 'chat 1 later'))
+        await asyncio.gather(first, other, later)
+        await queue.close()
+        return queue, log, attempts
+
+    queue, log, attempts = asyncio.run(scenario())
+    assert log == ['chat 2', 'chat 1', 'chat 1 later']
+    assert attempts[1] - attempts[0] >= 0.1
+    assert queue.retried == 1
+    assert queue.failed == 0
+
+
+def test_retry_after_gives_up_after_max_retries():
+    async def scenario():
+        queue = SendQueue(global_rate=1000.0, chat_interval=0.001, max_retries=1)
+
+        async def always_flooded():
+            raise RetryAfter(0.01)
+
+        future = queue.submit(1, Priority.ANSWER, always_flooded)
+        try:
+            await future
+        except RetryAfter:
+            pass
+        else:
+            raise AssertionError("expected RetryAfter")
+        await queue.close()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert queue.retried == 2
+    assert queue.failed == 1
+
+
+def test_chat_interval_does_not_hold_other_chats():
+    async def scenario():
+        queue = SendQueue(global_rate=1000.0, chat_interval=0.05)
+        log = []
+        busy = [queue.submit(1, Priority.ANSWER, _sender(log, f'chat 1 #{i}')) for i in range(6)]
+        other = queue.submit(2, Priority.PROMPT, _sender(log, 'chat 2'))
+        await asyncio.gather(other, *busy)
+        await queue.close()
+        return log
+
+    log = asyncio.run(scenario())
+    # Запас чата 1 кончается после SEND_CHAT_BURST сообщений, и сообщение чата 2 обгоняет остальные.
+    assert log.index('chat 2') < log.index('chat 1 #5')
+    assert [entry for entry in log if entry.startswith('chat 1')] == [f'chat 1 #{i}' for i in range(6)]
+
+
+def test_close_cancels_queued_and_parked():
+    async def scenario():
+        queue = SendQueue(global_rate=1000.0, chat_interval=10.0)
+        log = []
+        futures = [queue.submit(1, Priority.ANSWER, _sender(log, f'#{i}')) for i in range(5)]
+        await asyncio.sleep(0.05)
+        await queue.close()
+        return queue, log, futures
+
+    queue, log, futures = asyncio.run(scenario())
+    sent = len(log)
+    assert 0 < sent < 5
+    assert all(future.cancelled() for future in futures[sent:])
+    assert len(queue) == 0
+
+
+def test_dispatcher_survives_errors():
+    async def scenario():
+        queue = SendQueue(global_rate=1000.0, chat_interval=0.001)
+        next_job = queue._next_job
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            return next_job()
+
+        queue._next_job = flaky
+        log = []
+        result = await asyncio.wait_for(queue.submit(1, Priority.ANSWER, _sender(log, 'sent')), 5)
+        await queue.close()
+        return result
+
+    assert asyncio.run(scenario()) == 'sent'
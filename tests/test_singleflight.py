@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _slow(calls, result=None, error=None, delay=0.05):
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+    return func
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+        results = await asyncio.gather(
+            flight.do('key', _slow(calls, 'ответ')),
+            flight.do('key', _slow(calls, 'другой')),
+        )
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert results == [('ответ', False), ('ответ', True)]
+    assert len(calls) == 1
+    assert flight.coalesced == 1
+    assert len(flight) == 0
+
+
+def test_followers_see_leader_exception():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+        func = _slow(calls, error=ValueError('сбой'))
+        results = await asyncio.gather(
+            flight.do('key', func), flight.do('key', func), return_exceptions=True)
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert results[0] is results[1]
+    # Ошибка не залипает: следующий вызов выполняется заново.
+    assert len(flight) == 0
+
+
+def test_leader_cancelled_while_followers_wait():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+        leader = asyncio.ensure_future(flight.do('key', _slow(calls, 'ответ')))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do('key', _slow(calls, 'другой')))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        # Отмена ведущего не отменяет общий запрос, пока его ждут другие.
+        result = await follower
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return flight, calls, result
+
+    flight, calls, result = asyncio.run(scenario())
+    assert result == ('ответ', True)
+    assert len(calls) == 1
+    assert len(flight) == 0
+
+
+def test_last_waiter_cancel_cancels_call():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = []
+
+        async def func():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        waiters = [asyncio.ensure_future(flight.do('key', func)) for _ in range(2)]
+        await started.wait()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        return flight, cancelled
+
+    flight, cancelled = asyncio.run(scenario())
+    assert cancelled == [True]
+    assert len(flight) == 0
@@ -0,0 +1,50 @@
+import pytest
+
+from topic_filter import TopicMatcher
+
+KEYWORDS = [
+    "мониторинг", "активность", "безопасность", "риск", "сотрудник",
+    "анализ", "NLP", "угроза", "информация", "конфиденциальность"
+]
+
+
+@pytest.fixture
+def matcher():
+    return TopicMatcher(KEYWORDS)
+
+
+# Основа ключевого слова в начале токена с любым окончанием.
+@pytest.mark.parametrize('text, topic', [
+    ("анализировать", "анализ"),
+    ("мониторинговые", "мониторинг"),
+    ("рискованный", "риск"),
+    ("Оценка рисков", "риск"),
+    ("Мониторинг сотрудников", "сотрудник"),
+])
+def test_matches_keyword_stems(matcher, text, topic):
+    match = matcher.match(text)
+    assert match
+    assert topic in match.topics
+
+
+def test_rejects_off_topic(matcher):
+    assert not matcher.match("Как приготовить борщ?")
+    assert not matcher.match("")
+
+
+# Основа внутри чужого слова не делает вопрос тематическим.
+@pytest.mark.parametrize('text', ["радиоактивный распад", "кибербезопасность"])
+def test_stem_inside_token_does_not_match(matcher, text):
+    assert not matcher.match(text)
+
+
+def test_score_is_share_of_matched_tokens(matcher):
+    match = matcher.match("оценка рисков безопасности")
+    assert match.topics == ["риск", "безопасность"]
+    assert match.score == pytest.approx(2 / 3)
+
+
+def test_multi_word_phrase():
+    matcher = TopicMatcher(["анализ угроз"])
+    assert matcher.match("анализ угрозы утечки").topics == ["анализ угроз"]
+    assert not matcher.match("угрозы и анализ")
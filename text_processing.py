@@ -0,0 +1,49 @@
+import re
+from functools import lru_cache
+from typing import List
+
+TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+VOWELS = set("аеиоуыэюя")
+
+STOP_WORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до его ее ей ему если есть
+еще же за здесь и из или им их к как ко когда кто ли либо между меня мне может мы на над надо наш не него нее нет ни
+них но ну о об однако он она они оно от очень по под при про с со так также такой там те тем то того тоже той только
+том ты у уже хотя чего чей чем что чтобы чье чья эта эти это этого этой этом этот я
+""".split())
+
+ENDINGS = sorted(set("""
+ость ости остью остей остям остями остях
+иями ями ами иях ях ием ией иям ям ем ам ом ах ев ов ей ой ий ый ие ье ии ию ью ия ья ые ое ая яя ую юю ою ею
+ими ыми его ого ему ому их ых им ым ее ет ют ят ит ат ешь ишь ете ите или ыли ила ыла ило ыло ить ыть ать ять ла ли ло
+а е и о у ы ь ю я
+""".split()), key=len, reverse=True)
+
+REFLEXIVE_ENDINGS = ("ся", "сь")
+MIN_STEM_LENGTH = 3
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(TOKEN_RE.findall(text.lower().replace("ё", "е")))
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    if not ("а" <= word[0] <= "я"):
+        return word
+
+    rv_start = next((i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+
+    for ending in REFLEXIVE_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= max(rv_start, MIN_STEM_LENGTH):
+            word = word[:-len(ending)]
+            break
+
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= max(rv_start, MIN_STEM_LENGTH):
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(token) for token in normalize_text(text).split() if token not in STOP_WORDS]
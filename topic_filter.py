@@ -0,0 +1,63 @@
+import re
+from bisect import bisect_right
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from text_processing import normalize_text, stem
+
+TOKEN_SPLIT_RE = re.compile(r'\S+')
+
+
+class TopicMatch(NamedTuple):
+    topics: List[str]
+    score: float
+
+    def __bool__(self) -> bool:
+        return bool(self.topics)
+
+
+def _stems(text: str) -> Tuple[str, ...]:
+    return tuple(stem(token) for token in normalize_text(text).split())
+
+
+class TopicMatcher:
+    def __init__(self, keywords: Sequence[str]):
+        self.keywords = keywords
+        self.keyword_count = len(keywords)
+
+        phrases: Dict[Tuple[str, ...], str] = {}
+        for keyword in keywords:
+            phrase = _stems(keyword)
+            if phrase:
+                phrases.setdefault(phrase, keyword)
+
+        # Одна регулярка на все ключевые фразы: основа слова совпадает с началом токена, так что окончание
+        # не мешает ("мониторинговые"), а основа внутри чужого слова не считается ("радиоактивный").
+        # Длинные фразы идут первыми, чтобы выигрывать у своих же одиночных слов.
+        self._keywords: List[str] = []
+        alternatives = []
+        for phrase, keyword in sorted(phrases.items(), key=lambda item: -len(item[0])):
+            alternatives.append(rf"(?P<k{len(self._keywords)}>(?<!\w)" + r"\w*\s+".join(map(re.escape, phrase)) + ")")
+            self._keywords.append(keyword)
+        self._pattern = re.compile("|".join(alternatives)) if alternatives else None
+
+    def is_stale(self, keywords: Sequence[str]) -> bool:
+        return keywords is not self.keywords or len(keywords) != self.keyword_count
+
+    def match(self, text: str) -> TopicMatch:
+        normalized = normalize_text(text)
+        if not normalized or self._pattern is None:
+            return TopicMatch([], 0.0)
+
+        token_starts = [token.start() for token in TOKEN_SPLIT_RE.finditer(normalized)]
+
+        topics = []
+        matched_positions = set()
+        for found in self._pattern.finditer(normalized):
+            keyword = self._keywords[int(found.lastgroup[1:])]
+            if keyword not in topics:
+                topics.append(keyword)
+            first = bisect_right(token_starts, found.start()) - 1
+            last = bisect_right(token_starts, found.end() - 1) - 1
+            matched_positions.update(range(first, last + 1))
+
+        return TopicMatch(topics, len(matched_positions) / len(token_starts))
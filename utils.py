@@ -1,39 +1,26 @@
-import time
-from typing import Dict
-from textblob import TextBlob
-from textblob.exceptions import NotTranslated
-
 from config import config
+from rate_limiter import create_rate_limiter
+from sentiment import analyze_sentiment
+from topic_filter import TopicMatch, TopicMatcher
 
-user_last_message_time: Dict[int, float] = {}
+rate_limiter = create_rate_limiter()
+topic_matcher = TopicMatcher(config.TOPIC_KEYWORDS)
 
 
 def check_message_limit(user_id: int) -> bool:
-    current_time = time.time()
-    last_message_time = user_last_message_time.get(user_id, 0)
+    return rate_limiter.allow(user_id)
 
-    if current_time - last_message_time < config.MESSAGE_LIMIT_SECONDS:
-        return False
 
-    user_last_message_time[user_id] = current_time
-    return True
+def get_topic_matcher() -> TopicMatcher:
+    global topic_matcher
+    if topic_matcher.is_stale(config.TOPIC_KEYWORDS):
+        topic_matcher = TopicMatcher(config.TOPIC_KEYWORDS)
+    return topic_matcher
 
 
-def analyze_sentiment(text: str) -> str:
-    try:
-        analysis = TextBlob(text)
-        if analysis.sentiment.polarity > 0.1:
-            return "positive"
-        elif analysis.sentiment.polarity < -0.1:
-            return "negative"
-        return "neutral"
-    except NotTranslated:
-        return "neutral"
-    except Exception as e:
-        print(f"Error analyzing sentiment: {e}")
-        return "neutral"
+def match_topics(question: str) -> TopicMatch:
+    return get_topic_matcher().match(question)
 
 
 def is_on_topic(question: str) -> bool:
-    question_lower = question.lower()
-    return any(keyword in question_lower for keyword in config.TOPIC_KEYWORDS)
+    return bool(match_topics(question))
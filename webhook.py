@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_url() -> str:
+    return f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}" if config.WEBHOOK_URL else None
+
+
+def run_webhook(application) -> None:
+    from telegram import Update
+
+    logger.info(f"Webhook listening on {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}/{config.WEBHOOK_PATH}")
+    # run_webhook проверяет секрет в заголовке и при остановке дорабатывает уже принятые обновления.
+    application.run_webhook(
+        listen=config.WEBHOOK_LISTEN,
+        port=config.WEBHOOK_PORT,
+        url_path=config.WEBHOOK_PATH,
+        secret_token=config.WEBHOOK_SECRET,
+        webhook_url=webhook_url(),
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+    )
+
+
+def run_local_webhook(application) -> None:
+    # Только слушатель, без setWebhook: для прогона записанных обновлений через replay_updates, не
+    # перенаправляя вебхук рабочего бота на эту машину.
+    asyncio.run(_serve_local(application))
+
+
+async def _serve_local(application) -> None:
+    from telegram import Update
+
+    loop = asyncio.get_running_loop()
+
+    def enqueue(data: dict):
+        loop.call_soon_threadsafe(application.update_queue.put_nowait, Update.de_json(data, application.bot))
+
+    try:
+        async with application:
+            if application.post_init is not None:
+                await application.post_init(application)
+            await application.start()
+            server = start_listener(config.WEBHOOK_LISTEN, config.WEBHOOK_PORT, enqueue)
+            logger.info(f"Local webhook listening on {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}/"
+                        f"{config.WEBHOOK_PATH}, setWebhook skipped")
+            try:
+                await asyncio.Event().wait()
+            finally:
+                server.shutdown()
+                await application.stop()
+    finally:
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
+
+
+def start_listener(host: str, port: int, on_update: Callable[[dict], None]):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.split('?')[0].strip('/') != config.WEBHOOK_PATH.strip('/'):
+                self.send_error(404)
+                return
+            if config.WEBHOOK_SECRET and self.headers.get(SECRET_HEADER) != config.WEBHOOK_SECRET:
+                self.send_error(403)
+                return
+            try:
+                update = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                self.send_error(400)
+                return
+            on_update(update)
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), WebhookHandler)
+    threading.Thread(target=server.serve_forever, name=f'webhook-http-{port}', daemon=True).start()
+    return server
+
+
+def replay_updates(path: Path, url: str, secret: str, delay: float = 0.0) -> int:
+    import httpx
+
+    sent = 0
+    with httpx.Client(headers={SECRET_HEADER: secret} if secret else {}) as client, \
+            open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            response = client.post(url, json=json.loads(line))
+            if response.status_code != 200:
+                logger.error(f"Update rejected: {response.status_code} {response.text}")
+            sent += 1
+            if delay:
+                time.sleep(delay)
+    return sent
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="POST recorded Telegram updates (JSON lines) to the webhook")
+    parser.add_argument('updates', type=Path)
+    parser.add_argument('--url', default=f"http://127.0.0.1:{config.WEBHOOK_PORT}/{config.WEBHOOK_PATH}")
+    parser.add_argument('--secret', default=config.WEBHOOK_SECRET)
+    parser.add_argument('--delay', type=float, default=0.0)
+    args = parser.parse_args()
+    print(f"Sent {replay_updates(args.updates, args.url, args.secret, args.delay)} updates", file=sys.stderr)
@@ -1,11 +1,19 @@
+import asyncio
+import json
 import logging
-import requests
-from typing import Optional
+import time
+import httpx
+from typing import Awaitable, Callable, Optional, Tuple
 
 from config import config
+from metrics import LLM_ERRORS, LLM_HEDGES
+from resilience import RETRYABLE_STATUSES, CircuitBreaker, LatencyTracker, backoff_delay
+from response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
+FINAL_STATUSES = ('ALTERNATIVE_STATUS_FINAL', 'ALTERNATIVE_STATUS_TRUNCATED_FINAL')
+
 
 class YandexGPT:
     def __init__(self):
@@ -14,53 +22,275 @@ class YandexGPT:
         self.url = config.YANDEX_GPT_URL
         self.system_prompt = config.SYSTEM_PROMPT
 
-    def ask(self, question: str) -> Optional[str]:
-        try:
-            headers = {
-                "Authorization": f"Api-Key {self.api_key}",
-                "Content-Type": "application/json"
-            }
-
-            data = {
-                "modelUri": f"gpt://{self.folder_id}/yandexgpt-lite",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.5,
-                    "maxTokens": 1000
-                },
-                "messages": [
-                    {
-                        "role": "system",
-                        "text": self.system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "text": question
-                    }
-                ]
-            }
-
-            response = requests.post(
-                self.url,
-                headers=headers,
-                json=data,
-                timeout=10
+        self.headers = {
+            "Authorization": f"Api-Key {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        self.model_uri = f"gpt://{self.folder_id}/yandexgpt-lite"
+        self.completion_options = {
+            "stream": False,
+            "temperature": config.YANDEX_GPT_TEMPERATURE,
+            "maxTokens": config.YANDEX_GPT_MAX_TOKENS
+        }
+        self.stream_completion_options = dict(self.completion_options, stream=True)
+        self.system_message = {
+            "role": "system",
+            "text": self.system_prompt
+        }
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self.cache = ResponseCache(
+            config.LLM_CACHE_SIZE,
+            config.LLM_CACHE_TTL,
+            disk_path=config.LLM_CACHE_FILE
+        )
+        self.breaker = CircuitBreaker(config.CIRCUIT_FAILURE_THRESHOLD, config.CIRCUIT_RECOVERY_TIMEOUT)
+        self.latency = LatencyTracker()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                http2=config.YANDEX_GPT_HTTP2,
+                limits=httpx.Limits(
+                    max_connections=config.YANDEX_GPT_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.YANDEX_GPT_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=config.YANDEX_GPT_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(
+                    config.YANDEX_GPT_TIMEOUT,
+                    connect=config.YANDEX_GPT_CONNECT_TIMEOUT,
+                    pool=config.YANDEX_GPT_POOL_TIMEOUT
+                )
             )
+        return self._client
 
-            if response.status_code == 200:
-                result = response.json()
-                return result['result']['alternatives'][0]['message']['text']
-            else:
-                logger.error(f"Yandex GPT API error: {response.status_code} - {response.text}")
-                print(response.text)
-                return None
+    def _build_request(self, question: str, stream: bool = False) -> dict:
+        return {
+            "modelUri": self.model_uri,
+            "completionOptions": self.stream_completion_options if stream else self.completion_options,
+            "messages": [
+                self.system_message,
+                {
+                    "role": "user",
+                    "text": question
+                }
+            ]
+        }
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request to Yandex GPT failed: {e}")
+    def _cache_key(self, question: str) -> str:
+        return ResponseCache.make_key(
+            question, self.model_uri, self.system_prompt, self.completion_options['temperature']
+        )
+
+    @property
+    def is_unavailable(self) -> bool:
+        return self.breaker.is_open
+
+    def cached(self, question: str) -> Optional[str]:
+        return self.cache.get(self._cache_key(question))
+
+    async def ask(self, question: str, use_cache: bool = True) -> Optional[str]:
+        cache_key = self._cache_key(question)
+        if use_cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        probing = self.breaker.state == CircuitBreaker.HALF_OPEN
+        if not self.breaker.allow_request():
+            LLM_ERRORS.labels('circuit_open').inc()
+            return None
+
+        try:
+            return await asyncio.wait_for(
+                self._ask_with_retries(self._build_request(question), cache_key),
+                config.YANDEX_GPT_DEADLINE
+            )
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            LLM_ERRORS.labels('deadline').inc()
+            logger.error(f"Yandex GPT request exceeded {config.YANDEX_GPT_DEADLINE}s deadline")
             return None
         except Exception as e:
+            self.breaker.record_failure()
+            LLM_ERRORS.labels('unexpected').inc()
             logger.error(f"Unexpected error in Yandex GPT: {e}")
             return None
+        finally:
+            # CancelledError не ловится выше; без этого отменённая проба навсегда оставила бы цепь открытой.
+            if probing:
+                self.breaker.release_probe()
+
+    async def ask_stream(self, question: str, on_partial: Callable[[str], Awaitable[None]],
+                         use_cache: bool = True) -> Optional[str]:
+        cache_key = self._cache_key(question)
+        if use_cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        probing = self.breaker.state == CircuitBreaker.HALF_OPEN
+        if not self.breaker.allow_request():
+            LLM_ERRORS.labels('circuit_open').inc()
+            return None
+
+        try:
+            return await asyncio.wait_for(
+                self._stream_with_retries(self._build_request(question, stream=True), cache_key, on_partial),
+                config.YANDEX_GPT_STREAM_DEADLINE
+            )
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            LLM_ERRORS.labels('deadline').inc()
+            logger.error(f"Yandex GPT stream exceeded {config.YANDEX_GPT_STREAM_DEADLINE}s deadline")
+            return None
+        except Exception as e:
+            self.breaker.record_failure()
+            LLM_ERRORS.labels('unexpected').inc()
+            logger.error(f"Unexpected error in Yandex GPT stream: {e}")
+            return None
+        finally:
+            if probing:
+                self.breaker.release_probe()
+
+    async def _ask_with_retries(self, request: dict, cache_key: str) -> Optional[str]:
+        for attempt in range(config.YANDEX_GPT_MAX_RETRIES + 1):
+            text, retry_after = await self._post_hedged(request)
+            if text is not None:
+                self.breaker.record_success()
+                self.cache.put(cache_key, text)
+                return text
+
+            if not await self._should_retry(attempt, retry_after):
+                return None
+        return None
+
+    async def _stream_with_retries(self, request: dict, cache_key: str,
+                                   on_partial: Callable[[str], Awaitable[None]]) -> Optional[str]:
+        for attempt in range(config.YANDEX_GPT_MAX_RETRIES + 1):
+            text, retry_after, started = await self._stream(request, on_partial)
+            if text is not None:
+                self.breaker.record_success()
+                self.cache.put(cache_key, text)
+                return text
+
+            # Пользователь уже видит часть ответа, повтор начал бы его заново.
+            if started:
+                self.breaker.record_failure()
+                return None
+            if not await self._should_retry(attempt, retry_after):
+                return None
+        return None
+
+    async def _should_retry(self, attempt: int, retry_after: Optional[float]) -> bool:
+        if retry_after is None:
+            # Ответ без повтора (например, 400) значит, что сервис доступен.
+            self.breaker.record_success()
+            return False
+
+        self.breaker.record_failure()
+        if attempt >= config.YANDEX_GPT_MAX_RETRIES or self.breaker.is_open:
+            return False
+
+        await asyncio.sleep(max(
+            retry_after,
+            backoff_delay(attempt, config.YANDEX_GPT_BACKOFF_BASE, config.YANDEX_GPT_BACKOFF_MAX)
+        ))
+        return True
+
+    async def _post_hedged(self, request: dict) -> Tuple[Optional[str], Optional[float]]:
+        hedge_after = self.latency.percentile(0.95) if config.YANDEX_GPT_HEDGE else None
+        tasks = [asyncio.ensure_future(self._post(request))]
+
+        try:
+            if hedge_after is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done:
+                    LLM_HEDGES.inc()
+                    tasks.append(asyncio.ensure_future(self._post(request)))
+
+            result = (None, None)
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result[0] is not None:
+                    return result
+            return result
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _post(self, request: dict) -> Tuple[Optional[str], Optional[float]]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(self.url, json=request)
+        except httpx.HTTPError as e:
+            LLM_ERRORS.labels(type(e).__name__).inc()
+            logger.error(f"Request to Yandex GPT failed: {e}")
+            return None, 0.0
+
+        if response.status_code == 200:
+            self.latency.observe(time.perf_counter() - start)
+            result = response.json()
+            return result['result']['alternatives'][0]['message']['text'], None
+
+        LLM_ERRORS.labels(response.status_code).inc()
+        logger.error(f"Yandex GPT API error: {response.status_code} - {response.text}")
+        return None, self._retry_after(response)
+
+    async def _stream(self, request: dict, on_partial: Callable[[str], Awaitable[None]]
+                      ) -> Tuple[Optional[str], Optional[float], bool]:
+        started = False
+        try:
+            async with self.client.stream("POST", self.url, json=request) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    LLM_ERRORS.labels(response.status_code).inc()
+                    logger.error(f"Yandex GPT API error: {response.status_code} - {response.text}")
+                    return None, self._retry_after(response), False
+
+                text = None
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+
+                    alternative = json.loads(line)['result']['alternatives'][0]
+                    text = alternative['message']['text']
+
+                    if alternative.get('status') in FINAL_STATUSES:
+                        return text, None, started
+                    started = True
+                    try:
+                        await on_partial(text)
+                    except Exception as e:
+                        # Ошибка показа частичного ответа (например, правки в Telegram) - не сбой LLM.
+                        logger.warning(f"Partial answer callback failed: {e}")
+
+                LLM_ERRORS.labels('incomplete_stream').inc()
+                logger.error(f"Yandex GPT stream ended without final alternative: {text!r:.100}")
+                return None, 0.0, started
+
+        except httpx.HTTPError as e:
+            LLM_ERRORS.labels(type(e).__name__).inc()
+            logger.error(f"Streaming request to Yandex GPT failed: {e}")
+            return None, 0.0, started
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Optional[float]:
+        if response.status_code not in RETRYABLE_STATUSES:
+            return None
+        try:
+            return min(float(response.headers.get('Retry-After', 0)), config.YANDEX_GPT_BACKOFF_MAX)
+        except ValueError:
+            return 0.0
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self.cache.close()
 
 
 yandex_gpt = YandexGPT()